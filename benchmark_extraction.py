@@ -0,0 +1,133 @@
+#!/usr/bin/python2.5
+"""Compare the Tidy and streaming extraction modes of html2text on an offline
+corpus of saved pages when run as a program.
+
+The only public function is benchmark_extraction, which behaves like the
+program.
+"""
+
+import sys, os, errno, time, difflib
+import html2text
+from utilities import check_num_arguments, open_safely
+
+NUM_ARGUMENTS = 2
+"""The expected number of arguments to this module when executed as a script.
+The path to this file is included in this count.
+"""
+
+PROGRAM_USAGE = "Usage: %s <corpus_directory>" % __file__
+# A description of how to run execute this program from the command-line.
+
+def _read_corpus(corpus_directory):
+    """Return a list of (file_name, html) tuples for the files in the given
+    directory, in order of file name.
+    """
+    corpus = []
+    for file_name in sorted(os.listdir(corpus_directory)):
+        file_path = os.path.join(corpus_directory, file_name)
+        if not os.path.isfile(file_path):
+            continue
+        input_stream = open_safely(file_path)
+        try:
+            corpus.append((file_name, input_stream.read()))
+        finally:
+            input_stream.close()
+    return corpus
+
+def _time_mode(mode, corpus):
+    """Return the text extracted from each page with the given mode and the
+    CPU seconds spent extracting it.
+    """
+    texts = []
+    cpu_times = []
+    for file_name, html in corpus:
+        start_time = time.clock()
+        texts.append(html2text.extractFromDocument(html, mode))
+        cpu_times.append(time.clock() - start_time)
+    return (texts, cpu_times)
+
+def _get_similarity(text1, text2):
+    """Return the similarity of the words in the given texts, from 0 to 1."""
+    return difflib.SequenceMatcher(None, text1.split(), text2.split()).ratio()
+
+def _print_cpu_times(description, page_nums, tidy_cpu_times,
+                     streaming_cpu_times):
+    """Print the mean CPU time per page of both modes on the given pages."""
+    if len(page_nums) == 0:
+        return
+    tidy_cpu_time = sum([tidy_cpu_times[page_num] for page_num in page_nums])
+    streaming_cpu_time = sum([streaming_cpu_times[page_num] for page_num in
+                              page_nums])
+    print("%s (%d pages):" % (description, len(page_nums)))
+    print("  Tidy:      %.2f ms of CPU per page" %
+          (1000 * tidy_cpu_time / len(page_nums)))
+    print("  Streaming: %.2f ms of CPU per page" %
+          (1000 * streaming_cpu_time / len(page_nums)))
+    print("  Speedup: %.1fx" % (tidy_cpu_time / max(streaming_cpu_time, 1e-9)))
+
+def benchmark_extraction(corpus_directory):
+    """Extract text from saved pages in both modes and compare the results.
+
+    Every file in the given directory is treated as a page.  Print the number
+    of pages from which each mode extracted text, how similar the words
+    extracted by the two modes are, and the CPU time per page of each mode,
+    both over all pages and over the pages that Tidy could convert.  Tidy
+    fails outright on some pages, so the second comparison is the fairer one.
+    Raise ImportError if the TidyLib wrapper isn't installed.
+
+    corpus_directory, a str, is the path to the directory of saved pages.
+    """
+    if html2text.tidy is None:
+        raise ImportError("The Python wrapper for TidyLib is needed to " +
+                          "compare the extraction modes.")
+    corpus = _read_corpus(corpus_directory)
+    if len(corpus) == 0:
+        raise ValueError("%s contains no pages." % corpus_directory)
+    tidy_texts, tidy_cpu_times = _time_mode(html2text.TIDY_MODE, corpus)
+    streaming_texts, streaming_cpu_times = \
+        _time_mode(html2text.STREAMING_MODE, corpus)
+
+    similarities = []
+    num_identical = 0
+    only_tidy_page_nums = []
+    only_streaming_page_nums = []
+    for page_num in range(len(corpus)):
+        tidy_text = tidy_texts[page_num]
+        streaming_text = streaming_texts[page_num]
+        if tidy_text and streaming_text:
+            similarities.append(_get_similarity(tidy_text, streaming_text))
+            if tidy_text == streaming_text:
+                num_identical += 1
+        elif tidy_text:
+            only_tidy_page_nums.append(page_num)
+        elif streaming_text:
+            only_streaming_page_nums.append(page_num)
+
+    print("Read %d pages." % len(corpus))
+    if len(similarities) > 0:
+        print(("Both modes extracted text from %d pages, %d identically.  " +
+               "Word similarity: mean %.3f, minimum %.3f.") %
+              (len(similarities), num_identical,
+               sum(similarities) / len(similarities), min(similarities)))
+    for description, page_nums in \
+            [("Only Tidy", only_tidy_page_nums),
+             ("Only streaming", only_streaming_page_nums)]:
+        if len(page_nums) > 0:
+            print("%s extracted text from %d pages: %s" %
+                  (description, len(page_nums),
+                   ", ".join([corpus[page_num][0] for page_num in
+                              page_nums])))
+    _print_cpu_times("All pages", range(len(corpus)), tidy_cpu_times,
+                     streaming_cpu_times)
+    _print_cpu_times("Pages that Tidy converted",
+                     [page_num for page_num in range(len(corpus)) if
+                      tidy_texts[page_num] != ""],
+                     tidy_cpu_times, streaming_cpu_times)
+
+if __name__ == "__main__":
+    check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
+    if not os.path.isdir(sys.argv[1]):
+        print >> sys.stderr, "Expected a directory but got %s." % sys.argv[1]
+        print >> sys.stderr, PROGRAM_USAGE
+        sys.exit(errno.ENOTDIR)
+    benchmark_extraction(sys.argv[1])
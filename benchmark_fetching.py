@@ -0,0 +1,193 @@
+#!/usr/bin/python2.5
+"""Compare fetching stories with urllib2 and with an HttpFetcher from local
+stand-in servers when run as a program.
+
+The only public function is benchmark_fetching, which behaves like the program.
+"""
+
+import sys, errno, time, socket, threading, urllib2, BaseHTTPServer, \
+    SocketServer
+from http_fetcher import HttpFetcher
+from utilities import check_num_arguments
+
+NUM_ARGUMENTS = 2
+"""The expected number of arguments to this module when executed as a script.
+The path to this file is included in this count.
+"""
+
+PROGRAM_USAGE = "Usage: %s <num_stories>" % __file__
+# A description of how to run execute this program from the command-line.
+
+NUM_HOSTS = 8
+"""The number of stand-in servers, each of which plays a publisher's host.
+Stories are spread across them round-robin.
+"""
+
+STORY_SIZE = 32 * 1024
+# The size in bytes of each story served.
+
+CONNECTION_DELAY = 0.02
+"""The number of seconds for which a stand-in server waits before serving the
+first request on a new connection, to play the round trips that setting up a
+connection to a remote host takes.
+"""
+
+DNS_LOOKUP_DELAY = 0.02
+"""The number of seconds added to each DNS lookup while the benchmark runs, to
+play a lookup that isn't answered from the local resolver's cache.
+"""
+
+class _StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves a generated story for every path over keep-alive connections."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        time.sleep(CONNECTION_DELAY)
+        # Send each part of a response at once, as real servers do, rather
+        # than waiting for the client to acknowledge the previous part.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        body = _generate_story(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local HTTP server that handles each connection in its own thread."""
+
+    daemon_threads = True
+
+def _generate_story(path):
+    """Return the HTML page served for the given path."""
+    paragraph = "<p>%s is a story about nothing in particular.</p>\n" % path
+    return "<html><body>%s</body></html>" % \
+        (paragraph * (STORY_SIZE // len(paragraph)))
+
+def _start_servers(num_servers):
+    """Start the given number of stand-in servers on free local ports and
+    return them.
+    """
+    servers = []
+    for server_num in range(num_servers):
+        server = _StandInServer(("127.0.0.1", 0), _StandInRequestHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        servers.append(server)
+    return servers
+
+def _fetch_with_urllib2(url):
+    """Return the body of the given URL, fetched with urllib2."""
+    stream = urllib2.urlopen(url)
+    try:
+        return stream.read()
+    finally:
+        stream.close()
+
+def _time_fetches(fetch_fn, urls):
+    """Return the bodies fetched with the function from the given URLs, in
+    order, and the seconds spent fetching each.
+    """
+    bodies = []
+    latencies = []
+    for url in urls:
+        start_time = time.time()
+        bodies.append(fetch_fn(url))
+        latencies.append(time.time() - start_time)
+    return (bodies, latencies)
+
+def _get_percentile(sorted_values, fraction):
+    """Return the value below which the given fraction of the sorted values
+    fall.
+    """
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(fraction * len(sorted_values)))]
+
+def _print_latencies(description, latencies):
+    """Print the median, 90th percentile, and total of the given latencies."""
+    sorted_latencies = sorted(latencies)
+    print("%s: median %.2f ms, 90th percentile %.2f ms, total %.2f s" %
+          (description, 1000 * _get_percentile(sorted_latencies, 0.5),
+           1000 * _get_percentile(sorted_latencies, 0.9), sum(latencies)))
+
+def benchmark_fetching(num_stories):
+    """Time fetching stories with urllib2 against an HttpFetcher.
+
+    Start NUM_HOSTS stand-in servers that wait CONNECTION_DELAY seconds before
+    serving each new connection, and slow every DNS lookup down by
+    DNS_LOOKUP_DELAY seconds.  Fetch the given number of stories spread across
+    the servers one after another, once with urllib2.urlopen and once with an
+    HttpFetcher, as fetch_story_contents does.  Print the latency per story of
+    each, the speedup of the median latency, and how often the HttpFetcher
+    reused connections and DNS lookups.  Raise AssertionError if the bodies
+    fetched differ.
+
+    num_stories, an int, is the number of stories to fetch with each client.
+    """
+    if not isinstance(num_stories, int):
+        raise TypeError("Expected num_stories to be of type int.")
+    if num_stories <= 0:
+        raise ValueError("num_stories is %d but must be positive." %
+                         num_stories)
+
+    servers = _start_servers(NUM_HOSTS)
+    urls = ["http://127.0.0.1:%d/story/%d" %
+            (servers[story_num % NUM_HOSTS].server_address[1], story_num) for
+            story_num in range(num_stories)]
+    getaddrinfo = socket.getaddrinfo
+    def slow_getaddrinfo(*args):
+        time.sleep(DNS_LOOKUP_DELAY)
+        return getaddrinfo(*args)
+    socket.getaddrinfo = slow_getaddrinfo
+    fetcher = HttpFetcher()
+    def fetch_with_fetcher(url):
+        stream = fetcher.urlopen(url)
+        try:
+            return stream.read()
+        finally:
+            stream.close()
+    try:
+        urllib2_bodies, urllib2_latencies = _time_fetches(_fetch_with_urllib2,
+                                                          urls)
+        fetcher_bodies, fetcher_latencies = _time_fetches(fetch_with_fetcher,
+                                                          urls)
+    finally:
+        socket.getaddrinfo = getaddrinfo
+        fetcher.close()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    if urllib2_bodies != fetcher_bodies:
+        raise AssertionError("urllib2 and the HttpFetcher fetched different " +
+                             "bodies.")
+
+    print(("Fetched %d stories of %d bytes from %d hosts with each client; " +
+           "both fetched the same bodies.") %
+          (num_stories, STORY_SIZE, NUM_HOSTS))
+    _print_latencies("urllib2", urllib2_latencies)
+    _print_latencies("HttpFetcher", fetcher_latencies)
+    print("Speedup of the median latency: %.1fx" %
+          (_get_percentile(sorted(urllib2_latencies), 0.5) /
+           max(_get_percentile(sorted(fetcher_latencies), 0.5), 1e-9)))
+    print(("The HttpFetcher opened %d connections, reused connections %d " +
+           "times, and looked up %d host names.") %
+          (fetcher.num_connections_opened, fetcher.num_connections_reused,
+           fetcher.dns_cache.num_misses))
+
+if __name__ == "__main__":
+    check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
+    try:
+        _num_stories = int(sys.argv[1])
+    except ValueError:
+        print >> sys.stderr, "Expected an integer but got %s." % sys.argv[1]
+        print >> sys.stderr, PROGRAM_USAGE
+        sys.exit(errno.EINVAL)
+    benchmark_fetching(_num_stories)
@@ -0,0 +1,497 @@
+#!/usr/bin/python2.5
+"""Time the pipelines with which process_data and fetch_story_contents fetch
+stories and extract their text, and the serial pipeline that they replaced,
+against local stand-in servers that inject faults, when run as a program.
+
+The only public function is benchmark_pipeline, which behaves like the program.
+"""
+
+import sys, os, errno, time, random, socket, threading, multiprocessing, \
+    BaseHTTPServer, SocketServer
+import html2text
+from fetch_pool import FetchPool, fetch_concurrently, interleave_hosts
+from http_fetcher import HostDown
+from process_data import MIN_STORY_LENGTH, NUM_FETCH_THREADS, \
+    NUM_FETCH_THREADS_PER_HOST, NUM_EXTRACTION_PROCESSES, \
+    MAX_STORY_PAGE_SIZE, open_http_fetcher, get_story_extractor
+from fetch_story_contents import REORDER_WINDOW, _get_pipeline_extract_fn
+from utilities import check_num_arguments, open_safely
+
+NUM_ARGUMENTS = 3
+"""The expected number of arguments to this module when executed as a script.
+The path to this file is included in this count.
+"""
+
+PROGRAM_USAGE = "Usage: %s <num_pages> <corpus_directory>" % __file__
+# A description of how to run execute this program from the command-line.
+
+GENERATED_CORPUS_SIZE = 100
+"""The number of news pages generated when the corpus directory doesn't exist.
+Pages are served round-robin, so the number of pages fetched may be larger.
+"""
+
+NUM_HOSTS = 8
+"""The number of stand-in servers, each of which plays a publisher's host.
+Pages are spread across them round-robin.
+"""
+
+LATENCY = 0.02
+"""The mean number of seconds for which a stand-in server waits before it
+responds, to play the round trips and server time of a remote host.  The wait
+for each page is drawn from an exponential distribution, so a few pages are
+much slower than the rest.
+"""
+
+SOCKET_TIMEOUT = 1
+"""The socket timeout while the benchmark runs, which plays
+process_data.TIMEOUT_LENGTH but is shorter so that stalled pages don't dominate
+the timings.
+"""
+
+STALL_TIME = 3 * SOCKET_TIMEOUT
+# The number of seconds for which a server stalls before responding to a page
+# that is meant to time out.
+
+OVERSIZED_BODY_SIZE = 4 * 1024 * 1024
+"""The size in bytes of the bodies of oversized pages, which is larger than
+process_data.MAX_STORY_PAGE_SIZE.  Half of them declare their size in a
+Content-Length header, and half are sent until the connection is closed.
+"""
+
+ERROR = "error"
+TIMEOUT = "timeout"
+OVERSIZED = "oversized"
+NOT_HTML = "not_html"
+FAULT_RATES = [(ERROR, 0.03), (TIMEOUT, 0.01), (OVERSIZED, 0.02),
+               (NOT_HTML, 0.02)]
+"""The faults that the stand-in servers inject and the fraction of the pages
+affected by each.  Erroneous pages have a 404 or 500 status, pages that time
+out stall for STALL_TIME seconds, oversized pages have bodies of
+OVERSIZED_BODY_SIZE bytes, and pages that aren't HTML are sent as PDFs.  Every
+fetch of the same page suffers the same fault, so each pipeline sees the same
+faults.
+"""
+
+_SYLLABLES = ["an", "ba", "con", "de", "el", "for", "gi", "ho", "in", "ja",
+              "ker", "lo", "man", "ne", "or", "pre", "qua", "ri", "sta", "tu",
+              "un", "ver", "wa", "ex", "yo", "zen"]
+# The syllables from which the words of generated pages are made.
+
+def _generate_words(rng, num_words):
+    """Return a str of the given number of words made up with rng."""
+    return " ".join(["".join([rng.choice(_SYLLABLES) for syllable_num in
+                              range(rng.randint(1, 3))]) for word_num in
+                     range(num_words)])
+
+def _generate_paragraph(rng):
+    """Return the text of a paragraph of a few sentences made up with rng."""
+    sentences = []
+    for sentence_num in range(rng.randint(3, 7)):
+        sentence = _generate_words(rng, rng.randint(8, 25))
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+    return " ".join(sentences)
+
+def _generate_links(rng, num_links):
+    """Return a list of links to made-up pages with short made-up titles."""
+    return "".join(['<li><a href="/%s.html">%s</a></li>' %
+                    (_generate_words(rng, 1), _generate_words(rng, 3)) for
+                    link_num in range(num_links)])
+
+def _generate_page(page_num):
+    """Return the generated news page with the given number as a UTF-8 str.
+
+    Like a real news page, it has a head with a style sheet and scripts,
+    navigation, an article of several paragraphs, a sidebar of related links,
+    reader comments, and a footer.  html2text gives up on text that isn't
+    ASCII, so only the comments and the footer have non-ASCII characters.
+    """
+    rng = random.Random(page_num)
+    parts = ["<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">",
+             "<title>%s</title>" % _generate_words(rng, 6),
+             "<style>body { font-family: serif; } .nav li { " +
+             "display: inline; }</style>",
+             "<script>var ads = []; for (var i = 0; i < 10; i++) { " +
+             "ads.push('<div class=\"ad\">' + i + '</div>'); }</script>",
+             "</head><body>",
+             '<div class="nav"><ul>%s</ul></div>' % _generate_links(rng, 20),
+             "<div class=\"article\"><h1>%s</h1>" % _generate_words(rng, 8),
+             "<p class=\"byline\">By %s &amp; %s</p>" %
+             (_generate_words(rng, 2), _generate_words(rng, 2))]
+    for paragraph_num in range(rng.randint(5, 25)):
+        parts.append("<p>%s</p>\n" % _generate_paragraph(rng))
+    parts.append("</div><div class=\"sidebar\"><h2>Related</h2><ul>%s</ul>" %
+                 _generate_links(rng, 10) + "</div>")
+    parts.append("<div class=\"comments\">")
+    for comment_num in range(rng.randint(0, 10)):
+        parts.append(("<div class=\"comment\"><b>%s</b><p>\xe2\x80\x9c%s" +
+                      "\xe2\x80\x9d</p></div>") %
+                     (_generate_words(rng, 1),
+                      _generate_words(rng, rng.randint(5, 40))))
+    parts.append("</div><div class=\"footer\">&copy; %s Caf\xc3\xa9 News" %
+                 _generate_words(rng, 2) + "</div>")
+    parts.append("<script>track('%d');</script></body></html>\n" % page_num)
+    return "".join(parts)
+
+def _write_corpus(corpus_directory):
+    """Write GENERATED_CORPUS_SIZE generated pages to a new directory."""
+    os.mkdir(corpus_directory)
+    for page_num in range(GENERATED_CORPUS_SIZE):
+        output_stream = open_safely(os.path.join(corpus_directory,
+                                                 "page_%04d.html" % page_num),
+                                    "w")
+        try:
+            output_stream.write(_generate_page(page_num))
+        finally:
+            output_stream.close()
+
+def _read_corpus(corpus_directory):
+    """Return a list of the contents of the files in the given directory, in
+    order of file name.
+    """
+    corpus = []
+    for file_name in sorted(os.listdir(corpus_directory)):
+        file_path = os.path.join(corpus_directory, file_name)
+        if not os.path.isfile(file_path):
+            continue
+        input_stream = open_safely(file_path)
+        try:
+            corpus.append(input_stream.read())
+        finally:
+            input_stream.close()
+    return corpus
+
+def _choose_fault(rng):
+    """Return one of the faults in FAULT_RATES, or None, drawn with rng."""
+    draw = rng.random()
+    for fault, rate in FAULT_RATES:
+        if draw < rate:
+            return fault
+        draw -= rate
+    return None
+
+class _StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the corpus over keep-alive connections with injected faults.
+
+    The path of each page is /page/<page_num>, and page page_num is the
+    corpus page at that index modulo the size of the corpus.  Each page is
+    delayed, and suffers a fault, as drawn from a random number generator
+    seeded with its number.
+    """
+
+    protocol_version = "HTTP/1.1"
+    corpus = []
+
+    def setup(self):
+        # Send each part of a response at once, as real servers do, rather
+        # than waiting for the client to acknowledge the previous part.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        try:
+            page_num = int(self.path.split("/")[-1])
+        except ValueError:
+            self._send_body(404, "text/html", "Not found")
+            return
+        rng = random.Random(page_num)
+        time.sleep(rng.expovariate(1.0 / LATENCY))
+        fault = _choose_fault(rng)
+        page = self.corpus[page_num % len(self.corpus)]
+        if fault == ERROR:
+            self._send_body(rng.choice([404, 500]), "text/html",
+                            "<html><body><p>Error</p></body></html>")
+        elif fault == TIMEOUT:
+            time.sleep(STALL_TIME)
+            self._send_body(200, "text/html", page)
+        elif fault == NOT_HTML:
+            self._send_body(200, "application/pdf", "%PDF-1.4\n" + page)
+        elif fault == OVERSIZED:
+            self._send_oversized_body(page, page_num % 2 == 0)
+        else:
+            self._send_body(200, "text/html", page)
+
+    def _send_body(self, status, content_type, body):
+        """Send a response with the given status, type, and body."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_oversized_body(self, page, has_content_length):
+        """Send the given page repeated to OVERSIZED_BODY_SIZE bytes, with
+        a Content-Length header or until the connection is closed.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        if has_content_length:
+            self.send_header("Content-Length", str(OVERSIZED_BODY_SIZE))
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = 1
+        self.end_headers()
+        block = (page * (64 * 1024 // len(page) + 1))[:64 * 1024]
+        num_bytes_sent = 0
+        while num_bytes_sent < OVERSIZED_BODY_SIZE:
+            block = block[:OVERSIZED_BODY_SIZE - num_bytes_sent]
+            self.wfile.write(block)
+            num_bytes_sent += len(block)
+
+    def log_message(self, format, *args):
+        pass
+
+class _StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local HTTP server that handles each connection in its own thread and
+    ignores clients that hang up early, as clients skipping pages do.
+    """
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+def _serve(servers):
+    """Serve requests to the given servers until the process is terminated."""
+    for server in servers[1:]:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+    servers[0].serve_forever()
+
+def _start_servers(corpus):
+    """Start NUM_HOSTS stand-in servers of the given corpus on free local
+    ports in a child process, so that serving doesn't count towards the CPU
+    time of the pipelines.  Return the process and the ports.
+    """
+    _StandInRequestHandler.corpus = corpus
+    servers = [_StandInServer(("127.0.0.1", 0), _StandInRequestHandler) for
+               server_num in range(NUM_HOSTS)]
+    process = multiprocessing.Process(target=_serve, args=(servers, ))
+    process.daemon = True
+    process.start()
+    ports = []
+    for server in servers:
+        ports.append(server.server_address[1])
+        server.server_close()
+    return (process, ports)
+
+def _get_cpu_time():
+    """Return the user and system CPU seconds used by this process and its
+    children that have exited.
+    """
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+def _time_calls(fn, latencies):
+    """Return a function that calls fn and appends the seconds that each call
+    took to latencies.  It may be called from several threads at once.  It
+    returns None for URLs that aren't requested because their hosts seem to be
+    down, as process_data and fetch_story_contents do.
+    """
+    def timed_fn(url):
+        start_time = time.time()
+        try:
+            return fn(url)
+        except HostDown:
+            return None
+        finally:
+            latencies.append(time.time() - start_time)
+    return timed_fn
+
+def _run_serially(urls, http_fetcher, latencies):
+    """Fetch and extract the given URLs one at a time, as fetch_story_contents
+    does when PIPELINE_STORIES is False, and return a dict from each URL to its
+    text.
+    """
+    extract_fn = _time_calls(get_story_extractor(http_fetcher), latencies)
+    texts = {}
+    for url in urls:
+        texts[url] = extract_fn(url)
+    return texts
+
+def _run_in_threads(urls, http_fetcher, latencies):
+    """Fetch and extract the given URLs in the fetch threads, as process_data
+    does when NUM_EXTRACTION_PROCESSES is 1, and return a dict from each URL
+    to its text.
+    """
+    return fetch_concurrently(urls, _time_calls(
+        get_story_extractor(http_fetcher), latencies), NUM_FETCH_THREADS,
+                              NUM_FETCH_THREADS_PER_HOST)
+
+def _run_with_pool(urls, http_fetcher, latencies):
+    """Download the given URLs in the fetch threads and extract them in a pool
+    of one process per CPU, as process_data does when NUM_EXTRACTION_PROCESSES
+    is greater than 1, and return a dict from each URL to its text.  The
+    latencies are those of the downloads alone.
+    """
+    download_fn = lambda url: html2text.downloadDocument(
+        url, http_fetcher.urlopen)
+    documents = fetch_concurrently(urls, _time_calls(download_fn, latencies),
+                                   NUM_FETCH_THREADS,
+                                   NUM_FETCH_THREADS_PER_HOST)
+    return dict(html2text.extractFromDocuments(
+        [(url, ) + documents[url] for url in urls]))
+
+def _run_pipelined(urls, http_fetcher, latencies):
+    """Fetch and extract the given URLs with a FetchPool that is given at most
+    REORDER_WINDOW URLs ahead of the first one whose text hasn't been returned
+    yet, as fetch_story_contents does when PIPELINE_STORIES is True, and return
+    a dict from each URL to its text.  Text is extracted in a pool of
+    NUM_EXTRACTION_PROCESSES processes if it is greater than 1, and in the fetch
+    threads otherwise.
+    """
+    extraction_pool = None
+    if NUM_EXTRACTION_PROCESSES > 1:
+        extraction_pool = multiprocessing.Pool(NUM_EXTRACTION_PROCESSES)
+    fetch_pool = FetchPool(_time_calls(_get_pipeline_extract_fn(
+        http_fetcher, extraction_pool), latencies), NUM_FETCH_THREADS,
+                           NUM_FETCH_THREADS_PER_HOST)
+    texts = {}
+    num_urls_submitted = 0
+    num_urls_done = 0
+    try:
+        while True:
+            while (num_urls_done < len(urls)) and \
+                    (urls[num_urls_done] in texts):
+                num_urls_done += 1
+            while (num_urls_submitted < len(urls)) and \
+                    (num_urls_submitted - num_urls_done < REORDER_WINDOW):
+                fetch_pool.submit(urls[num_urls_submitted])
+                num_urls_submitted += 1
+            if fetch_pool.num_outstanding() == 0:
+                break
+            url, text = fetch_pool.get_result()
+            texts[url] = text
+    finally:
+        fetch_pool.close()
+        if extraction_pool is not None:
+            extraction_pool.terminate()
+            extraction_pool.join()
+    return texts
+
+_PIPELINES = [("Serial, as fetch_story_contents without PIPELINE_STORIES",
+               _run_serially),
+              ("Fetch threads, as process_data", _run_in_threads),
+              ("Fetch threads and an extraction pool", _run_with_pool),
+              ("FetchPool and reorder window, as fetch_story_contents",
+               _run_pipelined)]
+# The pipelines compared, with descriptions.
+
+def _get_percentile(sorted_values, fraction):
+    """Return the value below which the given fraction of the sorted values
+    fall.
+    """
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(fraction * len(sorted_values)))]
+
+def _time_pipeline(description, run_fn, urls):
+    """Run the given pipeline on the given URLs with a new HttpFetcher, print
+    its throughput, latencies, and CPU time, and return its texts.
+    """
+    http_fetcher = open_http_fetcher()
+    latencies = []
+    start_cpu_time = _get_cpu_time()
+    start_time = time.time()
+    try:
+        texts = run_fn(urls, http_fetcher, latencies)
+    finally:
+        http_fetcher.close()
+    elapsed_time = time.time() - start_time
+    cpu_time = _get_cpu_time() - start_cpu_time
+    num_extracted = len([text for text in texts.itervalues() if
+                         (text is not None) and
+                         (len(text) >= MIN_STORY_LENGTH)])
+
+    sorted_latencies = sorted(latencies)
+    print("%s:" % description)
+    print("  %d pages in %.2f s: %.1f pages/s, %d extracted" %
+          (len(urls), elapsed_time, len(urls) / max(elapsed_time, 1e-9),
+           num_extracted))
+    print("  Latency: median %.1f ms, 90th percentile %.1f ms, 99th " %
+          (1000 * _get_percentile(sorted_latencies, 0.5),
+           1000 * _get_percentile(sorted_latencies, 0.9)) +
+          "percentile %.1f ms" % (1000 * _get_percentile(sorted_latencies,
+                                                         0.99)))
+    print("  CPU: %.2f ms per page" % (1000 * cpu_time / len(urls)))
+    print("  " + http_fetcher.get_skip_summary())
+    return texts
+
+def _time_extraction(corpus):
+    """Print the CPU time that extracting text from the corpus takes in
+    html2text.DEFAULT_EXTRACTION_MODE without any network I/O.
+    """
+    num_bytes = sum([len(page) for page in corpus])
+    start_time = time.clock()
+    for page in corpus:
+        html2text.extractFromDocument(page)
+    cpu_time = time.clock() - start_time
+    print(("Extraction alone in %s mode: %.2f ms of CPU per page, " +
+           "%.2f MB/s") % (html2text.DEFAULT_EXTRACTION_MODE,
+                           1000 * cpu_time / len(corpus),
+                           num_bytes / max(cpu_time, 1e-9) / 1e6))
+
+def benchmark_pipeline(num_pages, corpus_directory):
+    """Time the pipelines that fetch stories and extract their text.
+
+    If the given directory doesn't exist, then write GENERATED_CORPUS_SIZE
+    generated news pages to it first.  Otherwise, treat every file in it as a
+    saved page.  Serve the pages from NUM_HOSTS local stand-in servers that
+    delay each response by LATENCY seconds on average and inject the faults in
+    FAULT_RATES.  Print the CPU time of extraction alone, and then fetch and
+    extract the given number of pages spread across the servers with each of
+    the pipelines in _PIPELINES, using an HttpFetcher from
+    process_data.open_http_fetcher.  Print the pages per second, latency
+    percentiles, CPU time per page, and fetches skipped of each.  Raise
+    AssertionError if the pipelines extract different text.
+
+    num_pages, an int, is the number of pages to fetch with each pipeline.
+    corpus_directory, a str, is the path to the directory of pages.
+    """
+    if not isinstance(num_pages, int):
+        raise TypeError("Expected num_pages to be of type int.")
+    if num_pages <= 0:
+        raise ValueError("num_pages is %d but must be positive." % num_pages)
+
+    if not os.path.exists(corpus_directory):
+        _write_corpus(corpus_directory)
+        print("Generated %d pages in %s." % (GENERATED_CORPUS_SIZE,
+                                             corpus_directory))
+    corpus = _read_corpus(corpus_directory)
+    if len(corpus) == 0:
+        raise ValueError("%s contains no pages." % corpus_directory)
+    _time_extraction(corpus)
+
+    server_process, ports = _start_servers(corpus)
+    urls = interleave_hosts(["http://127.0.0.1:%d/page/%d" %
+                             (ports[page_num % NUM_HOSTS], page_num) for
+                             page_num in range(num_pages)])
+    default_timeout = socket.getdefaulttimeout()
+    socket.setdefaulttimeout(SOCKET_TIMEOUT)
+    try:
+        print(("Fetching %d pages from %d hosts with %d threads, at most %d " +
+               "per host, and pages of at most %d bytes:") %
+              (num_pages, NUM_HOSTS, NUM_FETCH_THREADS,
+               NUM_FETCH_THREADS_PER_HOST, MAX_STORY_PAGE_SIZE))
+        all_texts = [_time_pipeline(description, run_fn, urls) for
+                     description, run_fn in _PIPELINES]
+    finally:
+        socket.setdefaulttimeout(default_timeout)
+        server_process.terminate()
+        server_process.join()
+    for texts in all_texts[1:]:
+        num_differences = len([url for url in urls if
+                               texts[url] != all_texts[0][url]])
+        if num_differences > 0:
+            raise AssertionError(("The pipelines extracted different text " +
+                                  "from %d pages.") % num_differences)
+    print("Every pipeline extracted the same text.")
+
+if __name__ == "__main__":
+    check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
+    try:
+        _num_pages = int(sys.argv[1])
+    except ValueError:
+        print >> sys.stderr, "Expected an integer but got %s." % sys.argv[1]
+        print >> sys.stderr, PROGRAM_USAGE
+        sys.exit(errno.EINVAL)
+    benchmark_pipeline(_num_pages, sys.argv[2])
@@ -0,0 +1,154 @@
+#!/usr/bin/python2.5
+"""Compare looking up the stories of events in a story index and by their full
+keys when run as a program.
+
+The only public function is benchmark_story_index, which behaves like the
+program.
+"""
+
+import sys, errno, time, random
+from utilities import DELIMITER, check_num_arguments
+from process_data import EVENTS_USER_ID_INDEX, EVENTS_STORY_URL_INDEX, \
+    EVENTS_STORY_TITLE_INDEX, EVENTS_FEED_URL_INDEX, EVENTS_FEED_TITLE_INDEX, \
+    OLD_EVENTS_NUM_FIELDS, NEW_STORIES_FEED_URL_INDEX, \
+    NEW_STORIES_FEED_TITLE_INDEX, NEW_STORIES_URL_INDEX, \
+    NEW_STORIES_TITLE_INDEX, _build_story_index, _insert_event
+
+NUM_ARGUMENTS = 2
+"""The expected number of arguments to this module when executed as a script.
+The path to this file is included in this count.
+"""
+
+PROGRAM_USAGE = "Usage: %s <num_events>" % __file__
+# A description of how to run execute this program from the command-line.
+
+NUM_STORIES = 50000
+# The number of distinct stories that the generated events read.
+
+UNKNOWN_STORY_RATE = 0.05
+"""The fraction of the generated events that read a story that isn't in the
+index, and so are discarded.
+"""
+
+NUM_RUNS = 5
+"""The number of times that each lookup is timed.  The fastest run is reported,
+which is the least disturbed by other work on the machine.
+"""
+
+def _generate_text(length):
+    """Return a random str of the given length that resembles a URL or title."""
+    return "".join([random.choice("abcdefghijklmnopqrstuvwxyz/.- ") for \
+                    char_num in xrange(length)])
+
+def _generate_stories(num_stories):
+    """Return a list of the given number of random (feed_url, feed_title,
+    story_url, story_title) keys.
+    """
+    stories = []
+    for story_num in xrange(num_stories):
+        story_key = [None] * 4
+        story_key[NEW_STORIES_FEED_URL_INDEX] = "http://" + _generate_text(30)
+        story_key[NEW_STORIES_FEED_TITLE_INDEX] = _generate_text(20)
+        story_key[NEW_STORIES_URL_INDEX] = "http://" + _generate_text(70)
+        story_key[NEW_STORIES_TITLE_INDEX] = _generate_text(60)
+        stories.append(tuple(story_key))
+    return stories
+
+def _generate_event_rows(stories, num_events):
+    """Return a list of the given number of raw event rows without their
+    newlines, each of which reads one of the given stories or, at
+    UNKNOWN_STORY_RATE, an unknown one.
+    """
+    rows = []
+    for event_num in xrange(num_events):
+        if random.random() < UNKNOWN_STORY_RATE:
+            story_key = _generate_stories(1)[0]
+        else:
+            story_key = random.choice(stories)
+        row = [""] * OLD_EVENTS_NUM_FIELDS
+        row[EVENTS_USER_ID_INDEX] = "%038x" % random.getrandbits(152)
+        row[EVENTS_STORY_URL_INDEX] = story_key[NEW_STORIES_URL_INDEX]
+        row[EVENTS_STORY_TITLE_INDEX] = story_key[NEW_STORIES_TITLE_INDEX]
+        row[EVENTS_FEED_URL_INDEX] = story_key[NEW_STORIES_FEED_URL_INDEX]
+        row[EVENTS_FEED_TITLE_INDEX] = story_key[NEW_STORIES_FEED_TITLE_INDEX]
+        rows.append(DELIMITER.join(row))
+    return rows
+
+def _insert_event_by_key(event, time_occurred, stories_dict, events_set):
+    """Behave like _insert_event, but look up the story of the event by its
+    full key in a dict mapping from story keys to story IDs, as _insert_event
+    did before story indexes.
+    """
+    story_id = stories_dict.get((event[EVENTS_FEED_URL_INDEX],
+                                 event[EVENTS_FEED_TITLE_INDEX],
+                                 event[EVENTS_STORY_URL_INDEX],
+                                 event[EVENTS_STORY_TITLE_INDEX]))
+    if story_id is None:
+        return
+    events_set.add((event[EVENTS_USER_ID_INDEX], story_id, time_occurred))
+
+def _time_lookups(insert_event_fn, stories, rows):
+    """Return the events inserted by the given function for the given rows
+    and the fastest of NUM_RUNS times spent inserting them.
+
+    Split the rows again before each run, outside of the time measured, so
+    that every field is a fresh str, as it is while cleaning a raw log file.
+    """
+    best_time = None
+    for run_num in xrange(NUM_RUNS):
+        split_rows = [row.split(DELIMITER) for row in rows]
+        events_set = set()
+        start_time = time.time()
+        for split_row in split_rows:
+            insert_event_fn(split_row, 0, stories, events_set)
+        run_time = time.time() - start_time
+        if (best_time is None) or (run_time < best_time):
+            best_time = run_time
+    return (events_set, best_time)
+
+def benchmark_story_index(num_events):
+    """Time _insert_event with a story index against a lookup by full keys.
+
+    Generate NUM_STORIES stories and the given number of events that read
+    them, and print the time per event that each lookup takes and the speedup
+    of the story index.  Raise AssertionError if the two lookups insert
+    different events.
+
+    num_events, an int, is the number of events to look up.
+    """
+    if not isinstance(num_events, int):
+        raise TypeError("Expected num_events to be of type int.")
+    if num_events <= 0:
+        raise ValueError("num_events is %d but must be positive." % num_events)
+
+    random.seed(0)
+    stories = _generate_stories(NUM_STORIES)
+    rows = _generate_event_rows(stories, num_events)
+    stories_dict = dict([(story_key, story_id) for (story_id, story_key) in \
+                         enumerate(stories)])
+    key_events, key_time = _time_lookups(_insert_event_by_key, stories_dict,
+                                         rows)
+    index_events, index_time = _time_lookups(_insert_event,
+                                             _build_story_index(stories_dict),
+                                             rows)
+    if key_events != index_events:
+        raise AssertionError("The story index and the full keys found " +
+                             "different stories.")
+
+    print(("Looked up %d events of %d stories; both lookups inserted the " +
+           "same %d events.") % (num_events, NUM_STORIES, len(key_events)))
+    print("Full keys:   %.3f s (%.2f us per event)" %
+          (key_time, 1e6 * key_time / num_events))
+    print("Story index: %.3f s (%.2f us per event)" %
+          (index_time, 1e6 * index_time / num_events))
+    print("Speedup: %.2fx" % (key_time / max(index_time, 1e-9)))
+
+if __name__ == "__main__":
+    check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
+    try:
+        _num_events = int(sys.argv[1])
+    except ValueError:
+        print >> sys.stderr, "Expected an integer but got %s." % sys.argv[1]
+        print >> sys.stderr, PROGRAM_USAGE
+        sys.exit(errno.EINVAL)
+    benchmark_story_index(_num_events)
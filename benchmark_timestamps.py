@@ -0,0 +1,105 @@
+#!/usr/bin/python2.5
+"""Compare the fast and reference timestamp parsers when run as a program.
+
+The only public function is benchmark_timestamps, which behaves like the
+program.
+"""
+
+import sys, errno, time, random
+from utilities import check_num_arguments
+from process_data import EARLIEST_ACCEPTABLE_TIMESTAMP, \
+    LATEST_ACCEPTABLE_TIMESTAMP, TIMESTAMP_FORMAT, SECONDS_IN_DAY, \
+    _parse_timestamp, _parse_timestamp_slowly
+
+NUM_ARGUMENTS = 2
+"""The expected number of arguments to this module when executed as a script.
+The path to this file is included in this count.
+"""
+
+PROGRAM_USAGE = "Usage: %s <num_timestamps>" % __file__
+# A description of how to run execute this program from the command-line.
+
+MALFORMED_TIMESTAMPS = ["", "2011-08-01", "2011-8-01 12:00:00",
+                        "2011-08-01 24:00:00", "2011-08-01 12:60:00",
+                        "2011-02-30 12:00:00", "2011-08-01 -1:00:00",
+                        "2011-08-01T12:00:00", "2011-08-01 12:00:00 "]
+"""Timestamps that exercise the fallback and error paths of the parsers.  They
+are mixed into the generated timestamps at a low rate, as in the raw logs.
+"""
+
+def _generate_timestamps(num_timestamps):
+    """Return a list of the given number of raw timestamps.
+
+    Draw most timestamps uniformly from a window that extends one day to either
+    side of the acceptable window, so that some timestamps are rejected as
+    unrealistic.  Replace roughly one percent with MALFORMED_TIMESTAMPS.
+    """
+    random.seed(0)
+    timestamps = []
+    earliest = EARLIEST_ACCEPTABLE_TIMESTAMP - SECONDS_IN_DAY
+    latest = LATEST_ACCEPTABLE_TIMESTAMP + SECONDS_IN_DAY
+    for timestamp_num in xrange(num_timestamps):
+        if random.random() < 0.01:
+            timestamps.append(random.choice(MALFORMED_TIMESTAMPS))
+        else:
+            timestamp_as_struct = time.localtime(random.randint(earliest,
+                                                                latest))
+            timestamps.append(time.strftime(TIMESTAMP_FORMAT,
+                                            timestamp_as_struct))
+    return timestamps
+
+def _time_parser(parse_timestamp_fn, timestamps):
+    """Return the parsed timestamps and the seconds spent parsing them.
+
+    Represent malformed timestamps as ValueError in the returned list.
+    """
+    results = []
+    start_time = time.time()
+    for timestamp_as_str in timestamps:
+        try:
+            results.append(parse_timestamp_fn(timestamp_as_str))
+        except ValueError:
+            results.append(ValueError)
+    return (results, time.time() - start_time)
+
+def benchmark_timestamps(num_timestamps):
+    """Time _parse_timestamp against _parse_timestamp_slowly.
+
+    Print the throughput of both parsers and the speedup of the fast parser.
+    Raise AssertionError if the two parsers disagree on any timestamp.
+
+    num_timestamps, an int, is the number of raw timestamps to parse.
+    """
+    if not isinstance(num_timestamps, int):
+        raise TypeError("Expected num_timestamps to be of type int.")
+    if num_timestamps <= 0:
+        raise ValueError("num_timestamps is %d but must be positive." %
+                         num_timestamps)
+
+    timestamps = _generate_timestamps(num_timestamps)
+    slow_results, slow_time = _time_parser(_parse_timestamp_slowly, timestamps)
+    fast_results, fast_time = _time_parser(_parse_timestamp, timestamps)
+    for timestamp_as_str, slow_result, fast_result in \
+            zip(timestamps, slow_results, fast_results):
+        if slow_result != fast_result:
+            raise AssertionError(("Parsers disagree on %r: %r (strptime) " +
+                                  "versus %r (fast path).") % \
+                                  (timestamp_as_str, slow_result, fast_result))
+
+    print("Parsed %d timestamps; both parsers agree on every one." %
+          num_timestamps)
+    print("strptime/mktime: %.3f s (%d timestamps/s)" %
+          (slow_time, num_timestamps / max(slow_time, 1e-9)))
+    print("Fast path:       %.3f s (%d timestamps/s)" %
+          (fast_time, num_timestamps / max(fast_time, 1e-9)))
+    print("Speedup: %.1fx" % (slow_time / max(fast_time, 1e-9)))
+
+if __name__ == "__main__":
+    check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
+    try:
+        _num_timestamps = int(sys.argv[1])
+    except ValueError:
+        print >> sys.stderr, "Expected an integer but got %s." % sys.argv[1]
+        print >> sys.stderr, PROGRAM_USAGE
+        sys.exit(errno.EINVAL)
+    benchmark_timestamps(_num_timestamps)
@@ -0,0 +1,175 @@
+#!/usr/bin/python2.5
+"""Compare the block TSV reader and writer with line-by-line loops when run as a
+program.
+
+The only public function is benchmark_tsv, which behaves like the program.
+"""
+
+import sys, os, errno, time
+from utilities import DELIMITER, TsvWriter, check_num_arguments, \
+    open_safely, read_int_tsv
+from process_data import EARLIEST_ACCEPTABLE_TIMESTAMP, NEW_EVENTS_NUM_FIELDS
+
+NUM_ARGUMENTS = 3
+"""The expected number of arguments to this module when executed as a script.
+The path to this file is included in this count.
+"""
+
+PROGRAM_USAGE = "Usage: %s <num_rows> <file_path>" % __file__
+# A description of how to run execute this program from the command-line.
+
+NUM_USERS = 1000000
+NUM_STORIES = 5000000
+# The ranges of the generated user and story IDs, which are similar to those in
+# the processed Pulse logs, so that rows have realistic lengths.
+
+def _generate_events(num_rows):
+    """Generate the given number of processed events as tuples of ints.
+
+    Spread the IDs with multiplicative hashing rather than drawing them with
+    random, which would dominate the time taken to write the rows.
+    """
+    for row_num in xrange(num_rows):
+        yield ((row_num * 2654435761) % NUM_USERS,
+               (row_num * 40503) % NUM_STORIES,
+               EARLIEST_ACCEPTABLE_TIMESTAMP + row_num // 16)
+
+def _write_rows_slowly(rows, output_file_path):
+    """Write the given rows a line at a time, as the scripts used to."""
+    output_stream = open_safely(output_file_path, "w")
+    for row in rows:
+        output_stream.write(DELIMITER.join(map(str, row)) + "\n")
+    output_stream.close()
+
+def _write_rows_quickly(rows, output_file_path):
+    """Write the given rows in batches with a TsvWriter."""
+    writer = TsvWriter(output_file_path, NEW_EVENTS_NUM_FIELDS)
+    writer.write_rows(rows)
+    writer.close()
+
+def _read_rows_slowly(input_file_path):
+    """Generate the rows of the given file, parsing them a line at a time."""
+    input_stream = open_safely(input_file_path)
+    for row in input_stream:
+        yield tuple(map(int, row[:-1].split(DELIMITER)))
+    input_stream.close()
+
+def _read_rows_quickly(input_file_path):
+    """Generate the rows of the given file, parsing them a block at a time."""
+    return read_int_tsv(input_file_path, NEW_EVENTS_NUM_FIELDS)
+
+def _time_writer(write_rows_fn, num_rows, output_file_path):
+    """Return the seconds spent writing the generated rows with the function."""
+    start_time = time.time()
+    write_rows_fn(_generate_events(num_rows), output_file_path)
+    return time.time() - start_time
+
+def _time_reader(read_rows_fn, input_file_path):
+    """Return a checksum of the rows read with the function and the seconds
+    spent reading them.
+
+    The checksum is the number of rows and the sum of each field, which is
+    cheap enough not to distort the timings.
+    """
+    num_rows = 0
+    user_id_sum = 0
+    story_id_sum = 0
+    time_sum = 0
+    start_time = time.time()
+    for user_id, story_id, time_occurred in read_rows_fn(input_file_path):
+        num_rows += 1
+        user_id_sum += user_id
+        story_id_sum += story_id
+        time_sum += time_occurred
+    return ((num_rows, user_id_sum, story_id_sum, time_sum),
+            time.time() - start_time)
+
+def _files_are_equal(file_path1, file_path2):
+    """Return True if the two files have the same contents."""
+    stream1 = open_safely(file_path1)
+    stream2 = open_safely(file_path2)
+    try:
+        while True:
+            block1 = stream1.read(1 << 20)
+            if block1 != stream2.read(1 << 20):
+                return False
+            if block1 == "":
+                return True
+    finally:
+        stream1.close()
+        stream2.close()
+
+def _print_comparison(description, num_rows, num_bytes, slow_time, fast_time):
+    """Print the throughput of both implementations and the speedup."""
+    print(description)
+    print("  Line by line: %.3f s (%d rows/s, %.1f MB/s)" %
+          (slow_time, num_rows / max(slow_time, 1e-9),
+           num_bytes / max(slow_time, 1e-9) / 1e6))
+    print("  Blocks:       %.3f s (%d rows/s, %.1f MB/s)" %
+          (fast_time, num_rows / max(fast_time, 1e-9),
+           num_bytes / max(fast_time, 1e-9) / 1e6))
+    print("  Speedup: %.1fx" % (slow_time / max(fast_time, 1e-9)))
+
+def benchmark_tsv(num_rows, file_path):
+    """Time TsvWriter and read_int_tsv against line-by-line loops.
+
+    Write the given number of generated processed events to the given file and
+    to a second file next to it, once with each writer, and check that the
+    files are identical.  Then read the file back with each reader and check
+    that they agree.  Print the throughput of each implementation and the
+    speedups.  Both files are deleted afterwards.  A few hundred million rows
+    make a file of several gigabytes, which is too large to be cached by most
+    machines, so the timings include the cost of disk I/O.  If file_path ends
+    with a compression extension, then the files are compressed, as in
+    utilities.open_safely.  Raise AssertionError if the implementations
+    disagree.
+
+    num_rows, an int, is the number of rows to write and read.
+    file_path, a str, is the file path to which to write the rows.
+    """
+    if not isinstance(num_rows, int):
+        raise TypeError("Expected num_rows to be of type int.")
+    if num_rows <= 0:
+        raise ValueError("num_rows is %d but must be positive." % num_rows)
+
+    root, extension = os.path.splitext(file_path)
+    slow_file_path = root + ".slow" + extension
+    try:
+        slow_write_time = _time_writer(_write_rows_slowly, num_rows,
+                                       slow_file_path)
+        fast_write_time = _time_writer(_write_rows_quickly, num_rows,
+                                       file_path)
+        if not _files_are_equal(slow_file_path, file_path):
+            raise AssertionError(("The writers wrote different files: %s " +
+                                  "and %s.") % (slow_file_path, file_path))
+        num_bytes = os.path.getsize(file_path)
+        os.remove(slow_file_path)
+        slow_checksum, slow_read_time = _time_reader(_read_rows_slowly,
+                                                     file_path)
+        fast_checksum, fast_read_time = _time_reader(_read_rows_quickly,
+                                                     file_path)
+        if slow_checksum != fast_checksum:
+            raise AssertionError(("The readers disagree: %r (line by line) " +
+                                  "versus %r (blocks).") %
+                                 (slow_checksum, fast_checksum))
+    finally:
+        for written_file_path in [slow_file_path, file_path]:
+            if os.path.exists(written_file_path):
+                os.remove(written_file_path)
+
+    print(("Wrote and read %d rows (%d bytes on disk); both " +
+           "implementations agree.") % (num_rows, num_bytes))
+    _print_comparison("Writing:", num_rows, num_bytes, slow_write_time,
+                      fast_write_time)
+    _print_comparison("Reading:", num_rows, num_bytes, slow_read_time,
+                      fast_read_time)
+
+if __name__ == "__main__":
+    check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
+    try:
+        _num_rows = int(sys.argv[1])
+    except ValueError:
+        print >> sys.stderr, "Expected an integer but got %s." % sys.argv[1]
+        print >> sys.stderr, PROGRAM_USAGE
+        sys.exit(errno.EINVAL)
+    benchmark_tsv(_num_rows, sys.argv[2])
@@ -0,0 +1,70 @@
+#!/usr/bin/python2.5
+"""Contains functions that recognize URLs that lead to the same story.
+
+canonicalize_url returns the canonical form of a URL, which is shared by the
+variants of the URL that differ only in ways that don't change the story.
+"""
+
+import urlparse
+
+TRACKING_PARAMETERS = frozenset(["fbclid", "gclid", "dclid", "yclid", "msclkid",
+                                 "mc_cid", "mc_eid", "_ga", "_hsenc", "_hsmi",
+                                 "igshid", "ncid", "cmpid", "ocid"])
+"""The lowercase names of query parameters that only track where a reader came
+from.  Parameters whose names start with TRACKING_PARAMETER_PREFIXES are
+tracking parameters too.
+"""
+
+TRACKING_PARAMETER_PREFIXES = ("utm_", )
+# The prefixes of the lowercase names of other tracking query parameters.
+
+_DEFAULT_PORTS = {"http": "80", "https": "443"}
+# The port of each scheme that is implied when a URL has none.
+
+def _is_tracking_parameter(parameter):
+    """Return True if the given name=value part of a query string is a
+    tracking parameter.
+    """
+    name = parameter.split("=", 1)[0].lower()
+    if name in TRACKING_PARAMETERS:
+        return True
+    for prefix in TRACKING_PARAMETER_PREFIXES:
+        if name.startswith(prefix):
+            return True
+    return False
+
+def canonicalize_url(url):
+    """Return the canonical form of the given URL.
+
+    Variants of a URL that differ only in their scheme, if it is http or
+    https, the case of the host, an explicit default port, the fragment,
+    tracking query parameters, or a trailing slash on the path have the same
+    canonical form.  The canonical form uses http and keeps the other query
+    parameters in order.  It identifies a story rather than being a URL to
+    fetch, since the variants that it collapses may not all be fetchable.  URLs
+    with other schemes, and URLs that can't be parsed, are returned unchanged.
+    """
+    try:
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    except ValueError:
+        return url
+    scheme = scheme.lower()
+    if scheme not in _DEFAULT_PORTS:
+        return url
+
+    user_info, at, host_and_port = netloc.rpartition("@")
+    host, colon, port = host_and_port.rpartition(":")
+    if (not colon) or ("]" in port):
+        # There is no port, or the colon belongs to an IPv6 address.
+        host = host_and_port
+        port = ""
+    host = host.lower().rstrip(".")
+    if (port == "") or (port == _DEFAULT_PORTS[scheme]):
+        netloc = user_info + at + host
+    else:
+        netloc = user_info + at + host + ":" + port
+
+    path = path.rstrip("/") or "/"
+    query = "&".join([parameter for parameter in query.split("&") if
+                      parameter and not _is_tracking_parameter(parameter)])
+    return urlparse.urlunsplit(("http", netloc, path, query, ""))
@@ -0,0 +1,169 @@
+#!/usr/bin/python2.5
+"""Contains a compact, column-oriented set of user events backed by arrays.
+
+UserIdInterner assigns dense provisional integer IDs to original user IDs as
+they are encountered.
+CompactEventSet stores (user_id, story_id, time_occurred) events in three
+array('i') columns and deduplicates, remaps, and sorts them with NumPy.
+"""
+
+import numpy
+from array import array
+from itertools import izip
+
+OUTPUT_CHUNK_SIZE = 65536
+"""The number of sorted events converted back into Python ints at once."""
+
+MIN_DEDUPLICATION_SIZE = 1 << 20
+"""The smallest number of stored events at which duplicates are pruned before
+all events have been added.
+"""
+
+def _to_array(column):
+    """Return a copy of the given NumPy column as an array('i')."""
+    column_as_array = array("i")
+    column_as_array.fromstring(column.astype(numpy.intc).tostring())
+    return column_as_array
+
+def _to_numpy(column):
+    """Return a NumPy view of the given array('i') that shares its memory."""
+    return numpy.frombuffer(column, dtype=numpy.intc)
+
+def _sort_and_deduplicate(users, stories, times):
+    """Return the given NumPy columns sorted by row with duplicate rows removed.
+
+    Rows are ordered as (user, story, time) tuples would be by sorted.
+    """
+    order = numpy.lexsort((times, stories, users))
+    users = users[order]
+    stories = stories[order]
+    times = times[order]
+    is_distinct = numpy.ones(len(users), dtype=bool)
+    is_distinct[1:] = (users[1:] != users[:-1]) | \
+        (stories[1:] != stories[:-1]) | (times[1:] != times[:-1])
+    return (users[is_distinct], stories[is_distinct], times[is_distinct])
+
+class UserIdInterner(object):
+    """Assigns 0, 1, 2, etc. to original user IDs in order of appearance.
+
+    The original user IDs are held once each rather than once per event.  A
+    single interner is shared by the reads and clickthroughs so that their
+    provisional user IDs agree.
+    """
+
+    def __init__(self):
+        """Create an interner with no user IDs."""
+        self._provisional_user_ids = {}
+        self._original_user_ids = []
+
+    def __len__(self):
+        """Return the number of distinct original user IDs interned."""
+        return len(self._original_user_ids)
+
+    def intern(self, original_user_id):
+        """Return the provisional ID of the given original user ID."""
+        try:
+            return self._provisional_user_ids[original_user_id]
+        except KeyError:
+            provisional_user_id = len(self._original_user_ids)
+            self._provisional_user_ids[original_user_id] = provisional_user_id
+            self._original_user_ids.append(original_user_id)
+            return provisional_user_id
+
+    def sort(self):
+        """Return the sorted original user IDs and the final ID of each user.
+
+        Return a (user_ids_list, new_user_ids) tuple, where user_ids_list
+        contains the original user IDs in ascending lexicographic order and
+        new_user_ids is a NumPy array mapping from each provisional user ID to
+        the index of the corresponding original user ID in user_ids_list.
+        """
+        original_user_ids = numpy.array(self._original_user_ids)
+        order = numpy.argsort(original_user_ids, kind="mergesort")
+        new_user_ids = numpy.empty(len(order), dtype=numpy.intc)
+        new_user_ids[order] = numpy.arange(len(order), dtype=numpy.intc)
+        user_ids_list = [self._original_user_ids[provisional_user_id] for \
+                         provisional_user_id in order.tolist()]
+        return (user_ids_list, new_user_ids)
+
+class CompactEventSet(object):
+    """A set of events stored column-wise in three array('i') columns.
+
+    Events are added as (original_user_id, story_id, time_occurred) tuples,
+    like those added to a set by process_data._insert_event, but only the
+    provisional user ID from a UserIdInterner and the two ints are stored.
+    Duplicates are pruned in bulk whenever the number of stored events doubles,
+    and when the size of the set is requested.
+    """
+
+    def __init__(self, user_ids):
+        """Create an empty set that interns user IDs with the given interner."""
+        self._user_ids = user_ids
+        self._users = array("i")
+        self._stories = array("i")
+        self._times = array("i")
+        self._num_distinct = 0
+        self._is_deduplicated = True
+
+    def add(self, event):
+        """Add the given (original_user_id, story_id, time_occurred) event."""
+        original_user_id, story_id, time_occurred = event
+        self._users.append(self._user_ids.intern(original_user_id))
+        self._stories.append(story_id)
+        self._times.append(time_occurred)
+        self._is_deduplicated = False
+        if len(self._users) >= \
+                max(MIN_DEDUPLICATION_SIZE, 2 * self._num_distinct):
+            self._deduplicate()
+
+    def update(self, events):
+        """Add each of the events in the given iterable."""
+        for event in events:
+            self.add(event)
+
+    def __len__(self):
+        """Return the number of distinct events in the set."""
+        self._deduplicate()
+        return self._num_distinct
+
+    def _deduplicate(self):
+        """Remove duplicate events from the columns."""
+        if self._is_deduplicated:
+            return
+        users, stories, times = \
+            _sort_and_deduplicate(_to_numpy(self._users),
+                                  _to_numpy(self._stories),
+                                  _to_numpy(self._times))
+        self._users = _to_array(users)
+        self._stories = _to_array(stories)
+        self._times = _to_array(times)
+        self._num_distinct = len(self._users)
+        self._is_deduplicated = True
+
+    def get_sorted_columns(self, new_user_ids):
+        """Return the distinct events as sorted NumPy columns with final IDs.
+
+        Return a (users, stories, times) tuple of NumPy arrays in which each
+        provisional user ID has been replaced by new_user_ids[provisional_id].
+        Rows are in the order in which sorted would arrange the corresponding
+        (new_user_id, story_id, time_occurred) tuples.
+
+        new_user_ids, a NumPy array, is the second element of the tuple
+        returned by UserIdInterner.sort.
+        """
+        return _sort_and_deduplicate(new_user_ids[_to_numpy(self._users)],
+                                     _to_numpy(self._stories),
+                                     _to_numpy(self._times))
+
+def iterate_rows(columns):
+    """Generate the rows of the given NumPy columns as tuples of Python ints.
+
+    Convert the columns a chunk at a time so that the Python objects for only
+    OUTPUT_CHUNK_SIZE rows exist at once.
+    """
+    num_rows = len(columns[0])
+    for chunk_start in xrange(0, num_rows, OUTPUT_CHUNK_SIZE):
+        chunk_end = chunk_start + OUTPUT_CHUNK_SIZE
+        for row in izip(*[column[chunk_start:chunk_end].tolist() for column in
+                          columns]):
+            yield row
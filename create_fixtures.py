@@ -5,13 +5,14 @@ The only public function is create_fixtures, which behaves like the program.
 """
 
 import sys, os, errno, time
-from utilities import DELIMITER, check_num_arguments, report_time_elapsed, \
-    write_iterable
+from utilities import TsvWriter, check_num_arguments, report_time_elapsed, \
+    read_lines, read_int_tsv, write_iterable
 from process_data import STORIES_FILENAME, READS_FILENAME, \
     CLICKTHROUGHS_FILENAME, PROCESSED_DATA_DIRECTORY, \
     PROCESSED_STORIES_FILE_PATH, PROCESSED_READS_FILE_PATH, \
     PROCESSED_CLICKTHROUGHS_FILE_PATH, EVENTS_USER_ID_INDEX, \
-    EVENTS_STORY_ID_INDEX, NEW_EVENTS_TIMESTAMP_INDEX, open_safely
+    EVENTS_STORY_ID_INDEX, NEW_EVENTS_TIMESTAMP_INDEX, NEW_EVENTS_NUM_FIELDS, \
+    find_user_offsets
 
 NUM_ARGUMENTS = 3
 """The expected number of arguments to this module when executed as a script.
@@ -59,7 +60,9 @@ def _read_events(min_user_id, max_user_id, input_file_path):
     """Return a list of the events in the given file for the given users.
 
     Generate list elements of the form (user_id, story_id, time_occurred), and
-    maintain the ordering of the input file.
+    maintain the ordering of the input file, which is sorted by user ID.  Seek
+    to the events of the given users with the user index of the file if it has
+    one, and stop reading after them.
     
     min_user_id, an int, is the smallest user ID that will be included, and is
     in processed form (i.e., 0, 1, 2) rather than the original 38-character
@@ -70,21 +73,24 @@ def _read_events(min_user_id, max_user_id, input_file_path):
     inpurt_file_path, a str, is the file path to the Pulse event log file to
     read in.
     """
+    offsets = find_user_offsets(input_file_path, min_user_id, max_user_id)
+    if offsets is None:
+        offsets = (0, None)
     events_list = []
-    input_stream = open_safely(input_file_path)
-    for event_as_str in input_stream:
-        event_as_tuple = map(int, tuple(event_as_str[:-1].split(DELIMITER)))
+    for event_as_tuple in read_int_tsv(input_file_path, NEW_EVENTS_NUM_FIELDS,
+                                       *offsets):
         curr_user_id = event_as_tuple[EVENTS_USER_ID_INDEX]
-        if (min_user_id <= curr_user_id) and (curr_user_id <= max_user_id):
+        if curr_user_id > max_user_id:
+            break
+        if min_user_id <= curr_user_id:
             events_list.append(event_as_tuple)
-    input_stream.close()
     return events_list
 
 def _read_stories(story_ids):
     """Return a list of stories with the given IDs and a dict with new IDs.
 
-    Generate list elements in newline-terminated str form, where each element is
-    a single line of the processed stories log file.  Generate dict entries
+    Generate list elements in str form, where each element is a single line of
+    the processed stories log file without its newline.  Generate dict entries
     mapping from story IDs in the input file to story IDs in the output file.
     Maintain the ordering of the input file in the list.  This ordering is
     equivalent to ascending order of both old story IDs and new story IDs.
@@ -95,25 +101,23 @@ def _read_stories(story_ids):
     new_story_id = 0
     stories_list = []
     story_id_dict = {}
-    input_stream = open_safely(PROCESSED_STORIES_FILE_PATH)
-    for story in input_stream:
+    for story in read_lines(PROCESSED_STORIES_FILE_PATH):
         if old_story_id in story_ids:
             stories_list.append(story)
             story_id_dict[old_story_id] = new_story_id
             new_story_id += 1
         old_story_id += 1
-    input_stream.close()
     return (stories_list, story_id_dict)
 
 def _write_events(events_list, output_file_path, story_id_dict, user_id_offset):
     """Write the given events to the given output file using new story IDs.
     
     Maintain the ordering of events_list in the output file.  Write events in
-    newline-delimited raw text format.  Within each event, delimit fields by
-    DELIMITER.  Write events with fields (new_user_id, new_story_id,
-    time_occurred), where new user IDs start from 0.  Assume the the first
-    element in events_list belongs to the user with the smallest ID of those in
-    the list.
+    newline-delimited raw text format with a TsvWriter.  Within each event,
+    delimit fields by DELIMITER.  Write events with fields (new_user_id,
+    new_story_id, time_occurred), where new user IDs start from 0.  Assume the
+    the first element in events_list belongs to the user with the smallest ID
+    of those in the list.
     
     events_list, a list, contains all the events of a given type (reads or
     clickthroughs) for a range of users.  Each element of events_list is in the
@@ -123,7 +127,7 @@ def _write_events(events_list, output_file_path, story_id_dict, user_id_offset):
     user_id_offset, an int, is the value that must be subtracted from an old
     user ID to produce the corresponding new user ID.
     """ 
-    output_stream = open_safely(output_file_path, "w")
+    events_writer = TsvWriter(output_file_path, NEW_EVENTS_NUM_FIELDS)
     
     for old_event in events_list:
         old_user_id = old_event[EVENTS_USER_ID_INDEX]
@@ -131,10 +135,9 @@ def _write_events(events_list, output_file_path, story_id_dict, user_id_offset):
         old_story_id = old_event[EVENTS_STORY_ID_INDEX]
         new_story_id = story_id_dict[old_story_id]
         time_occurred = old_event[NEW_EVENTS_TIMESTAMP_INDEX]
-        new_event = (new_user_id, new_story_id, time_occurred)
-        output_stream.write(DELIMITER.join(map(str, new_event)) + "\n")
+        events_writer.write_row((new_user_id, new_story_id, time_occurred))
     
-    output_stream.close()
+    events_writer.close()
 
 def create_fixtures(min_user_id, max_user_id):
     """Create processed Pulse log files with data only for the given users.
@@ -189,7 +192,7 @@ def create_fixtures(min_user_id, max_user_id):
     _write_events(clickthroughs_list, output_clickthroughs_path, story_id_dict,
                   min_user_id)
     output_stories_path = output_directory + STORIES_FILENAME
-    write_iterable(stories_list, output_stories_path, "")
+    write_iterable(stories_list, output_stories_path)
     print("Output fixtures in directory: %s" % output_directory)
     report_time_elapsed(start_time)
 
@@ -0,0 +1,125 @@
+#!/usr/bin/python2.5
+"""Contains a set of user events that spills to disk when it grows too large.
+
+SpilledEventSet collects (user_id, story_id, time_occurred) events, writing
+sorted, deduplicated runs of them to temporary files whenever too many are held
+in memory, and merges the runs back into a single sorted, deduplicated stream.
+"""
+
+import os, heapq, tempfile
+from utilities import DELIMITER
+
+BATCH_SIZE = 10000
+"""The number of events formatted and written to a run file at once."""
+
+_EVENT_FORMAT = DELIMITER.join(["%s", "%d", "%d"]) + "\n"
+# The format of a single event in a run file.
+
+def _read_run(run_file_path):
+    """Generate the events in the given run file in the order they were written.
+
+    Each event is a (user_id, story_id, time_occurred) tuple in which user_id is
+    a str and the other fields are ints.
+    """
+    run_stream = open(run_file_path)
+    try:
+        for line in run_stream:
+            user_id, story_id, time_occurred = line[:-1].split(DELIMITER)
+            yield (user_id, int(story_id), int(time_occurred))
+    finally:
+        run_stream.close()
+
+class SpilledEventSet(object):
+    """A set of events that holds at most a fixed number of them in memory.
+
+    Events are (user_id, story_id, time_occurred) tuples, where user_id is a
+    str that does not contain DELIMITER and the other fields are ints.  Once the
+    number of distinct events in memory reaches max_events_in_memory, they are
+    sorted and written to a temporary run file.  Iterating over the set merges
+    the runs and the events still in memory, yielding each distinct event
+    exactly once in ascending order, i.e., in the order of sorted(events).  The
+    caller must call close to delete the run files.
+    """
+
+    def __init__(self, max_events_in_memory, temp_directory = None):
+        """Create an empty set.
+
+        max_events_in_memory, an int, is the number of distinct events held in
+        memory that triggers a spill to disk.
+        temp_directory, a str, is the directory in which to create run files.
+        If None, then the platform's default temporary directory is used.
+        """
+        if max_events_in_memory < 1:
+            raise ValueError("max_events_in_memory must be positive.")
+        self._max_events_in_memory = max_events_in_memory
+        self._temp_directory = temp_directory
+        self._events = set()
+        self._run_file_paths = []
+        self._num_spilled_events = 0
+
+    def __len__(self):
+        """Return the number of distinct events added so far.
+
+        Events that were spilled to different runs are deduplicated only when
+        the runs are merged, so this may overcount events that were added more
+        than once.
+        """
+        return len(self._events) + self._num_spilled_events
+
+    def add(self, event):
+        """Add the given event, spilling to disk if memory is full."""
+        self._events.add(event)
+        if len(self._events) >= self._max_events_in_memory:
+            self.spill()
+
+    def update(self, events):
+        """Add each of the events in the given iterable."""
+        for event in events:
+            self.add(event)
+
+    def spill(self):
+        """Write the events held in memory to a new sorted run file.
+
+        Do nothing if no events are held in memory.
+        """
+        if len(self._events) == 0:
+            return
+        sorted_events = sorted(self._events)
+        self._events = set()
+        run_fd, run_file_path = tempfile.mkstemp(suffix=".run",
+                                                 prefix="events_",
+                                                 dir=self._temp_directory)
+        self._run_file_paths.append(run_file_path)
+        run_stream = os.fdopen(run_fd, "w")
+        try:
+            for batch_start in xrange(0, len(sorted_events), BATCH_SIZE):
+                batch = sorted_events[batch_start:batch_start + BATCH_SIZE]
+                run_stream.write("".join([_EVENT_FORMAT % event for event in
+                                          batch]))
+        finally:
+            run_stream.close()
+        self._num_spilled_events += len(sorted_events)
+
+    def __iter__(self):
+        """Generate every distinct event in ascending order.
+
+        Run files are read lazily, so memory use is bounded by the events held
+        in memory plus one buffered line per run.
+        """
+        runs = [_read_run(run_file_path) for run_file_path in
+                self._run_file_paths]
+        runs.append(iter(sorted(self._events)))
+        previous_event = None
+        for event in heapq.merge(*runs):
+            if event != previous_event:
+                yield event
+                previous_event = event
+
+    def close(self):
+        """Delete the run files and discard the events held in memory."""
+        for run_file_path in self._run_file_paths:
+            if os.path.exists(run_file_path):
+                os.remove(run_file_path)
+        self._run_file_paths = []
+        self._num_spilled_events = 0
+        self._events = set()
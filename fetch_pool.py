@@ -0,0 +1,220 @@
+#!/usr/bin/python2.5
+"""Contains a bounded thread pool for fetching many URLs concurrently.
+
+get_host returns the lowercase host and port of a URL.
+interleave_hosts reorders URLs round-robin across their hosts.
+FetchPool calls a fetch function on URLs as they are submitted with a global
+limit and a per-host limit on the number of concurrent calls.
+fetch_concurrently calls a fetch function on many URLs with a FetchPool.
+"""
+
+import sys, threading, Queue, urlparse
+from collections import defaultdict, deque
+
+def get_host(url):
+    """Return the lowercase network location of the given URL.
+
+    Return an empty str if the URL has no network location or cannot be parsed.
+    URLs with an empty host share a single per-host limit in fetch_concurrently.
+    """
+    try:
+        return urlparse.urlsplit(url)[1].lower()
+    except ValueError:
+        return ""
+
+def interleave_hosts(urls):
+    """Return a list of the given URLs reordered round-robin across hosts.
+
+    The first URL of each host comes first, in order of first appearance, then
+    the second URL of each host, and so on, which is the order in which
+    fetch_concurrently dispatches URLs when no host is saturated.  Any slice of
+    the result therefore spreads its URLs across as many hosts as possible,
+    which keeps the pool busy when URLs are fetched in batches.
+    """
+    urls_by_host = defaultdict(deque)
+    hosts = []
+    for url in urls:
+        host = get_host(url)
+        if len(urls_by_host[host]) == 0:
+            hosts.append(host)
+        urls_by_host[host].append(url)
+    interleaved_urls = []
+    while len(hosts) > 0:
+        remaining_hosts = []
+        for host in hosts:
+            interleaved_urls.append(urls_by_host[host].popleft())
+            if len(urls_by_host[host]) > 0:
+                remaining_hosts.append(host)
+        hosts = remaining_hosts
+    return interleaved_urls
+
+def _fetch_worker(fetch_fn, task_queue, result_queue):
+    """Call fetch_fn on URLs from task_queue until a None task is received.
+
+    Put a (url, host, result, exc_info) tuple on result_queue for each URL,
+    where exc_info is None unless fetch_fn raised an exception, in which case
+    result is None and exc_info is the tuple returned by sys.exc_info.
+    """
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        url, host = task
+        try:
+            result_queue.put((url, host, fetch_fn(url), None))
+        except:
+            result_queue.put((url, host, None, sys.exc_info()))
+
+class FetchPool(object):
+    """A pool of threads that call a fetch function on URLs as they are
+    submitted.
+
+    No more than num_threads calls run at once, and no more than
+    max_threads_per_host run at once for URLs with the same host, so that a few
+    large publishers can't monopolize the pool or be flooded with requests.
+    Submitted URLs are dispatched round-robin across hosts in the order in
+    which they were submitted whenever get_result is called, and results are
+    returned in the order in which the calls finish, so URLs can be submitted
+    and their results consumed a few at a time from a single thread.  Threads
+    are started as they are needed.
+    """
+
+    def __init__(self, fetch_fn, num_threads, max_threads_per_host):
+        """Create a pool without starting any threads.
+
+        fetch_fn, a function, accepts a single URL and returns its result.  It
+        must be safe to call from several threads at once.
+        num_threads, an int, is the largest number of calls to make at once.
+        max_threads_per_host, an int, is the largest number of calls to make at
+        once for URLs that share a host.
+        """
+        if (num_threads < 1) or (max_threads_per_host < 1):
+            raise ValueError("num_threads and max_threads_per_host must both " +
+                             "be positive.")
+        self._fetch_fn = fetch_fn
+        self._num_threads = num_threads
+        self._max_threads_per_host = max_threads_per_host
+        self._pending_urls_by_host = defaultdict(deque)
+        self._hosts_with_pending_urls = deque()
+        self._saturated_hosts = deque()
+        self._num_pending = 0
+        self._num_in_flight = 0
+        self._num_in_flight_by_host = defaultdict(int)
+        self._task_queue = Queue.Queue()
+        self._result_queue = Queue.Queue()
+        self._threads = []
+
+    def submit(self, url):
+        """Queue a call of the fetch function on the given URL.
+
+        The URL is fetched again if it was already submitted.
+        """
+        host = get_host(url)
+        pending_urls = self._pending_urls_by_host[host]
+        if len(pending_urls) == 0:
+            if self._num_in_flight_by_host[host] < self._max_threads_per_host:
+                self._hosts_with_pending_urls.append(host)
+            else:
+                self._saturated_hosts.append(host)
+        pending_urls.append(url)
+        self._num_pending += 1
+
+    def num_outstanding(self):
+        """Return the number of submitted URLs whose results haven't been
+        returned by get_result.
+        """
+        return self._num_pending + self._num_in_flight
+
+    def _dispatch(self):
+        """Hand out URLs from hosts with spare capacity while threads are idle.
+
+        Saturated hosts wait until one of their calls returns.
+        """
+        while (self._num_in_flight < self._num_threads) and \
+                (len(self._hosts_with_pending_urls) > 0):
+            if len(self._threads) == self._num_in_flight:
+                thread = threading.Thread(target=_fetch_worker,
+                                          args=(self._fetch_fn,
+                                                self._task_queue,
+                                                self._result_queue))
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+            host = self._hosts_with_pending_urls.popleft()
+            pending_urls = self._pending_urls_by_host[host]
+            self._task_queue.put((pending_urls.popleft(), host))
+            self._num_pending -= 1
+            self._num_in_flight += 1
+            self._num_in_flight_by_host[host] += 1
+            if len(pending_urls) == 0:
+                del self._pending_urls_by_host[host]
+            elif self._num_in_flight_by_host[host] < \
+                    self._max_threads_per_host:
+                self._hosts_with_pending_urls.append(host)
+            else:
+                self._saturated_hosts.append(host)
+
+    def get_result(self):
+        """Return a (url, result) tuple for the next call to finish.
+
+        Dispatch submitted URLs to idle threads first, and then wait for a call
+        to finish.  If the call raised an exception, then re-raise it.  Raise
+        ValueError if no URLs are outstanding.
+        """
+        self._dispatch()
+        if self._num_in_flight == 0:
+            raise ValueError("No URLs are outstanding.")
+        url, host, result, exc_info = self._result_queue.get()
+        self._num_in_flight -= 1
+        self._num_in_flight_by_host[host] -= 1
+        if (host in self._saturated_hosts) and \
+                (self._num_in_flight_by_host[host] < \
+                 self._max_threads_per_host):
+            self._saturated_hosts.remove(host)
+            self._hosts_with_pending_urls.append(host)
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return (url, result)
+
+    def close(self):
+        """Stop dispatching URLs, wait for the calls in flight, and stop the
+        threads.
+        """
+        for thread in self._threads:
+            self._task_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+def fetch_concurrently(urls, fetch_fn, num_threads, max_threads_per_host):
+    """Return a dict mapping from each of the given URLs to fetch_fn(url).
+
+    Call fetch_fn on each distinct URL exactly once from a FetchPool of
+    num_threads threads, at most max_threads_per_host of which fetch URLs with
+    the same host at once.  URLs are dispatched round-robin across hosts in the
+    order in which they are first supplied.  If fetch_fn raises an exception,
+    then stop dispatching, wait for calls in flight, and re-raise it in the
+    calling thread.
+
+    urls, an iterable of str, contains the URLs to fetch.
+    fetch_fn, a function, accepts a single URL and returns its result.  It must
+    be safe to call from several threads at once.
+    num_threads, an int, is the largest number of calls to make at once.
+    max_threads_per_host, an int, is the largest number of calls to make at
+    once for URLs that share a host.
+    """
+    pool = FetchPool(fetch_fn, num_threads, max_threads_per_host)
+    seen_urls = set()
+    for url in urls:
+        if url not in seen_urls:
+            seen_urls.add(url)
+            pool.submit(url)
+
+    results = {}
+    try:
+        while pool.num_outstanding() > 0:
+            url, result = pool.get_result()
+            results[url] = result
+    finally:
+        pool.close()
+    return results
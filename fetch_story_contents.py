@@ -5,15 +5,23 @@ The only public function is fetch_story_contents, which behaves like the
 program.
 """
 
-import sys, os, time, socket, html2text
+import sys, os, time, socket, functools, multiprocessing, html2text
 from os import path
-from utilities import DELIMITER, check_num_arguments, write_iterable, \
-    write_2d_iterable
+from array import array
+from fetch_pool import FetchPool
+from utilities import TsvWriter, check_num_arguments, read_tsv, read_int_tsv, \
+    write_iterable
 from process_data import TIMEOUT_LENGTH, MIN_STORY_LENGTH, STORIES_FILENAME, \
     READS_FILENAME, CLICKTHROUGHS_FILENAME, USER_IDS_FILENAME, \
     STORIES_DESCRIPTOR, READS_DESCRIPTOR, CLICKTHROUGHS_DESCRIPTOR, \
-    NEW_STORIES_URL_INDEX, NEW_STORIES_TITLE_INDEX, EVENTS_STORY_ID_INDEX, \
-    open_safely, report_time_elapsed, get_user_ids
+    USER_IDS_DESCRIPTOR, STORY_KEYS_FILENAME, STORY_CONTENTS_HASHES_FILENAME, \
+    NEW_STORIES_URL_INDEX, NEW_STORIES_TITLE_INDEX, STORIES_TIMESTAMP_INDEX, \
+    EVENTS_USER_ID_INDEX, EVENTS_STORY_ID_INDEX, NEW_EVENTS_NUM_FIELDS, \
+    NUM_FETCH_THREADS, NUM_FETCH_THREADS_PER_HOST, NUM_EXTRACTION_PROCESSES, \
+    report_time_elapsed, open_story_cache, open_http_fetcher, \
+    get_story_extractor, get_story_downloader, get_story_contents_key, \
+    get_story_contents_hash
+from http_fetcher import HostDown
 
 NUM_ARGUMENTS = 2
 """The expected number of arguments to this module when executed as a script.
@@ -26,13 +34,77 @@ PROGRAM_USAGE = "Usage: %s <input_directory>" % __file__
 SUB_DIRECTORY_NAME = "Processed Data with Story Contents/"
 # The name of the directory in which to place the output log files.
 
+PIPELINE_STORIES = True
+"""A boolean that determines whether stories are fetched, extracted, and
+written by a pipeline, or fetched one at a time and written once all of them
+have been fetched.  In the pipeline, process_data.NUM_FETCH_THREADS threads
+fetch stories, process_data.NUM_EXTRACTION_PROCESSES processes extract their
+text if it is greater than 1, and each story is written as soon as every story
+before it has been.
+"""
+
+REORDER_WINDOW = 1000
+"""The largest number of stories that the pipeline reads ahead of the next
+story to write.  Stories that are fetched before the stories ahead of them wait
+in memory to be written in order, so this bounds the memory that the pipeline
+uses, while a larger window keeps the fetch threads busy behind slow stories.
+"""
+
+def _fetch_story(story_url, story_cache, extract_fn):
+    """Return the full contents of the story at the given URL, or None if they
+    could not be extracted or were at most MIN_STORY_LENGTH characters long.
+
+    Consult the given story contents cache, if it isn't None, before
+    extracting the story with the given function.  If the function raises
+    HostDown, then the story wasn't requested, so return None without caching
+    the failure, and a later run may still fetch the story.
+    """
+    try:
+        if story_cache is None:
+            story_contents = extract_fn(story_url)
+        else:
+            story_contents = story_cache.fetch(story_url, extract_fn)
+    except HostDown:
+        return None
+    if (story_contents is not None) and \
+            (len(story_contents) <= MIN_STORY_LENGTH):
+        return None
+    return story_contents
+
+def _open_story_writers(output_file_path):
+    """Return a tuple of TsvWriters for the given stories file and for the
+    story keys and contents hashes files next to it, which are named and laid
+    out as process_data writes them for stories with full contents.
+    """
+    output_directory = path.dirname(output_file_path)
+    return (TsvWriter(output_file_path),
+            TsvWriter(path.join(output_directory, STORY_KEYS_FILENAME),
+                      STORIES_TIMESTAMP_INDEX),
+            TsvWriter(path.join(output_directory,
+                                STORY_CONTENTS_HASHES_FILENAME), 1))
+
+def _write_story(story_writers, story_as_list, story_contents):
+    """Append a space followed by the given full contents to the title of the
+    given story and write it with the given writers, as returned by
+    _open_story_writers, along with its key and the hash of its contents.
+    """
+    stories_writer, keys_writer, hashes_writer = story_writers
+    keys_writer.write_row(story_as_list[:STORIES_TIMESTAMP_INDEX])
+    hashes_writer.write_row((get_story_contents_hash(story_contents), ))
+    story_as_list[NEW_STORIES_TITLE_INDEX] += " " + story_contents
+    stories_writer.write_row(story_as_list)
+
+def _close_story_writers(story_writers):
+    """Close the writers returned by _open_story_writers."""
+    for writer in story_writers:
+        writer.close()
+
 def _read_stories(input_file_path):
     """Return a list of stories with full contents and a dict with new IDs.
 
-    Generate list elements in tuple form, where each element corresponds to a
-    single line of the given processed stories log file.  Do not trim the
-    newline off the end of the last element of the tuple.  Append a space
-    followed by the full story contents to the title of each story.  Omit
+    Generate list elements in (story_as_list, story_contents) form, where
+    story_as_list corresponds to a single line of the given processed stories
+    log file and story_contents is the full contents of the story.  Omit
     stories for which the full story contents could not be fetched.  Generate
     dict entries mapping from story IDs in the input file to story IDs in the
     output file.  Maintain the ordering of the input file in the list.  This
@@ -40,6 +112,14 @@ def _read_stories(input_file_path):
     story IDs.  Be warned that fetching full story contents is quite slow and
     consumes a great deal of bandwidth, so you or other users on your network
     may experience connectivity problems while executing this function.
+    Consult the story contents cache shared with process_data before fetching a
+    story, so that stories fetched by earlier runs are read from disk instead.
+    Reuse connections and DNS lookups across stories if
+    process_data.REUSE_CONNECTIONS is True.  Skip pages that aren't HTML or are
+    too large or slow to fetch, and stories from hosts that seem to be down,
+    as process_data does, and report how much skipping them saved.  Fetch
+    stories whose URLs share a process_data.get_story_contents_key once, and
+    report how many fetches sharing them saved.
 
     input_file_path, a str, is the file path to the processed Pulse stories log
     file that contains story URLs and titles but not the full contents of the
@@ -51,83 +131,296 @@ def _read_stories(input_file_path):
     stories_list = []
     story_id_dict = {}
     story_contents_dict = {}
+    story_urls = set()
     socket.setdefaulttimeout(TIMEOUT_LENGTH)
-    input_stream = open_safely(input_file_path)
+    story_cache = open_story_cache()
+    http_fetcher = open_http_fetcher()
+    extract_fn = get_story_extractor(http_fetcher)
     
-    for story_as_str in input_stream:
-        story_as_list = story_as_str.split(DELIMITER)
+    for story_as_list in read_tsv(input_file_path):
         story_url = story_as_list[NEW_STORIES_URL_INDEX]
-        if story_url in story_contents_dict:
-            story_contents = story_contents_dict[story_url]
+        story_urls.add(story_url)
+        story_contents_key = get_story_contents_key(story_url)
+        if story_contents_key in story_contents_dict:
+            story_contents = story_contents_dict[story_contents_key]
         else:
-            story_contents = html2text.extractFromURL(story_url)
-            if (story_contents is not None) and \
-                    (len(story_contents) <= MIN_STORY_LENGTH):
-                story_contents = None
-            story_contents_dict[story_url] = story_contents
+            story_contents = _fetch_story(story_url, story_cache, extract_fn)
+            story_contents_dict[story_contents_key] = story_contents
         if story_contents is not None:
-            story_as_list[NEW_STORIES_TITLE_INDEX] += " " + story_contents
-            stories_list.append(tuple(story_as_list))
+            stories_list.append((story_as_list, story_contents))
             story_id_dict[old_story_id] = new_story_id
             new_story_id += 1
         old_story_id += 1
         
-    input_stream.close()
-    num_stories_discarded = old_story_id - new_story_id
-    discard_rate = float(100 * num_stories_discarded) / float(old_story_id)
+    _report_stories_fetched(story_cache, http_fetcher,
+                            len(story_urls) - len(story_contents_dict),
+                            old_story_id, new_story_id)
+    if story_cache is not None:
+        story_cache.close()
+    http_fetcher.close()
+    report_time_elapsed(start_time)
+    return (stories_list, story_id_dict)
+
+def _report_stories_fetched(story_cache, http_fetcher, num_fetches_saved,
+                            num_stories_read, num_stories_kept):
+    """Print how the stories were fetched and how many of them were kept.
+
+    story_cache and http_fetcher are the story contents cache, which may be
+    None, and the HttpFetcher with which the stories were fetched.
+    num_fetches_saved, an int, is the number of stories whose contents were
+    fetched for another story with the same get_story_contents_key.
+    num_stories_read and num_stories_kept, ints, are the number of stories read
+    and the number of those with full contents.
+    """
+    if story_cache is not None:
+        print("Found %d of the fetched stories in the story contents cache." %
+              story_cache.num_hits)
+    print(("Opened %d connections and reused connections %d times to " +
+           "fetch the stories.") % (http_fetcher.num_connections_opened,
+                                   http_fetcher.num_connections_reused))
+    print(http_fetcher.get_skip_summary())
+    print(("Saved %d fetches of URLs that lead to the same stories as the " +
+           "URLs fetched.") % num_fetches_saved)
+    num_stories_discarded = num_stories_read - num_stories_kept
+    discard_rate = float(100 * num_stories_discarded) / \
+        float(max(num_stories_read, 1))
     print(("Read a total of %d %s, %d (%.2f%%) of which were discarded " + \
            "because their full contents could not be fetched.") % \
-           (old_story_id, STORIES_DESCRIPTOR, num_stories_discarded,
+           (num_stories_read, STORIES_DESCRIPTOR, num_stories_discarded,
             discard_rate))
+
+def _get_pipeline_extract_fn(http_fetcher, extraction_pool):
+    """Return a function that extracts the text of the story at a given URL,
+    as the function returned by get_story_extractor does, and is safe to call
+    from several threads.
+
+    If extraction_pool, a multiprocessing.Pool, is not None, then the calling
+    thread downloads the story with the given HttpFetcher and waits while a
+    process in the pool extracts its text.  Otherwise, the calling thread
+    extracts the text as it downloads the story.
+    """
+    if extraction_pool is None:
+        return get_story_extractor(http_fetcher)
+    download_fn = get_story_downloader(http_fetcher)
+    def extract_fn(story_url):
+        html, encoding = download_fn(story_url)
+        if html is None:
+            return None
+        return extraction_pool.apply(html2text.extractFromDocument,
+                                     (html, None, encoding))
+    return extract_fn
+
+def _get_pipeline_fetch_fn(story_cache, http_fetcher, extraction_pool):
+    """Return a function that returns the full contents of the story at a
+    given URL as _fetch_story does and is safe to call from several threads.
+
+    The story is extracted by _get_pipeline_extract_fn with the given
+    HttpFetcher and extraction pool, which may be None.
+    """
+    return functools.partial(_fetch_story, story_cache = story_cache,
+                             extract_fn = _get_pipeline_extract_fn(
+                                 http_fetcher, extraction_pool))
+
+def _pipeline_stories(input_file_path, output_file_path):
+    """Write the stories with full contents to the given output file as they
+    are fetched, and return a dict with new IDs.
+
+    Read the given processed stories log file at most REORDER_WINDOW stories
+    ahead of the next story to write.  Fetch the stories read with a FetchPool
+    of NUM_FETCH_THREADS threads, at most NUM_FETCH_THREADS_PER_HOST of which
+    fetch from the same host at once, and extract their text in a pool of
+    NUM_EXTRACTION_PROCESSES processes if it is greater than 1.  Write each
+    story as soon as it and every story before it have been fetched, so that
+    stories are written in order of their old story IDs and are assigned new
+    story IDs 0, 1, 2, etc. as they are written.  Otherwise, the stories
+    written, the dict returned, and the summary printed are as in
+    _read_stories, except that the fetch of a story is only shared with the
+    stories that share its get_story_contents_key while it is in the window,
+    including those with the same URL, which all count as fetches saved.
+    Later stories are read from the story contents cache instead.
+
+    input_file_path, a str, is the file path to the processed Pulse stories log
+    file that contains story URLs and titles but not the full contents of the
+    stories themselves.
+    output_file_path, a str, is the file path to which to write the stories.
+    """
+    start_time = time.time()
+    if REORDER_WINDOW < 1:
+        raise ValueError("REORDER_WINDOW is %d but must be positive." %
+                         REORDER_WINDOW)
+    socket.setdefaulttimeout(TIMEOUT_LENGTH)
+    story_cache = open_story_cache()
+    http_fetcher = open_http_fetcher()
+    extraction_pool = None
+    if NUM_EXTRACTION_PROCESSES > 1:
+        # Start the processes before the fetch threads, which they would
+        # otherwise be forked along with.
+        extraction_pool = multiprocessing.Pool(NUM_EXTRACTION_PROCESSES)
+    fetch_pool = FetchPool(_get_pipeline_fetch_fn(story_cache, http_fetcher,
+                                                  extraction_pool),
+                           NUM_FETCH_THREADS, NUM_FETCH_THREADS_PER_HOST)
+    story_writers = _open_story_writers(output_file_path)
+    stories = read_tsv(input_file_path)
+    stories_by_id = {}
+    story_contents_by_id = {}
+    story_ids_by_key = {}
+    story_id_dict = {}
+    num_stories_read = 0
+    num_fetches = 0
+    old_story_id = 0
+    new_story_id = 0
+    try:
+        while True:
+            while old_story_id in story_contents_by_id:
+                story_contents = story_contents_by_id.pop(old_story_id)
+                story_as_list = stories_by_id.pop(old_story_id)
+                if story_contents is not None:
+                    _write_story(story_writers, story_as_list, story_contents)
+                    story_id_dict[old_story_id] = new_story_id
+                    new_story_id += 1
+                old_story_id += 1
+            for writer in story_writers:
+                writer.flush()
+            
+            while (stories is not None) and \
+                    (num_stories_read - old_story_id < REORDER_WINDOW):
+                try:
+                    story_as_list = stories.next()
+                except StopIteration:
+                    stories = None
+                    break
+                story_url = story_as_list[NEW_STORIES_URL_INDEX]
+                story_contents_key = get_story_contents_key(story_url)
+                stories_by_id[num_stories_read] = story_as_list
+                if story_contents_key in story_ids_by_key:
+                    story_ids_by_key[story_contents_key].append(
+                        num_stories_read)
+                else:
+                    story_ids_by_key[story_contents_key] = [num_stories_read]
+                    fetch_pool.submit(story_url)
+                    num_fetches += 1
+                num_stories_read += 1
+            # Every story in the window that hasn't been written waits for a
+            # fetch, so there is nothing left to do once none are outstanding.
+            if fetch_pool.num_outstanding() == 0:
+                break
+            story_url, story_contents = fetch_pool.get_result()
+            for story_id in story_ids_by_key.pop(
+                    get_story_contents_key(story_url)):
+                story_contents_by_id[story_id] = story_contents
+    finally:
+        fetch_pool.close()
+        if extraction_pool is not None:
+            extraction_pool.terminate()
+            extraction_pool.join()
+        _close_story_writers(story_writers)
+        if story_cache is not None:
+            story_cache.close()
+        http_fetcher.close()
+    
+    _report_stories_fetched(story_cache, http_fetcher,
+                            num_stories_read - num_fetches, num_stories_read,
+                            new_story_id)
     report_time_elapsed(start_time)
-    return (stories_list, story_id_dict)
+    return story_id_dict
+
+def _find_users(story_id_dict, input_file_paths):
+    """Return a bytearray that marks the users with events that are retained.
+
+    The byte at each user ID is 1 if the user has an event with a story ID in
+    story_id_dict in any of the given files and 0 otherwise.  The bytearray
+    extends only to the largest user ID so marked, so it holds a single byte per
+    user however many events the files hold.
+
+    story_id_dict, a dict, maps from old story IDs to new story IDs.
+    input_file_paths, a list of strs, are the file paths to the processed Pulse
+    event log files to read.
+    """
+    user_bitmap = bytearray()
+    for input_file_path in input_file_paths:
+        for event_as_tuple in read_int_tsv(input_file_path,
+                                           NEW_EVENTS_NUM_FIELDS):
+            if event_as_tuple[EVENTS_STORY_ID_INDEX] in story_id_dict:
+                user_id = event_as_tuple[EVENTS_USER_ID_INDEX]
+                if user_id >= len(user_bitmap):
+                    user_bitmap.extend(bytearray(user_id + 1 -
+                                                 len(user_bitmap)))
+                user_bitmap[user_id] = 1
+    return user_bitmap
+
+def _get_new_user_ids(user_bitmap):
+    """Return an array of ints that maps from old user IDs to new user IDs.
+
+    The users marked in the given bytearray, as returned by _find_users, are
+    assigned new IDs 0, 1, 2, etc. in ascending order of their old IDs, and the
+    other users are mapped to -1.
+    """
+    new_user_ids = array("i", [-1]) * len(user_bitmap)
+    new_user_id = 0
+    for old_user_id, is_marked in enumerate(user_bitmap):
+        if is_marked:
+            new_user_ids[old_user_id] = new_user_id
+            new_user_id += 1
+    return new_user_ids
 
-def _read_events(story_id_dict, input_file_path, event_descriptor):
-    """"Return a list of the events in the given file with the given story IDs.
+def _write_events(story_id_dict, new_user_ids, input_file_path,
+                  output_file_path, event_descriptor):
+    """Write the events in the given file with the given story IDs to the
+    given output file as they are read.
 
-    Generate list elements in [user_id, new_story_id, time_occurred] form, and
-    maintain the ordering of the input file.
+    Replace the story and user IDs of each event with their new IDs, and
+    maintain the ordering of the input file.  Only a block of events is held in
+    memory at a time.
     
-    inpurt_file_path, a str, is the file path to the Pulse event log file to
-    read in.
     story_id_dict, a dict, maps from old story IDs to new story IDs.  Only
     events with story IDs that are keys in story_id_dict are retained in the
     output, but these old story IDs are replaced with the corresponding new
     story IDs.
+    new_user_ids, an array of ints, maps from the old user IDs of the retained
+    events to their new user IDs, as returned by _get_new_user_ids.
+    input_file_path, a str, is the file path to the Pulse event log file to
+    read in.
+    output_file_path, a str, is the file path to which to write the events.
     event_descriptor, a str, briefly describes the events in the plural form and
     is used to notify the user upon completion.
     """
-    events_list = []
+    events_writer = TsvWriter(output_file_path, NEW_EVENTS_NUM_FIELDS)
     num_events = 0
     num_events_kept = 0
-    input_stream = open_safely(input_file_path)
-    for event_as_str in input_stream:
-        event_as_list = map(int, event_as_str[:-1].split(DELIMITER))
-        old_user_id = event_as_list[EVENTS_STORY_ID_INDEX]
-        if old_user_id in story_id_dict:
-            event_as_list[EVENTS_STORY_ID_INDEX] = story_id_dict[old_user_id]
-            events_list.append(event_as_list)
+    for event_as_tuple in read_int_tsv(input_file_path, NEW_EVENTS_NUM_FIELDS):
+        old_story_id = event_as_tuple[EVENTS_STORY_ID_INDEX]
+        if old_story_id in story_id_dict:
+            event_as_list = list(event_as_tuple)
+            event_as_list[EVENTS_STORY_ID_INDEX] = story_id_dict[old_story_id]
+            event_as_list[EVENTS_USER_ID_INDEX] = \
+                new_user_ids[event_as_tuple[EVENTS_USER_ID_INDEX]]
+            events_writer.write_row(event_as_list)
             num_events_kept += 1
         num_events += 1
-    input_stream.close()
+    events_writer.close()
     num_events_discarded = num_events - num_events_kept
-    discard_rate = float(100 * num_events_discarded) / float(num_events)
+    discard_rate = float(100 * num_events_discarded) / float(max(num_events, 1))
     print(("Read a total of %d %s, %d (%.2f%%) of which were discarded " + \
            "because the full contents of the associated story could not be " + \
            "fetched.") % (num_events, event_descriptor, num_events_discarded,
                           discard_rate))
-    return events_list
 
 def fetch_story_contents(input_directory):
     """Write processed Pulse log files with full story contents.
     
     Output files by the same name in a sub-directory of the given directory
     named SUB_DIRECTORY_NAME.  Append a space followed by the full story
-    contents to the story titles.  Remove stories for which no content could not
-    be fetched and events involving these stories.  Reassign story and user IDs
-    to 0, 1, 2, etc. to fill the resulting gaps in the ID sequences.  Output a
+    contents to the story titles, and write the story keys and contents hashes
+    files that process_data writes for stories with full contents, so that
+    reselect and stem_processed_stories process contents that several stories
+    share only once.  Remove stories for which no content could not be fetched
+    and events involving these stories.  Reassign story and user IDs to 0, 1,
+    2, etc. to fill the resulting gaps in the ID sequences.  Output a
     user IDs log file in which row numbers correspond to the new user IDs, and
-    row values correspond to the old user IDs.
+    row values correspond to the old user IDs.  If PIPELINE_STORIES is True,
+    then stories are written as they are fetched.  Events are remapped in two
+    streaming passes over the event log files, the first of which finds the
+    users that remain, so memory use doesn't grow with the number of events.
     
     input_directory, a str, is the file path to a directory containing processed
     Pulse log files lacking full story contents.
@@ -138,33 +431,43 @@ def fetch_story_contents(input_directory):
     if not path.isdir(input_directory):
         raise ValueError("Could not find given directory: %s" % input_directory)
     
-    input_stories_path = path.join(input_directory, STORIES_FILENAME)
-    stories_list, story_id_dict = _read_stories(input_stories_path)
-    input_reads_path = path.join(input_directory, READS_FILENAME)
-    reads_list = _read_events(story_id_dict, input_reads_path, READS_DESCRIPTOR)
-    input_clickthroughs_path = path.join(input_directory,
-                                         CLICKTHROUGHS_FILENAME)
-    clickthroughs_list = _read_events(story_id_dict, input_clickthroughs_path,
-                                      CLICKTHROUGHS_DESCRIPTOR)
-    user_ids_list = get_user_ids(reads_list, clickthroughs_list) 
-    reads_list = [map(str, read) for read in reads_list]
-    clickthroughs_list = [map(str, clickthrough) for clickthrough in \
-                          clickthroughs_list]
-    user_ids_list = map(str, user_ids_list)
-    
     output_directory = path.join(input_directory, SUB_DIRECTORY_NAME)
     if not path.exists(output_directory):
         os.mkdir(output_directory)
     
+    input_stories_path = path.join(input_directory, STORIES_FILENAME)
     output_stories_path = path.join(output_directory, STORIES_FILENAME)
-    write_2d_iterable(stories_list, output_stories_path, "")
+    if PIPELINE_STORIES:
+        story_id_dict = _pipeline_stories(input_stories_path,
+                                          output_stories_path)
+    else:
+        stories_list, story_id_dict = _read_stories(input_stories_path)
+        story_writers = _open_story_writers(output_stories_path)
+        for story_as_list, story_contents in stories_list:
+            _write_story(story_writers, story_as_list, story_contents)
+        _close_story_writers(story_writers)
+        del stories_list
+    input_reads_path = path.join(input_directory, READS_FILENAME)
+    input_clickthroughs_path = path.join(input_directory,
+                                         CLICKTHROUGHS_FILENAME)
+    start_time = time.time()
+    user_bitmap = _find_users(story_id_dict, [input_reads_path,
+                                              input_clickthroughs_path])
+    new_user_ids = _get_new_user_ids(user_bitmap)
+    print("Reassigned %s from original values to 0, 1, 2, etc." % \
+          USER_IDS_DESCRIPTOR)
+    report_time_elapsed(start_time)
+    
     output_reads_path = path.join(output_directory, READS_FILENAME)
-    write_2d_iterable(reads_list, output_reads_path)
+    _write_events(story_id_dict, new_user_ids, input_reads_path,
+                  output_reads_path, READS_DESCRIPTOR)
     output_clickthroughs_path = path.join(output_directory,
                                           CLICKTHROUGHS_FILENAME)
-    write_2d_iterable(clickthroughs_list, output_clickthroughs_path)
+    _write_events(story_id_dict, new_user_ids, input_clickthroughs_path,
+                  output_clickthroughs_path, CLICKTHROUGHS_DESCRIPTOR)
     output_users_path = path.join(output_directory, USER_IDS_FILENAME)
-    write_iterable(user_ids_list, output_users_path)
+    write_iterable((old_user_id for old_user_id, is_marked in \
+                    enumerate(user_bitmap) if is_marked), output_users_path)
 
 if __name__ == "__main__":
     check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
@@ -20,12 +20,98 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 """
 
 import os, sys, htmllib, formatter, StringIO, re, HTMLParser, htmlentitydefs
-import socket, httplib, urllib2, time
+import socket, httplib, urllib2, time, codecs, multiprocessing
 try:
     import tidy
-except ImportError, e:
-    print "You need to install the Python wrapper for TidyLib."
-    raise
+except ImportError:
+    tidy = None # Only the Tidy extraction mode needs the TidyLib wrapper.
+
+TIDY_MODE = "tidy"
+STREAMING_MODE = "streaming"
+# The extraction modes.  TIDY_MODE reads the whole page, converts it to XHTML
+# with Tidy, and then parses the XHTML with a TextExtractor.  STREAMING_MODE
+# feeds the raw page to a TolerantTextExtractor as it is downloaded.
+
+DEFAULT_EXTRACTION_MODE = TIDY_MODE
+if tidy is None:
+    DEFAULT_EXTRACTION_MODE = STREAMING_MODE
+# The extraction mode used when none is given.
+
+DEFAULT_ENCODING = "utf-8"
+# The encoding assumed for pages whose Content-Type header names no known
+# charset.  Undecodable bytes are replaced.
+
+STREAM_CHUNK_SIZE = 16384
+# The number of bytes read from the network and fed to a TolerantTextExtractor
+# at once in STREAMING_MODE.
+
+EXTRACTION_CHUNK_SIZE = 8
+# The number of documents sent to a worker process at once by
+# extractFromDocuments.  Larger chunks cost less to dispatch, but leave workers
+# idle at the end of a batch while the last chunks finish.
+
+VOID_ELEMENTS = frozenset(['area', 'base', 'basefont', 'br', 'col', 'embed',
+                           'frame', 'hr', 'img', 'input', 'isindex', 'keygen',
+                           'link', 'meta', 'param', 'source', 'track', 'wbr'])
+# Elements that never have end tags, which Tidy writes as <br />, etc.
+
+_P_CLOSERS = frozenset(['address', 'article', 'aside', 'blockquote', 'center',
+                        'dir', 'div', 'dl', 'fieldset', 'figure', 'footer',
+                        'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+                        'main', 'menu', 'nav', 'ol', 'p', 'pre', 'section',
+                        'table', 'ul'])
+IMPLIED_END_TAGS = {'p': _P_CLOSERS,
+                    'li': frozenset(['li']),
+                    'dt': frozenset(['dt', 'dd']),
+                    'dd': frozenset(['dt', 'dd']),
+                    'option': frozenset(['option', 'optgroup']),
+                    'tr': frozenset(['tr', 'tbody', 'tfoot', 'thead']),
+                    'td': frozenset(['td', 'th', 'tr', 'tbody', 'tfoot']),
+                    'th': frozenset(['td', 'th', 'tr', 'tbody', 'tfoot']),
+                    'thead': frozenset(['tbody', 'tfoot']),
+                    'tbody': frozenset(['tbody', 'tfoot'])}
+# Maps from an element whose end tag may be omitted to the start tags that
+# close it when it is the innermost open element, as Tidy would.
+
+BLOCK_ELEMENTS = frozenset(['address', 'article', 'aside', 'blockquote', 'body',
+                            'caption', 'center', 'dd', 'dir', 'div', 'dl',
+                            'dt', 'fieldset', 'figcaption', 'figure', 'footer',
+                            'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'head',
+                            'header', 'html', 'legend', 'li', 'main', 'menu',
+                            'nav', 'noscript', 'ol', 'p', 'pre', 'section',
+                            'table', 'tbody', 'td', 'tfoot', 'th', 'thead',
+                            'title', 'tr', 'ul'])
+LINE_BREAK_ELEMENTS = frozenset(['br', 'hr'])
+# Tidy indents its output, which puts line breaks around block elements and
+# after line break elements.  A TolerantTextExtractor starts the first text
+# after any of these tags on a new line, so that words in neighbouring blocks
+# aren't run together.
+
+_SEPARATING_ELEMENTS = BLOCK_ELEMENTS | LINE_BREAK_ELEMENTS
+
+IGNORED_ELEMENTS = frozenset(['script', 'style', 'option', 'ul', 'li', 'legend',
+                              'object', 'noscript', 'label'])
+# Elements whose text is never part of the story.  'h1', 'h2', etc. were tried.
+
+RAW_TEXT_ELEMENTS = ('script', 'style')
+# Elements whose contents are not parsed, as in HTMLParser.
+
+_tokenPattern = re.compile(r"""
+    ([^<]+)                                     # 1: text
+  | <([a-zA-Z][-.a-zA-Z0-9:_]*)                 # 2: start tag name
+    ([^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*)>   # 3: attributes
+  | </\s*([a-zA-Z][-.a-zA-Z0-9:_]*)[^>]*>       # 4: end tag name
+  | <!--.*?--\s*>                               # comment
+  | <(?!!--)[!?][^>]*>                          # declaration or PI
+  | </(?:[^a-zA-Z>][^>]*)?>                     # bogus end tag
+""", re.S | re.X)
+_ignoredAttributePattern = re.compile('footer|copyright', re.I)
+_attributePattern = re.compile(r"""(?:^|[\s/"'])(id|class)\s*=\s*""" +
+                               r"""("[^"]*"|'[^']*'|[^\s>]*)""", re.I)
+_referencePattern = re.compile(r'&(?:#([0-9]{1,7}|[xX][0-9a-fA-F]{1,6})|' +
+                               r'([a-zA-Z][-.a-zA-Z0-9]*));?')
+_rawTextEndPatterns = dict((tag, re.compile(r'</\s*(%s)\s*>' % tag, re.I))
+                           for tag in RAW_TEXT_ELEMENTS)
 
 def unescapeHTMLEntities(text):
    """Removes HTML or XML character references 
@@ -54,6 +140,29 @@ def unescapeHTMLEntities(text):
       return text # leave as is
    return re.sub("&#?\w+;", fixup, text)
 
+def _unescapeCharref(name):
+    """
+    Returns the character that the character reference &#name; stands for,
+    where name is a decimal number or an 'x' and a hexadecimal number, or the
+    reference itself if it stands for no character.
+    """
+    try:
+        if name[0] in 'xX':
+            return unichr(int(name[1:], 16))
+        return unichr(int(name))
+    except (ValueError, OverflowError):
+        return '&#' + name + ';'
+
+def _unescapeEntityref(name):
+    """
+    Returns the character that the entity &name; stands for, or the entity
+    itself if it isn't a known HTML entity.
+    """
+    try:
+        return unichr(htmlentitydefs.name2codepoint[name])
+    except KeyError:
+        return '&' + name + ';'
+
 class TextExtractor(HTMLParser.HTMLParser):
     """
     Attempts to extract the main body of text from an HTML document.
@@ -63,32 +172,71 @@ class TextExtractor(HTMLParser.HTMLParser):
     The story text:
     1. Is the largest block of text in the document.
     2. Sections all exist at the same relative depth.
+    
+    Elements are numbered in the order in which they are opened, with the
+    document itself numbered 0, so comparing the numbers of two elements
+    compares their paths from the document.  Text is grouped into blocks by
+    the number of the element pathBlur levels above it.  The length of each
+    block is counted as text arrives, so that get_plaintext only has to join
+    and clean the blocks that may be the longest.
     """
     
     dom = []
-    path = [0]
     pathBlur = 5
     
     def __init__(self):
         HTMLParser.HTMLParser.__init__(self)
         self._ignore = False
-        self._ignorePath = None
+        self._ignoreNode = None
         self._lasttag = None
         self._depth = 0
-        self.depthText = {} # path:text
+        self._nodes = [0] # The numbers of the open elements.  Not shared with
+                          # other instances, which may be in use by other
+                          # threads.
+        self._indexes = [0] # The index of each element among its siblings.
+        self._texts = [] # Every text added to a block, in order.
+        
+        # element number:[length, tailLength, refs], where refs are indexes
+        # into _texts, or their complements for texts prefixed with '#'.
+        # length counts the characters from the first text in the block that
+        # get_plaintext can't strip as a header to the last that it can't
+        # strip as a footer, and tailLength those after that last text, so
+        # length is never less than the length of the block's plaintext.
+        self._blocks = {}
         self.counting = 0
         self.lastN = 0
+        self._currentBlocks = None # The blocks for text in the current element.
+        
+    def _openElement(self):
+        """
+        Numbers a new element inside the current one and makes it current.
+        """
+        self._nodes.append(len(self._indexes))
+        self._indexes.append(self.lastN)
+        self._depth += 1
+        self.lastN = 0
+        self._currentBlocks = None
+        
+    def _closeElement(self):
+        """
+        Makes the parent of the current element current, and stops ignoring
+        text if the current element was the first one ignored.
+        """
+        node = self._nodes.pop()
+        if self._ignore and node == self._ignoreNode:
+            self._ignore = False
+        self._depth -= 1
+        self.lastN = self._indexes[node] + 1
+        self._currentBlocks = None
         
     def handle_starttag(self, tag, attrs): 
         ignore0 = self._ignore
         tag = tag.lower()
-        if tag in ('script','style','option','ul','li','legend','object','noscript','label'): # 'h1','h2','h3','h4','h5','h6',
+        if tag in IGNORED_ELEMENTS:
             self._ignore = True
         attrd = dict(attrs)
         self._lasttag = tag.lower()
-        self._depth += 1
-        self.path += [self.lastN]
-        self.lastN = 0
+        self._openElement()
         
         # Ignore footer garbage.
         if 'id' in attrd and 'footer' in attrd['id'].lower():
@@ -101,21 +249,16 @@ class TextExtractor(HTMLParser.HTMLParser):
         elif 'class' in attrd and 'copyright' in attrd['class'].lower():
             self._ignore = True
             
-        # If we just started ignoring, then remember the initial path
+        # If we just started ignoring, then remember the initial element
         # so we can later know when to start un-ignoring again.
         if self._ignore and not ignore0:
-            self._ignorePath = tuple(self.path)
+            self._ignoreNode = self._nodes[-1]
             
     def handle_startendtag(self, tag, attrs):
         pass
     
     def handle_endtag(self, tag):
-        if self._ignore and tuple(self.path) == self._ignorePath:
-            self._ignore = False
-            
-        self._depth -= 1
-        self.lastN = self.path.pop()
-        self.lastN += 1
+        self._closeElement()
         
     def handle_data(self, data, entity=False):
         if len(data) > 0 and not self._ignore:
@@ -124,37 +267,75 @@ class TextExtractor(HTMLParser.HTMLParser):
             # indicates a copyright notice.
             if data.strip().lower().startswith('copyright') and not self._ignore:
                 self._ignore = True
-                self._ignorePath = tuple(self.path)
+                self._ignoreNode = self._nodes[-1]
                 return
             
             if data:
+                self._addText(data)
                 
-                rpath = tuple(self.path[:-self.pathBlur])
-                self.depthText.setdefault(rpath, [])
-                self.depthText[rpath] += [data]
-                
-                # Allow one more layer below, to include
-                # text inside <i></i> or <b></b> tags.
-                # Unfortuantely, this will include a lot of crap
-                # in the page's header and footer, so we'll
-                # prefix this text with '#' and strip these out later.
-                rpath2 = tuple(self.path[:-self.pathBlur-1])
-                self.depthText.setdefault(rpath2, [])
-                self.depthText[rpath2] += ['#'+data]
-                
+    def _addText(self, data):
+        """
+        Adds the given text to the block pathBlur levels above the current
+        element, and prefixed with '#' to the block one level further up.
+        """
+        blocks = self._currentBlocks
+        if blocks is None:
+            nodes = self._nodes
+            
+            # Allow one more layer below, to include
+            # text inside <i></i> or <b></b> tags.
+            # Unfortuantely, this will include a lot of crap
+            # in the page's header and footer, so we'll
+            # prefix this text with '#' and strip these out later.
+            keys = [None, None]
+            if len(nodes) > self.pathBlur:
+                keys[0] = nodes[-self.pathBlur-1]
+            if len(nodes) > self.pathBlur + 1:
+                keys[1] = nodes[-self.pathBlur-2]
+            blocks = self._currentBlocks = \
+                [self._blocks.setdefault(key, [0, 0, []]) for key in keys]
+            
+        ref = len(self._texts)
+        self._texts.append(data)
+        n = len(data)
+        block = blocks[0]
+        block[2].append(ref)
+        if data.isspace() or data.startswith('#'):
+            if block[0]:
+                block[1] += n
+        else:
+            block[0] += block[1] + n
+            block[1] = 0
+        block = blocks[1]
+        block[2].append(~ref)
+        if block[0]:
+            block[1] += n
+            
     def handle_charref(self, name):
         if name.isdigit():
-            text = unescapeHTMLEntities('&#'+name+';')
+            text = _unescapeCharref(name)
         else:
-            text = unescapeHTMLEntities('&'+name+';')
+            text = _unescapeEntityref(name)
         self.handle_data(text, entity=True)
                 
     def handle_entityref(self, name):
         self.handle_charref(name)
         
     def get_plaintext(self):
-        maxLen,maxPath,maxText,maxTextList = 0,None,'',[]
-        for path,textList in self.depthText.iteritems():
+        maxLen,maxNode,maxText = 0,None,''
+        
+        # Stripping never lengthens text, so visit the longest blocks first,
+        # and stop once no block left can win, even on length alone.
+        # Usually only the winner has to be joined and cleaned.
+        bounds = [(block[0], node) for node,block in self._blocks.iteritems()
+                  if block[0] > 0]
+        bounds.sort(reverse=True)
+        texts = self._texts
+        for bound,node in bounds:
+            if (bound, node) < (maxLen, maxNode):
+                break
+            textList = [(ref >= 0) and texts[ref] or ('#' + texts[~ref])
+                        for ref in self._blocks[node][2]]
             
             # Strip off header segments, prefixed with a '#'.
             start = True
@@ -186,7 +367,7 @@ class TextExtractor(HTMLParser.HTMLParser):
             text = text.replace(u'\u2019',"'")
             text = re.sub("[\\n\\s]+", " ", text).strip() # Compress whitespace.
             #text = re.sub("[\W]+", " ", text).strip() # Compress whitespace.
-            maxLen,maxPath,maxText,maxTextList = max((maxLen,maxPath,maxText,maxTextList), (len(text),path,text,textList))
+            maxLen,maxNode,maxText = max((maxLen,maxNode,maxText), (len(text),node,text))
         
         return maxText
     
@@ -194,6 +375,194 @@ class TextExtractor(HTMLParser.HTMLParser):
         # ignore all errors
         pass
 
+class TolerantTextExtractor(TextExtractor):
+    """
+    A TextExtractor that parses raw, possibly malformed HTML a chunk at a time.
+    
+    Raw bytes are decoded as they are fed, and are split into tags, text, and
+    references by a single regular expression rather than by HTMLParser.  The
+    tree is repaired as Tidy would repair it: void elements are treated as
+    empty, omitted end tags are implied, and stray end tags are ignored.
+    Whitespace between words is kept, but runs of whitespace aren't stored as
+    text of their own, so get_plaintext returns nearly what a TextExtractor
+    returns for the output of tidyHTML, with less work.
+    """
+    
+    def __init__(self, encoding=None):
+        TextExtractor.__init__(self)
+        try:
+            decoder = codecs.getincrementaldecoder(encoding or
+                                                   DEFAULT_ENCODING)
+        except LookupError:
+            decoder = codecs.getincrementaldecoder(DEFAULT_ENCODING)
+        self._decoder = decoder('replace')
+        self._text = u''
+        self._openTags = []
+        self._numOpen = {} # tag:number of open elements with the tag
+        self._rawTextEnd = None
+        self._separate = False # Whether the next text starts a new word.
+        
+    def feed(self, data):
+        self._text += self._decoder.decode(data)
+        self._parse(False)
+        
+    def close(self):
+        self._text += self._decoder.decode('', True)
+        self._parse(True)
+        
+    def _parse(self, final):
+        """
+        Handles every complete construct in the text fed so far, and all of
+        the remaining text if final is True.
+        """
+        text = self._text
+        n = len(text)
+        pos = 0
+        matchToken = _tokenPattern.match
+        handleData = self.handle_data
+        while pos < n:
+            if self._rawTextEnd is not None:
+                match = self._rawTextEnd.search(text, pos)
+                if match is None:
+                    # Only the last '<' may begin an end tag that hasn't been
+                    # fed yet, so don't search the text before it again.
+                    end = text.rfind('<', pos)
+                    if final or (end < 0):
+                        end = n
+                    if pos < end:
+                        handleData(text[pos:end])
+                        pos = end
+                    break
+                if pos < match.start():
+                    handleData(text[pos:match.start()])
+                self._rawTextEnd = None
+                self._endTag(match.group(1).lower())
+                pos = match.end()
+                continue
+            
+            match = matchToken(text, pos)
+            if match is None:
+                # A '<' that doesn't begin a complete construct.
+                nextChar = text[pos + 1:pos + 2]
+                if nextChar and not (nextChar.isalpha() or nextChar in '/!?'):
+                    handleData('<')
+                    pos += 1
+                    continue
+                if final:
+                    pos = n # Drop an unterminated construct, as Tidy does.
+                break
+            
+            kind = match.lastindex
+            end = match.end()
+            if kind == 1:
+                if (end == n) and not final:
+                    break # The text may continue in the next chunk.
+                data = match.group(1)
+                if data.isspace():
+                    self._separate = True
+                elif '&' in data:
+                    self._handleText(data)
+                else:
+                    handleData(data)
+            elif kind == 3:
+                self._startTag(match.group(2).lower(), match.group(3))
+            elif kind == 4:
+                self._endTag(match.group(4).lower())
+            pos = end
+        self._text = text[pos:]
+        
+    def _handleText(self, text):
+        """
+        Passes the given text to handle_data, with the character and entity
+        references in it passed separately, as HTMLParser would.
+        Hexadecimal character references are decoded too, as Tidy does.
+        """
+        i = 0
+        for match in _referencePattern.finditer(text):
+            if i < match.start():
+                self.handle_data(text[i:match.start()])
+            if match.group(1) is not None:
+                self.handle_data(_unescapeCharref(match.group(1).lower()),
+                                 True)
+            else:
+                self.handle_entityref(match.group(2))
+            i = match.end()
+        if i < len(text):
+            self.handle_data(text[i:])
+            
+    def handle_data(self, data, entity=False):
+        if self._ignore or not data:
+            return
+        if data.isspace():
+            self._separate = True
+            return
+        
+        # Skip blocks of text beginning with 'copyright', as TextExtractor does.
+        if data.lstrip()[:9].lower() == 'copyright':
+            self._ignore = True
+            self._ignoreNode = self._nodes[-1]
+            return
+        
+        if self._separate:
+            data = u' ' + data
+            self._separate = False
+        self._addText(data)
+        
+    def _startTag(self, tag, attributeText):
+        """
+        Handles a start tag as TextExtractor.handle_starttag does, after
+        ending the elements that it implicitly closes.
+        """
+        if tag in _SEPARATING_ELEMENTS:
+            self._separate = True
+        if attributeText.endswith('/') or (tag in VOID_ELEMENTS):
+            return
+        openTags = self._openTags
+        while openTags and (tag in IMPLIED_END_TAGS.get(openTags[-1], ())):
+            self._closeInnermost()
+        openTags.append(tag)
+        self._numOpen[tag] = self._numOpen.get(tag, 0) + 1
+        
+        ignore0 = self._ignore
+        if tag in IGNORED_ELEMENTS:
+            self._ignore = True
+        elif attributeText and _ignoredAttributePattern.search(attributeText):
+            # Ignore footer garbage.
+            for name, value in _attributePattern.findall(attributeText):
+                value = value.lower()
+                if ('footer' in value) or ('copyright' in value):
+                    self._ignore = True
+        self._lasttag = tag
+        self._openElement()
+        if self._ignore and not ignore0:
+            self._ignoreNode = self._nodes[-1]
+        if tag in RAW_TEXT_ELEMENTS:
+            self._rawTextEnd = _rawTextEndPatterns[tag]
+            
+    def _endTag(self, tag):
+        """
+        Handles an end tag, ending any elements that it implicitly closes, or
+        ignores it if the element isn't open.
+        """
+        openTags = self._openTags
+        if openTags and (openTags[-1] == tag):
+            self._closeInnermost()
+        elif self._numOpen.get(tag):
+            while self._closeInnermost() != tag:
+                pass
+            
+    def _closeInnermost(self):
+        """
+        Ends the innermost open element as TextExtractor.handle_endtag does,
+        and returns its tag.
+        """
+        tag = self._openTags.pop()
+        self._numOpen[tag] -= 1
+        if tag in BLOCK_ELEMENTS:
+            self._separate = True
+        self._closeElement()
+        return tag
+
 class HTMLParserNoFootNote(htmllib.HTMLParser):
     """
     Ignores link footnotes, image tags, and other useless things.
@@ -227,6 +596,16 @@ class HTMLParserNoFootNote(htmllib.HTMLParser):
             data = ' '.join(self.textPattern.findall(data))
         htmllib.HTMLParser.handle_data(self, data)
     
+def cleanPlaintext(text):
+    """
+    Removes punctuation and whitespace noise from extracted text.
+    """
+    text = re.sub("\s[\(\),;\.\?\!](?=\s)", " ", text).strip() # Remove stand-alone punctuation.
+    text = re.sub("[\n\s]+", " ", text).strip() # Compress whitespace.
+    text = re.sub("\-{2,}", "", text).strip() # Remove consequetive dashes.
+    text = re.sub("\.{2,}", "", text).strip() # Remove consequetive periods.
+    return text
+
 def extractFromHTML(html):
     """
     Extracts text from HTML content.
@@ -244,18 +623,30 @@ def extractFromHTML(html):
         return None
     
     p.close()
-    text = p.get_plaintext()
-    
-    text = re.sub("\s[\(\),;\.\?\!](?=\s)", " ", text).strip() # Remove stand-alone punctuation.
-    text = re.sub("[\n\s]+", " ", text).strip() # Compress whitespace.
-    text = re.sub("\-{2,}", "", text).strip() # Remove consequetive dashes.
-    text = re.sub("\.{2,}", "", text).strip() # Remove consequetive periods.
-    return text
+    return cleanPlaintext(p.get_plaintext())
+
+def extractFromStream(stream, encoding=None):
+    """
+    Extracts text from a file-like object of raw HTML without Tidy, feeding
+    each chunk to a TolerantTextExtractor as soon as it has been read.
+    encoding is the charset of the HTML, or None for DEFAULT_ENCODING.
+    """
+    p = TolerantTextExtractor(encoding)
+    while True:
+        data = stream.read(STREAM_CHUNK_SIZE)
+        if not data:
+            break
+        p.feed(data)
+    p.close()
+    return cleanPlaintext(p.get_plaintext())
 
 def tidyHTML(dirtyHTML):
     """
     Runs an arbitrary HTML string through Tidy.
     """
+    if tidy is None:
+        raise ImportError("You need to install the Python wrapper for " +
+                          "TidyLib to use Tidy.")
     file = StringIO.StringIO()
     options = dict(output_xhtml=1, add_xml_decl=1, indent=1, tidy_mark=1)
     html = tidy.parseString(dirtyHTML, **options)
@@ -263,22 +654,163 @@ def tidyHTML(dirtyHTML):
     html = file.getvalue()
     return html
 
-def extractFromURL(url):
+def _toStr(extracted_content):
     """
-    Extracts text from a URL.
+    Returns the extracted text as a str, or None if it isn't ASCII.
+    """
+    try:
+        return str(extracted_content)
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return None
+
+def extractFromDocument(html, mode=None, encoding=None):
+    """
+    Extracts text from a whole HTML document, as extractFromURL would if the
+    document had been downloaded with the given mode and charset.  In
+    TIDY_MODE, the document is converted to XHTML with Tidy first.
     """
+    if mode is None:
+        mode = DEFAULT_EXTRACTION_MODE
     try:
-        stream = urllib2.urlopen(url)
-        html = stream.read()
-        stream.close()
-    except (ValueError, IOError, httplib.InvalidURL, httplib.BadStatusLine,
-            socket.timeout, socket.error):
+        if mode == TIDY_MODE:
+            extracted_content = extractFromHTML(tidyHTML(html))
+        elif mode == STREAMING_MODE:
+            extracted_content = extractFromStream(StringIO.StringIO(html),
+                                                  encoding)
+        else:
+            raise ValueError("Unknown extraction mode: %s" % mode)
+    except UnicodeError:
+        return None
+    return _toStr(extracted_content)
+
+def _extractFromDocumentTuple(document, mode):
+    """
+    Extracts text from a (url, html) or (url, html, encoding) tuple with
+    extractFromDocument.  Returns None if html is None.
+    """
+    html = document[1]
+    if html is None:
         return None
+    encoding = None
+    if len(document) > 2:
+        encoding = document[2]
+    return extractFromDocument(html, mode, encoding)
+
+def _extractFromDocumentChunk(args):
+    """
+    Extracts text from each document in a chunk in a worker process of
+    extractFromDocuments.  args is a (documents, mode) tuple, so that the chunk
+    can be pickled as a single task.
+    """
+    documents, mode = args
+    return [_extractFromDocumentTuple(document, mode) for document in documents]
+
+def _chunkDocuments(documents, mode, chunkSize):
+    """
+    Groups the given documents into (documents, mode) tasks for
+    _extractFromDocumentChunk of at most chunkSize documents each.
+    """
+    chunk = []
+    for document in documents:
+        chunk.append(document)
+        if len(chunk) >= chunkSize:
+            yield (chunk, mode)
+            chunk = []
+    if chunk:
+        yield (chunk, mode)
+
+def extractFromDocuments(documents, mode=None, numProcesses=None,
+                         chunkSize=EXTRACTION_CHUNK_SIZE):
+    """
+    Extracts text from many downloaded documents in a pool of processes.
     
-    # Convert content to XHTML.
-    html = tidyHTML(html)
-    extracted_content = extractFromHTML(html)
+    documents is an iterable of (url, html) pairs, or (url, html, encoding)
+    triples such as those built from the results of downloadDocument, where
+    html is None for pages that couldn't be downloaded.  Returns a list of
+    (url, text) pairs in the same order, where text is what
+    extractFromDocument returns for the document, or None if html is None.
+    mode is TIDY_MODE, STREAMING_MODE, or None for DEFAULT_EXTRACTION_MODE.
+    numProcesses is the number of worker processes, or None for one per CPU.
+    If 1, then the documents are extracted serially in the current process.
+    Documents are sent to the workers chunkSize at a time.
+    """
+    if mode is None:
+        mode = DEFAULT_EXTRACTION_MODE
+    if mode not in (TIDY_MODE, STREAMING_MODE):
+        raise ValueError("Unknown extraction mode: %s" % mode)
+    if numProcesses is None:
+        numProcesses = multiprocessing.cpu_count()
+    if (numProcesses < 1) or (chunkSize < 1):
+        raise ValueError("numProcesses and chunkSize must both be positive.")
+    documents = list(documents)
+    if numProcesses == 1:
+        return [(document[0], _extractFromDocumentTuple(document, mode))
+                for document in documents]
+    
+    texts = []
+    pool = multiprocessing.Pool(numProcesses)
     try:
-        return str(extracted_content)
-    except (UnicodeEncodeError, UnicodeDecodeError):
+        for chunkTexts in pool.imap(_extractFromDocumentChunk,
+                                    _chunkDocuments(documents, mode,
+                                                    chunkSize)):
+            texts.extend(chunkTexts)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return [(documents[i][0], texts[i]) for i in range(len(documents))]
+
+def downloadDocument(url, urlopen=None):
+    """
+    Downloads the page at a URL without extracting its text, so that it can be
+    extracted later, for example by extractFromDocuments.
+    
+    Returns an (html, encoding) tuple, where encoding is the charset named by
+    the Content-Type header or None, or (None, None) if the page couldn't be
+    downloaded.
+    urlopen is the function that opens the URL, such as the urlopen method of
+    an http_fetcher.HttpFetcher, or None for urllib2.urlopen.
+    """
+    if urlopen is None:
+        urlopen = urllib2.urlopen
+    try:
+        stream = urlopen(url)
+        try:
+            return (stream.read(), stream.info().getparam("charset"))
+        finally:
+            stream.close()
+    except (ValueError, IOError, httplib.HTTPException, socket.timeout,
+            socket.error):
+        return (None, None)
+
+def extractFromURL(url, mode=None, urlopen=None):
+    """
+    Extracts text from a URL.
+    
+    mode is TIDY_MODE, STREAMING_MODE, or None for DEFAULT_EXTRACTION_MODE.
+    In STREAMING_MODE, the page is parsed as it is downloaded and Tidy is not
+    needed.
+    urlopen is the function that opens the URL, such as the urlopen method of
+    an http_fetcher.HttpFetcher, or None for urllib2.urlopen.
+    """
+    if urlopen is None:
+        urlopen = urllib2.urlopen
+    if mode is None:
+        mode = DEFAULT_EXTRACTION_MODE
+    if mode not in (TIDY_MODE, STREAMING_MODE):
+        raise ValueError("Unknown extraction mode: %s" % mode)
+    if mode == TIDY_MODE:
+        html = downloadDocument(url, urlopen)[0]
+        if html is None:
+            return None
+        return extractFromDocument(html, TIDY_MODE)
+    try:
+        stream = urlopen(url)
+        try:
+            return _toStr(extractFromStream(
+                stream, stream.info().getparam("charset")))
+        finally:
+            stream.close()
+    except (ValueError, IOError, httplib.HTTPException, socket.timeout,
+            socket.error, UnicodeError):
         return None
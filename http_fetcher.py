@@ -0,0 +1,886 @@
+#!/usr/bin/python2.5
+"""Contains an HTTP client that reuses connections and DNS lookups across
+fetches and gives up early on responses that aren't worth downloading.
+
+DnsCache remembers the addresses to which host names resolve for a fixed time.
+CircuitBreaker stops requests to hosts that seem to be down.
+HttpFetcher opens URLs like urllib2.urlopen, but keeps persistent connections
+to each host open between fetches, resolves host names with a DnsCache, and
+skips responses with the wrong status or content type, or that are too large or
+too slow to download, and hosts whose CircuitBreaker is open.
+FetchSkipped is raised when a fetch is skipped.
+raise_host_down wraps the urlopen method of an HttpFetcher so that it raises
+HostDown, which isn't an IOError, for fetches skipped because the host seems to
+be down.
+"""
+
+import time, socket, threading, httplib, urllib, urllib2, urlparse
+
+DNS_CACHE_TTL = 5 * 60
+"""The number of seconds for which a DnsCache remembers the addresses of a host.
+The resolver doesn't report the TTLs of DNS records, so every lookup is
+remembered for the same time.
+"""
+
+DNS_FAILURE_TTL = 60
+"""The number of seconds for which a DnsCache remembers that a host name could
+not be resolved.
+"""
+
+MAX_IDLE_CONNECTIONS_PER_HOST = 4
+"""The largest number of idle connections to the same host that an HttpFetcher
+keeps open for reuse.  This should be at least the number of threads that fetch
+from the same host at once.
+"""
+
+IDLE_CONNECTION_TIMEOUT = 15
+"""The number of seconds after which an idle connection is closed rather than
+reused, since servers close idle keep-alive connections after a while.
+"""
+
+MAX_CONSECUTIVE_FAILURES = 5
+"""The default number of consecutive requests to a host that must fail to
+connect or time out before a CircuitBreaker stops sending requests to it.
+"""
+
+FAILURE_COOLDOWN = 10 * 60
+"""The default number of seconds after which a CircuitBreaker lets a single
+request through to a host that it has stopped, to see whether it is back.
+"""
+
+MAX_REDIRECTS = 10
+"""The largest number of redirects followed for a single URL, as in urllib2."""
+
+MAX_DRAINED_BODY_SIZE = 64 * 1024
+"""The largest body of a redirect or error response that is read and discarded
+so that its connection can be reused.  Connections with larger bodies are
+closed instead.
+"""
+
+MAX_BODY_SIZE = 4 * 1024 * 1024
+"""The default largest number of bytes of a body that an HttpFetcher downloads.
+Responses whose Content-Length is larger are skipped before their bodies are
+read, and other responses as soon as they exceed it.
+"""
+
+FETCH_DEADLINE = 60
+"""The default number of seconds within which an HttpFetcher must fetch a URL,
+including any redirects and the whole body, before it skips the URL.
+"""
+
+ACCEPTED_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+"""The default media types of the responses whose bodies an HttpFetcher reads.
+Responses without a Content-Type header are read too.
+"""
+
+READ_SIZE = 16 * 1024
+# The number of bytes read at once when a whole body is read.
+
+USER_AGENT = "Python-urllib/%s" % urllib2.__version__
+# The User-Agent header sent with each request, which is the same as urllib2's.
+
+SKIPPED_STATUS = "status"
+SKIPPED_CONTENT_TYPE = "content_type"
+SKIPPED_SIZE = "size"
+SKIPPED_DEADLINE = "deadline"
+SKIPPED_HOST_DOWN = "host_down"
+SKIP_REASONS = (SKIPPED_STATUS, SKIPPED_CONTENT_TYPE, SKIPPED_SIZE,
+                SKIPPED_DEADLINE, SKIPPED_HOST_DOWN)
+"""The reasons for which an HttpFetcher skips a URL: the response had an error
+status, the response had a content type that isn't accepted, the body was too
+large, the deadline passed, or the circuit breaker of the host was open.
+"""
+
+_REDIRECT_STATUSES = (301, 302, 303, 307)
+# The statuses of the responses that urllib2 follows to another URL.
+
+class FetchSkipped(urllib2.URLError):
+    """Raised when an HttpFetcher gives up on a URL before reading all of its
+    body, or without requesting it at all.
+
+    reason is one of SKIP_REASONS, and url is the URL that was being fetched
+    when the fetch was skipped.
+    """
+
+    def __init__(self, reason, url):
+        urllib2.URLError.__init__(self, reason)
+        self.url = url
+
+    def __str__(self):
+        return "<urlopen skipped %s: %s>" % (self.url, self.reason)
+
+class HostDown(Exception):
+    """Raised instead of FetchSkipped with reason SKIPPED_HOST_DOWN by the
+    functions that raise_host_down returns.
+
+    Unlike FetchSkipped, it isn't an IOError, so callers such as html2text,
+    which take every IOError to mean that a page can't be fetched, let it
+    through.  The URL was never requested, so it may well be fetched once the
+    host is back.  url is the URL that was not requested.
+    """
+
+    def __init__(self, url):
+        Exception.__init__(self, url)
+        self.url = url
+
+class DnsCache(object):
+    """An in-process cache of the addresses to which host names resolve.
+
+    Each successful lookup is remembered for ttl seconds, and each failed
+    lookup for failure_ttl seconds.  All methods may be called from several
+    threads at once.  Threads that miss the cache for the same host at the same
+    time each look it up.
+    """
+
+    def __init__(self, ttl = DNS_CACHE_TTL, failure_ttl = DNS_FAILURE_TTL):
+        """Create an empty cache.
+
+        ttl, a number, is the number of seconds for which a successful lookup
+        is remembered.
+        failure_ttl, a number, is the number of seconds for which a failed
+        lookup is remembered.
+        """
+        self._ttl = ttl
+        self._failure_ttl = failure_ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def resolve(self, host, port):
+        """Return the addresses of the given host as a list of tuples.
+
+        The tuples are those returned by socket.getaddrinfo for a TCP
+        connection to the given port.  Raise socket.gaierror if the host name
+        could not be resolved.
+        """
+        key = (host, port)
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if (entry is not None) and (entry[0] > now):
+                self.num_hits += 1
+            else:
+                entry = None
+                self.num_misses += 1
+        finally:
+            self._lock.release()
+
+        if entry is None:
+            try:
+                entry = (now + self._ttl,
+                         socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM),
+                         None)
+            except socket.gaierror, e:
+                entry = (now + self._failure_ttl, None, e.args)
+            self._lock.acquire()
+            try:
+                self._entries[key] = entry
+            finally:
+                self._lock.release()
+        if entry[2] is not None:
+            raise socket.gaierror(*entry[2])
+        return entry[1]
+
+    def invalidate(self, host, port):
+        """Forget the addresses of the given host, if they are cached."""
+        self._lock.acquire()
+        try:
+            self._entries.pop((host, port), None)
+        finally:
+            self._lock.release()
+
+class CircuitBreaker(object):
+    """Stops requests to hosts that seem to be down.
+
+    Each host starts closed, which lets every request through.  Once
+    max_failures requests in a row to a host have failed to connect or timed
+    out, the host is open, and requests to it are refused without waiting for
+    it.  After cooldown seconds, the host is half-open: a single trial request
+    is let through, while others are still refused.  If the trial succeeds,
+    then the host is closed again, and if it fails, then the host stays open
+    for another cooldown.  All methods may be called from several threads at
+    once.
+    """
+
+    def __init__(self, max_failures = MAX_CONSECUTIVE_FAILURES,
+                 cooldown = FAILURE_COOLDOWN):
+        """Create a breaker with every host closed.
+
+        max_failures, an int, is the number of consecutive failures after
+        which a host is opened.
+        cooldown, a number, is the number of seconds after which an open host
+        lets a trial request through.
+        """
+        if max_failures < 1:
+            raise ValueError("max_failures is %d but must be positive." %
+                             max_failures)
+        self._max_failures = max_failures
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        # Maps from each host with failures since its last success to a
+        # [num_failures, time_opened, is_trial_running] list, where
+        # time_opened is None while the host is closed.
+        self._failures = {}
+        self.num_trips = 0
+        self.num_refusals = 0
+
+    def allow(self, host):
+        """Return True if a request to the given host may be sent, and False
+        if it must be refused.
+
+        host is any hashable value that identifies a host, such as a (name,
+        port) tuple.  Every allowed request must be followed by a call to
+        record_success or record_failure.
+        """
+        self._lock.acquire()
+        try:
+            failures = self._failures.get(host)
+            if (failures is None) or (failures[1] is None):
+                return True
+            if (not failures[2]) and \
+                    (time.time() - failures[1] >= self._cooldown):
+                failures[2] = True
+                return True
+            self.num_refusals += 1
+            return False
+        finally:
+            self._lock.release()
+
+    def record_success(self, host):
+        """Record that a request to the given host got a response, which
+        closes the host.
+        """
+        self._lock.acquire()
+        try:
+            self._failures.pop(host, None)
+        finally:
+            self._lock.release()
+
+    def record_failure(self, host):
+        """Record that a request to the given host failed to connect or timed
+        out, which opens the host after max_failures failures in a row or
+        after a failed trial.
+        """
+        self._lock.acquire()
+        try:
+            failures = self._failures.setdefault(host, [0, None, False])
+            failures[0] += 1
+            if failures[2]:
+                failures[1] = time.time()
+                failures[2] = False
+            elif (failures[1] is None) and \
+                    (failures[0] >= self._max_failures):
+                failures[1] = time.time()
+                self.num_trips += 1
+        finally:
+            self._lock.release()
+
+def _get_timeout(deadline):
+    """Return the socket timeout to use for an operation that must finish by
+    the given deadline.
+
+    This is the default timeout set with socket.setdefaulttimeout, as in
+    urllib2, or the number of seconds left before the deadline if that is less.
+    deadline is a time in seconds since the Unix epoch, or None if there is
+    none.
+    """
+    timeout = socket.getdefaulttimeout()
+    if deadline is not None:
+        remaining = max(deadline - time.time(), 0.001)
+        if (timeout is None) or (remaining < timeout):
+            timeout = remaining
+    return timeout
+
+def _get_content_length(headers):
+    """Return the Content-Length in the given headers as an int, or None if it
+    is missing or malformed.
+    """
+    try:
+        content_length = int(headers.get("content-length", ""))
+    except ValueError:
+        return None
+    if content_length < 0:
+        return None
+    return content_length
+
+def _open_socket(dns_cache, host, port, timeout):
+    """Return a socket connected to the given host, resolved with dns_cache.
+
+    Each address of the host is tried in turn, as in socket.create_connection,
+    and the socket has the given timeout.  If no address accepts a connection,
+    then the host is removed from the cache, since it may have moved, and
+    socket.error is raised.
+    """
+    error = socket.error("No addresses found for %s." % host)
+    for family, socket_type, protocol, canonical_name, address in \
+            dns_cache.resolve(host, port):
+        sock = None
+        try:
+            sock = socket.socket(family, socket_type, protocol)
+            sock.settimeout(timeout)
+            sock.connect(address)
+            return sock
+        except socket.error, error:
+            if sock is not None:
+                sock.close()
+    dns_cache.invalidate(host, port)
+    raise error
+
+class _DeadlineSocket(object):
+    """Wraps a socket so that no receive waits past a deadline.
+
+    Reading a response from a file object made by socket.makefile receives
+    until it has as many bytes as were asked for, so the socket timeout alone
+    doesn't stop a server that sends a few bytes at a time.  Before each
+    receive, the timeout is shortened to the time left before the deadline,
+    so a receive after the deadline raises socket.timeout at once.  deadline
+    is a time in seconds since the Unix epoch, or None if there is none.
+    httplib closes the socket of a connection while a response that ends when
+    the connection closes is still being read, so the socket is closed only
+    once it and every file object made from it have been closed, as in
+    ssl.SSLSocket.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._num_files = 0
+        self.deadline = None
+
+    def recv(self, *args):
+        self._sock.settimeout(_get_timeout(self.deadline))
+        return self._sock.recv(*args)
+
+    def makefile(self, mode = "r", bufsize = -1):
+        self._num_files += 1
+        return socket._fileobject(self, mode, bufsize, close=True)
+
+    def close(self):
+        if self._num_files > 0:
+            self._num_files -= 1
+        else:
+            self._sock.close()
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+class _CachedHTTPConnection(httplib.HTTPConnection):
+    """An HTTPConnection that resolves its host with a DnsCache and never waits
+    past the deadline set with set_deadline.
+    """
+
+    def __init__(self, host, port, dns_cache):
+        httplib.HTTPConnection.__init__(self, host, port)
+        self._dns_cache = dns_cache
+        self._deadline = None
+
+    def set_deadline(self, deadline):
+        """Set the deadline of the next request, in seconds since the Unix
+        epoch, or None if there is none.
+        """
+        _set_deadline(self, deadline)
+
+    def connect(self):
+        self.sock = _DeadlineSocket(_open_socket(
+            self._dns_cache, self.host, self.port,
+            _get_timeout(self._deadline)))
+        self.sock.deadline = self._deadline
+
+_CONNECTION_CLASSES = {"http": _CachedHTTPConnection}
+# The connection class for each URL scheme that an HttpFetcher opens itself.
+
+if hasattr(httplib, "HTTPSConnection"):
+    import ssl
+
+    class _CachedHTTPSConnection(httplib.HTTPSConnection):
+        """An HTTPSConnection that resolves its host with a DnsCache and never
+        waits past the deadline set with set_deadline.
+        """
+
+        def __init__(self, host, port, dns_cache):
+            httplib.HTTPSConnection.__init__(self, host, port)
+            self._dns_cache = dns_cache
+            self._deadline = None
+
+        def set_deadline(self, deadline):
+            """Set the deadline of the next request, in seconds since the Unix
+            epoch, or None if there is none.
+            """
+            _set_deadline(self, deadline)
+
+        def connect(self):
+            sock = _open_socket(self._dns_cache, self.host, self.port,
+                                _get_timeout(self._deadline))
+            # Newer versions of httplib verify certificates with a context,
+            # as urllib2 does.
+            context = getattr(self, "_context", None)
+            if context is None:
+                sock = ssl.wrap_socket(sock, self.key_file, self.cert_file)
+            else:
+                sock = context.wrap_socket(sock, server_hostname=self.host)
+            self.sock = _DeadlineSocket(sock)
+            self.sock.deadline = self._deadline
+
+    _CONNECTION_CLASSES["https"] = _CachedHTTPSConnection
+
+def _set_deadline(connection, deadline):
+    """Set the deadline of the next request over the given connection, and of
+    its socket if it is connected.
+    """
+    connection._deadline = deadline
+    if connection.sock is not None:
+        connection.sock.deadline = deadline
+        connection.sock.settimeout(_get_timeout(deadline))
+
+class _FetchedResponse(object):
+    """A file-like object for a response from an HttpFetcher.
+
+    It behaves like the object returned by urllib2.urlopen, but raises
+    FetchSkipped if the body grows larger than the fetcher's maximum size or
+    the deadline of the fetch passes while it is read.  The response either
+    came over one of the fetcher's connections, which is returned to the
+    fetcher for reuse when the response is closed if the body was read
+    completely, or was opened with urllib2.  Only the reads of a response over
+    one of the fetcher's connections are cut short at the deadline; a response
+    opened with urllib2 is checked against it between reads.
+    """
+
+    def __init__(self, fetcher, url, response, start_time, deadline,
+                 key = None, connection = None):
+        self._fetcher = fetcher
+        self._url = url
+        self._response = response
+        self._start_time = start_time
+        self._deadline = deadline
+        self._key = key
+        self._connection = connection
+        if connection is None:
+            self.code = response.getcode()
+            self.headers = response.info()
+        else:
+            self.code = response.status
+            self.headers = response.msg
+        self._content_length = _get_content_length(self.headers)
+        self._num_bytes_read = 0
+        self._is_complete = False
+
+    def read(self, amt = None):
+        """Return at most amt bytes of the body, or all of it if amt is
+        None.
+        """
+        if amt is None:
+            chunks = []
+            while True:
+                chunk = self.read(READ_SIZE)
+                if chunk == "":
+                    return "".join(chunks)
+                chunks.append(chunk)
+        if self._is_complete:
+            return ""
+
+        if (self._deadline is not None) and (time.time() >= self._deadline):
+            self._skip(SKIPPED_DEADLINE)
+        try:
+            chunk = self._response.read(amt)
+        except socket.timeout:
+            if (self._deadline is not None) and \
+                    (time.time() >= self._deadline):
+                self._skip(SKIPPED_DEADLINE)
+            raise
+        self._num_bytes_read += len(chunk)
+        max_body_size = self._fetcher.max_body_size
+        if (max_body_size is not None) and \
+                (self._num_bytes_read > max_body_size):
+            self._skip(SKIPPED_SIZE)
+        if (chunk == "") or (self._num_bytes_read == self._content_length):
+            self._is_complete = True
+            self._fetcher._count_download(self._num_bytes_read,
+                                          time.time() - self._start_time)
+        return chunk
+
+    def _skip(self, reason):
+        """Record that the fetch was skipped for the given reason and raise
+        FetchSkipped.
+        """
+        num_bytes_avoided = 0
+        if self._content_length is not None:
+            num_bytes_avoided = max(0, self._content_length -
+                                    self._num_bytes_read)
+        self._fetcher._count_skip(reason, num_bytes_avoided)
+        raise FetchSkipped(reason, self._url)
+
+    def info(self):
+        """Return the headers of the response as a mimetools.Message."""
+        return self.headers
+
+    def geturl(self):
+        """Return the URL of the response, after any redirects."""
+        return self._url
+
+    def getcode(self):
+        """Return the HTTP status code of the response."""
+        return self.code
+
+    def close(self):
+        """Close the response and release its connection."""
+        if self._connection is not None:
+            self._fetcher._release(self._key, self._connection,
+                                   self._response)
+            self._connection = None
+        elif self._response is not None:
+            self._response.close()
+        self._response = None
+
+class HttpFetcher(object):
+    """Opens HTTP and HTTPS URLs over persistent connections.
+
+    urlopen behaves like urllib2.urlopen: it follows redirects and raises
+    urllib2.HTTPError for responses with other statuses outside of 2xx.  When
+    a response is closed after its body has been read completely, its
+    connection is kept open for the next request to the same host, unless the
+    server asked for it to be closed.  At most max_idle_connections_per_host
+    idle connections are kept for each host.  Host names are resolved with a
+    DnsCache.  URLs with other schemes, and every URL when a proxy is
+    configured in the environment, are opened with urllib2.urlopen instead.
+    If the fetcher has a CircuitBreaker, then the requests that the fetcher
+    sends itself are recorded in it and skipped while it refuses their host.
+
+    Fetches are skipped, raising FetchSkipped or urllib2.HTTPError, as soon as
+    the status or headers of a response show that its body isn't wanted or is
+    too large, when the body grows too large, or when the deadline passes.
+    The number of fetches skipped for each reason and the bytes that their
+    Content-Length headers declared but that weren't downloaded are counted,
+    as are the bytes and seconds taken by complete downloads, so that
+    get_skip_summary can estimate what skipping saved.
+
+    All methods may be called from several threads at once.  The caller must
+    call close to close the idle connections.
+    """
+
+    def __init__(self, dns_cache = None,
+                 max_idle_connections_per_host = MAX_IDLE_CONNECTIONS_PER_HOST,
+                 max_body_size = MAX_BODY_SIZE, deadline = FETCH_DEADLINE,
+                 accepted_content_types = ACCEPTED_CONTENT_TYPES,
+                 circuit_breaker = None):
+        """Create a fetcher with no open connections.
+
+        dns_cache, a DnsCache, resolves host names.  If None, then a new
+        DnsCache with the default TTLs is used.
+        max_idle_connections_per_host, an int, is the largest number of idle
+        connections to the same host kept open for reuse.
+        max_body_size, an int, is the largest number of bytes of a body to
+        download, or None for no limit.
+        deadline, a number, is the number of seconds within which each URL
+        must be fetched, or None for no limit.  The default socket timeout
+        still bounds each wait for a server.
+        accepted_content_types, a sequence of str, holds the lowercase media
+        types of the responses whose bodies are read, or is None to read the
+        bodies of responses of every type.
+        circuit_breaker, a CircuitBreaker, stops requests to hosts that seem
+        to be down, or is None to always send requests.
+        """
+        if dns_cache is None:
+            dns_cache = DnsCache()
+        self.dns_cache = dns_cache
+        self._max_idle_connections_per_host = max_idle_connections_per_host
+        self.max_body_size = max_body_size
+        self.deadline = deadline
+        self.accepted_content_types = accepted_content_types
+        self.circuit_breaker = circuit_breaker
+        self._proxies = urllib.getproxies()
+        self._lock = threading.Lock()
+        self._idle_connections = {}
+        self.num_connections_opened = 0
+        self.num_connections_reused = 0
+        self.skip_counts = dict([(reason, 0) for reason in SKIP_REASONS])
+        self.num_bytes_avoided = 0
+        self.num_downloads = 0
+        self.num_bytes_downloaded = 0
+        self.download_time = 0.0
+
+    def urlopen(self, url):
+        """Open the given URL and return a file-like object for the response.
+
+        The object behaves like the one returned by urllib2.urlopen, and must
+        be closed.  Raise FetchSkipped if the fetch was skipped, including
+        while the body is read, urllib2.HTTPError if the server returned an
+        error status, and urllib2.URLError, httplib.HTTPException,
+        socket.error, or ValueError if the URL could not be fetched.
+        """
+        start_time = time.time()
+        deadline = None
+        if self.deadline is not None:
+            deadline = start_time + self.deadline
+        for redirect_num in xrange(MAX_REDIRECTS + 1):
+            if (deadline is not None) and (time.time() >= deadline):
+                self._count_skip(SKIPPED_DEADLINE, 0)
+                raise FetchSkipped(SKIPPED_DEADLINE, url)
+            parts = urlparse.urlsplit(url)
+            scheme = parts[0].lower()
+            if (scheme not in _CONNECTION_CLASSES) or (scheme in self._proxies):
+                try:
+                    response = urllib2.urlopen(url)
+                except urllib2.HTTPError:
+                    self._count_skip(SKIPPED_STATUS, 0)
+                    raise
+                return self._check_headers(
+                    _FetchedResponse(self, url, response, start_time,
+                                     deadline))
+            host = parts.hostname
+            if not host:
+                raise urllib2.URLError("no host given")
+            port = parts.port
+            if port is None:
+                port = _CONNECTION_CLASSES[scheme].default_port
+            path = parts[2] or "/"
+            if parts[3]:
+                path += "?" + parts[3]
+
+            key = (scheme, host, port)
+            circuit_breaker = self.circuit_breaker
+            if (circuit_breaker is not None) and \
+                    not circuit_breaker.allow((host, port)):
+                self._count_skip(SKIPPED_HOST_DOWN, 0)
+                raise FetchSkipped(SKIPPED_HOST_DOWN, url)
+            try:
+                connection, response = self._request(key, path, deadline)
+            except socket.error, e:
+                # This includes timeouts and failed DNS lookups.
+                if circuit_breaker is not None:
+                    circuit_breaker.record_failure((host, port))
+                if isinstance(e, socket.timeout) and \
+                        (deadline is not None) and (time.time() >= deadline):
+                    self._count_skip(SKIPPED_DEADLINE, 0)
+                    raise FetchSkipped(SKIPPED_DEADLINE, url)
+                raise
+            except:
+                if circuit_breaker is not None:
+                    circuit_breaker.record_success((host, port))
+                raise
+            if circuit_breaker is not None:
+                circuit_breaker.record_success((host, port))
+            status = response.status
+            if 200 <= status < 300:
+                return self._check_headers(
+                    _FetchedResponse(self, url, response, start_time,
+                                     deadline, key, connection))
+            location = response.getheader("location") or \
+                response.getheader("uri")
+            num_bytes_avoided = self._discard(key, connection, response)
+            if (status not in _REDIRECT_STATUSES) or not location:
+                self._count_skip(SKIPPED_STATUS, num_bytes_avoided)
+                raise urllib2.HTTPError(url, status, response.reason,
+                                        response.msg, None)
+            url = urlparse.urljoin(url, location.strip())
+        self._count_skip(SKIPPED_STATUS, 0)
+        raise urllib2.HTTPError(url, status, "Too many redirects",
+                                response.msg, None)
+
+    def _check_headers(self, response):
+        """Return the given _FetchedResponse if its headers show that its body
+        is wanted, or close it and raise FetchSkipped otherwise.
+        """
+        content_type = None
+        if self.accepted_content_types is not None and \
+                response.headers.get("content-type"):
+            content_type = response.headers.gettype()
+        if (content_type is not None) and \
+                (content_type not in self.accepted_content_types):
+            reason = SKIPPED_CONTENT_TYPE
+        elif (self.max_body_size is not None) and \
+                (response._content_length > self.max_body_size):
+            reason = SKIPPED_SIZE
+        else:
+            return response
+        response.close()
+        self._count_skip(reason, response._content_length or 0)
+        raise FetchSkipped(reason, response.geturl())
+
+    def _request(self, key, path, deadline):
+        """Return a connection to the host of the given key and the response
+        to a GET request for the given path sent over it.
+
+        An idle connection is used if there is one.  If the request fails over
+        an idle connection before the response arrives, then the server may
+        have closed the connection, so the request is sent once more over a
+        new connection.  The socket timeout is shortened so that no wait lasts
+        past the given deadline.
+        """
+        connection = self._acquire(key)
+        if connection is not None:
+            try:
+                connection.set_deadline(deadline)
+                return (connection, _send_request(connection, path))
+            except socket.timeout:
+                connection.close()
+                raise
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+
+        connection = _CONNECTION_CLASSES[key[0]](key[1], key[2],
+                                                 self.dns_cache)
+        connection.set_deadline(deadline)
+        self._lock.acquire()
+        try:
+            self.num_connections_opened += 1
+        finally:
+            self._lock.release()
+        try:
+            return (connection, _send_request(connection, path))
+        except:
+            connection.close()
+            raise
+
+    def _acquire(self, key):
+        """Return the most recently released idle connection to the host of
+        the given key, or None if there is none.
+
+        Connections that have been idle for IDLE_CONNECTION_TIMEOUT seconds or
+        more are closed rather than returned.
+        """
+        now = time.time()
+        stale_connections = []
+        self._lock.acquire()
+        try:
+            idle_connections = self._idle_connections.get(key, [])
+            while len(idle_connections) > 0:
+                connection, time_released = idle_connections.pop()
+                if now - time_released < IDLE_CONNECTION_TIMEOUT:
+                    self.num_connections_reused += 1
+                    return connection
+                stale_connections.append(connection)
+            return None
+        finally:
+            self._lock.release()
+            for connection in stale_connections:
+                connection.close()
+
+    def _release(self, key, connection, response):
+        """Keep the given connection for reuse if the given response from it
+        has been read completely and the connection may stay open, and close
+        it otherwise.
+        """
+        if response.isclosed() and not response.will_close:
+            self._lock.acquire()
+            try:
+                idle_connections = self._idle_connections.setdefault(key, [])
+                if len(idle_connections) < \
+                        self._max_idle_connections_per_host:
+                    idle_connections.append((connection, time.time()))
+                    return
+            finally:
+                self._lock.release()
+        connection.close()
+
+    def _discard(self, key, connection, response):
+        """Discard the body of the given response and release its connection.
+
+        Small bodies are read so that the connection can be reused.  Return
+        the number of bytes declared by the Content-Length header that
+        weren't read.
+        """
+        content_length = _get_content_length(response.msg)
+        if (content_length is not None) and \
+                (content_length > MAX_DRAINED_BODY_SIZE):
+            connection.close()
+            return content_length
+        try:
+            response.read(MAX_DRAINED_BODY_SIZE)
+        except (socket.error, httplib.HTTPException):
+            connection.close()
+            return 0
+        self._release(key, connection, response)
+        return 0
+
+    def _count_skip(self, reason, num_bytes_avoided):
+        """Count a fetch skipped for the given reason that avoided downloading
+        the given number of bytes.
+        """
+        self._lock.acquire()
+        try:
+            self.skip_counts[reason] += 1
+            self.num_bytes_avoided += num_bytes_avoided
+        finally:
+            self._lock.release()
+
+    def _count_download(self, num_bytes, download_time):
+        """Count a complete download of the given number of bytes that took
+        the given number of seconds.
+        """
+        self._lock.acquire()
+        try:
+            self.num_downloads += 1
+            self.num_bytes_downloaded += num_bytes
+            self.download_time += download_time
+        finally:
+            self._lock.release()
+
+    def get_skip_summary(self):
+        """Return a str that summarizes the fetches skipped so far.
+
+        The summary counts the fetches skipped for each reason and the bytes
+        that their Content-Length headers declared but that weren't
+        downloaded.  The bytes of bodies without a Content-Length are unknown,
+        so this undercounts the bandwidth saved.  The time saved is estimated
+        from the mean rate of the complete downloads.
+        """
+        self._lock.acquire()
+        try:
+            summary = ("Skipped %d fetches: %d for their status, %d for " +
+                       "their content type, %d for their size, %d for the " +
+                       "deadline, and %d because their hosts seemed to be " +
+                       "down.  Avoided downloading at least %d bytes") % \
+                (sum(self.skip_counts.values()),
+                 self.skip_counts[SKIPPED_STATUS],
+                 self.skip_counts[SKIPPED_CONTENT_TYPE],
+                 self.skip_counts[SKIPPED_SIZE],
+                 self.skip_counts[SKIPPED_DEADLINE],
+                 self.skip_counts[SKIPPED_HOST_DOWN], self.num_bytes_avoided)
+            if (self.num_bytes_downloaded > 0) and (self.download_time > 0):
+                download_rate = self.num_bytes_downloaded / self.download_time
+                summary += (", which would have taken about %.1f seconds at " +
+                            "the mean rate of %d bytes per second of %d " +
+                            "complete downloads") % \
+                    (self.num_bytes_avoided / download_rate, download_rate,
+                     self.num_downloads)
+        finally:
+            self._lock.release()
+        return summary + "."
+
+    def close(self):
+        """Close every idle connection.
+
+        Responses that are still open keep their connections until they are
+        closed.  The fetcher may still be used afterwards.
+        """
+        self._lock.acquire()
+        try:
+            idle_connections = self._idle_connections
+            self._idle_connections = {}
+        finally:
+            self._lock.release()
+        for connections in idle_connections.itervalues():
+            for connection, time_released in connections:
+                connection.close()
+
+def _send_request(connection, path):
+    """Send a GET request for the given path over the given connection and
+    return the response.
+    """
+    connection.request("GET", path, headers={"User-Agent": USER_AGENT})
+    return connection.getresponse()
+
+def raise_host_down(urlopen):
+    """Return a function that opens a URL with the given function, such as the
+    urlopen method of an HttpFetcher, but raises HostDown instead of
+    FetchSkipped if the request was refused because the host seems to be down.
+    """
+    def urlopen_or_raise_host_down(url):
+        try:
+            return urlopen(url)
+        except FetchSkipped, e:
+            if e.reason == SKIPPED_HOST_DOWN:
+                raise HostDown(e.url)
+            raise
+    return urlopen_or_raise_host_down
@@ -1,16 +1,42 @@
 #!/usr/bin/python2.5
 
-import sys, os, functools, time, socket, html2text, pprint
+import sys, os, errno, functools, time, socket, multiprocessing, heapq, \
+    json, cPickle, html2text, pprint
+from fetch_pool import fetch_concurrently, interleave_hosts
+from story_cache import StoryContentsCache
+from http_fetcher import DnsCache, CircuitBreaker, HttpFetcher, HostDown, \
+    SKIP_REASONS, raise_host_down
+from external_sort import SpilledEventSet
+from canonical_urls import canonicalize_url
+try:
+    from compact_events import UserIdInterner, CompactEventSet, iterate_rows
+except ImportError:
+    # NumPy is unavailable, so events are always held in sets of tuples.
+    CompactEventSet = None
 from collections import defaultdict
-from utilities import DELIMITER, check_num_arguments, report_time_elapsed, \
-    open_safely
+from hashlib import md5
+from utilities import DELIMITER, COMPRESSED_EXTENSIONS, BinaryColumnWriter, \
+    StageMetrics, TsvWriter, check_num_arguments, report_time_elapsed, \
+    get_compression_extension, find_file_path, open_safely, read_lines, \
+    read_tsv, read_int_tsv, write_metrics_record
 
 NUM_ARGUMENTS = 1
 """The expected number of arguments to this module when executed as a script.
 The path to this file is included in this count.
 """
 
-PROGRAM_USAGE = "Usage: %s" % __file__
+INCREMENTAL_FLAG = "--incremental"
+"""The optional argument to this module when executed as a script that updates
+the processed data with newly appended raw rows instead of rebuilding it.
+"""
+
+RESUME_FLAG = "--resume"
+"""The optional argument to this module when executed as a script that resumes
+an interrupted run from the checkpoint at CHECKPOINT_FILE_PATH.
+"""
+
+PROGRAM_USAGE = "Usage: %s [%s | %s]" % (__file__, INCREMENTAL_FLAG,
+                                         RESUME_FLAG)
 # A description of how to run execute this program from the command-line.
 
 """
@@ -28,6 +54,179 @@ TIMEOUT_LENGTH = 10
 # The shortest string that I will believe is a bonafide extracted story.
 MIN_STORY_LENGTH = 256
 
+"""
+The number of threads used to fetch story contents concurrently before the raw
+stories log file is cleaned when FETCH_FULL_STORIES is True.  If 1, then story
+contents are instead fetched serially by _insert_full_story as stories are
+cleaned.
+"""
+NUM_FETCH_THREADS = 16
+
+"""
+The largest number of threads that may fetch story contents from the same host
+at once, so that publishers with many stories are not flooded with requests.
+"""
+NUM_FETCH_THREADS_PER_HOST = 2
+
+"""
+A boolean that determines whether the http_fetcher.HttpFetcher with which story
+contents are fetched keeps connections to each host open between stories and
+caches DNS lookups, or opens a new connection and looks the host up for every
+story, as urllib2 does.
+"""
+REUSE_CONNECTIONS = True
+
+"""
+The largest number of bytes of a story page that are downloaded.  Pages whose
+Content-Length is larger are skipped before their bodies are read, and other
+pages as soon as they grow larger, since such pages are almost always media or
+documents rather than stories.  If None, then pages of every size are read.
+"""
+MAX_STORY_PAGE_SIZE = 2 * 1024 * 1024
+
+"""
+The number of seconds within which a story page, including any redirects, must
+be fetched before it is skipped.  Unlike the socket timeout, which bounds each
+wait for a server, this bounds the whole fetch, so servers that send a page a
+trickle at a time cannot hold a fetch thread indefinitely.  If None, then only
+the socket timeout applies.
+"""
+STORY_FETCH_DEADLINE = 60
+
+"""
+The number of consecutive fetches from a publisher's host that must fail to
+connect or time out before the host is assumed to be down and its remaining
+stories are skipped as failed fetches, rather than each waiting TIMEOUT_LENGTH
+seconds.  If None, then every story is fetched.
+"""
+MAX_CONSECUTIVE_HOST_FAILURES = 5
+
+"""
+The number of seconds after which a single story is fetched again from a host
+that was assumed to be down.  If it is fetched, then the host is assumed to be
+up again, and if not, then its stories are skipped for this long again.
+"""
+HOST_FAILURE_COOLDOWN = 10 * 60
+
+"""
+A boolean that determines whether story contents are looked up by the canonical
+form of each story URL, as returned by canonical_urls.canonicalize_url, rather
+than by the URL itself.  Stories whose URLs differ only by tracking parameters,
+fragments, scheme, or a trailing slash then share a single fetch.
+"""
+CANONICALIZE_STORY_URLS = True
+
+"""
+The least number of seconds between checkpoints of the state built while
+cleaning stories and fetching their contents, or None to disable checkpoints.
+Each checkpoint pickles stories_dict and every story contents fetched so far, so
+this bounds the time spent checkpointing relative to the time spent cleaning.
+An interrupted run resumes from its last checkpoint when this program is run
+with RESUME_FLAG.
+"""
+CHECKPOINT_INTERVAL = 15 * 60
+
+"""
+The number of story URLs fetched concurrently between opportunities to write a
+checkpoint while prefetching story contents.  Threads idle at the end of each
+batch until its slowest fetch finishes, so batches should be much larger than
+NUM_FETCH_THREADS.
+"""
+FETCH_BATCH_SIZE = 1000
+
+"""
+The number of processes among which the extraction of text from downloaded
+story pages is divided while story contents are prefetched.  If 1, then each
+fetch thread extracts the text of the pages that it downloads, so extraction
+competes with the network I/O for a single core.  Otherwise, each batch of
+FETCH_BATCH_SIZE pages is downloaded by the fetch threads and then extracted in
+a pool of this many processes.  Set this to multiprocessing.cpu_count() to use
+every core on the machine.
+"""
+NUM_EXTRACTION_PROCESSES = 1
+
+"""
+The file path to the on-disk cache of extracted story contents shared by this
+program and fetch_story_contents, so that reruns don't fetch stories again.  If
+None, then no cache is used.
+"""
+STORY_CACHE_FILE_PATH = "../Story Contents Cache/story_contents.db"
+
+# The largest total size in bytes of the URLs and contents in the cache.
+STORY_CACHE_MAX_SIZE = 4 * 1024 * 1024 * 1024
+
+"""
+The length of time in seconds for which the cache remembers that the contents of
+a story could not be extracted.  Afterwards, the story is fetched again.
+"""
+STORY_CACHE_FAILURE_TTL = 7 * 24 * 60 * 60
+
+"""
+The number of processes among which to divide the cleaning of the raw user
+reads and clickthroughs log files.  If 1, then these files are cleaned serially
+in the current process.  Set this to multiprocessing.cpu_count() to use every
+core on the machine.
+"""
+NUM_CLEANING_PROCESSES = 1
+
+"""
+The number of byte ranges into which each raw event log file is split per
+cleaning process when cleaning in parallel.  Using several ranges per process
+evens out the load when some ranges are slower to clean than others.
+"""
+CHUNKS_PER_CLEANING_PROCESS = 4
+
+"""
+The approximate number of bytes of memory that cleaned user reads or
+clickthroughs may occupy before they are sorted and spilled to temporary files,
+which are merged when the processed event log files are written.  If None, then
+all events are held in memory and sorted there.
+"""
+EVENTS_MEMORY_BUDGET = None
+
+"""
+A rough estimate of the memory occupied by each distinct event in a set,
+including the tuple, its user ID string and ints, and the set's hash table.
+"""
+BYTES_PER_EVENT = 300
+
+"""
+A boolean that determines whether to hold cleaned user reads and clickthroughs
+in compact, NumPy-backed columns rather than in sets of tuples when
+EVENTS_MEMORY_BUDGET is None.  User IDs are interned into integers as events are
+added.  Ignored if NumPy is not installed.
+"""
+COMPACT_EVENTS = True
+
+"""
+The directory in which to create the temporary files that events are spilled
+to when EVENTS_MEMORY_BUDGET is not None.  If None, then the platform's default
+temporary directory is used.
+"""
+EVENTS_SPILL_DIRECTORY = None
+
+"""
+A boolean that determines whether to also write the processed user reads,
+user clickthroughs, and story metadata as fixed-width binary column files,
+which utilities.load_binary_column maps into memory without parsing.  Each
+column of a processed log file is written to a file named after the log file and
+the column, e.g., user_story_reads_v2.story_id.col.  The story columns are the
+feed ID, which numbers the distinct feed URLs in ascending order, and the time
+each story was first read.
+"""
+WRITE_BINARY_COLUMNS = True
+
+"""
+The extension of the format in which to compress the processed stories, events,
+user IDs, and story keys, which is one of utilities.COMPRESSED_EXTENSIONS, or
+None to write them uncompressed.  Each file is written under its usual name plus
+this extension and is compressed on a background thread while the next rows are
+formatted.  Binary column files are never compressed, so that they can still be
+mapped into memory.  Raw and processed log files are read whether or not they
+are compressed, so this may be changed between runs.
+"""
+COMPRESSED_OUTPUT_EXTENSION = None
+
 # File names of the input and output data.
 STORIES_FILENAME = "stories_v2.log"
 READS_FILENAME = "user_story_reads_v2.log"
@@ -52,6 +251,94 @@ PROCESSED_CLICKTHROUGHS_FILE_PATH = PROCESSED_DATA_DIRECTORY + \
     CLICKTHROUGHS_FILENAME
 USER_IDS_FILE_PATH = PROCESSED_DATA_DIRECTORY + USER_IDS_FILENAME
 
+"""
+File names of the processed files that support incremental updates.  The ingest
+state records how far into each raw log file the processed data reaches.  The
+story keys file holds the (feed_url, feed_title, story_url, story_title) key of
+each processed story and is only written if FETCH_FULL_STORIES is True, since
+the story contents are otherwise indistinguishable from the story titles.  The
+remap files map from IDs before the last incremental update to IDs after it and
+are only present if that update changed any existing IDs.
+"""
+INGEST_STATE_FILENAME = "ingest_state.json"
+STORY_KEYS_FILENAME = "story_keys.log"
+STORY_ID_REMAP_FILENAME = "story_id_remap.log"
+USER_ID_REMAP_FILENAME = "user_id_remap.log"
+
+INGEST_STATE_FILE_PATH = PROCESSED_DATA_DIRECTORY + INGEST_STATE_FILENAME
+STORY_KEYS_FILE_PATH = PROCESSED_DATA_DIRECTORY + STORY_KEYS_FILENAME
+STORY_ID_REMAP_FILE_PATH = PROCESSED_DATA_DIRECTORY + STORY_ID_REMAP_FILENAME
+USER_ID_REMAP_FILE_PATH = PROCESSED_DATA_DIRECTORY + USER_ID_REMAP_FILENAME
+
+"""
+File name of the processed file that holds the hexadecimal MD5 digest of the
+contents of each processed story in order of story ID.  The contents of a story
+are what follows its title from STORY_KEYS_FILE_PATH and a space in its
+story_title field, so consumers can process contents that several stories share,
+such as those of syndicated stories, only once.  It is only written if
+FETCH_FULL_STORIES is True.
+"""
+STORY_CONTENTS_HASHES_FILENAME = "story_contents_hashes.log"
+STORY_CONTENTS_HASHES_FILE_PATH = PROCESSED_DATA_DIRECTORY + \
+    STORY_CONTENTS_HASHES_FILENAME
+
+"""
+File path to the log to which a JSON metrics record is appended for each stage
+of every run of this program, or None to disable metrics.  Each record holds the
+throughput, bytes read and written, peak memory use, and counts, such as the
+number of rows discarded for each reason, of one stage.  Records from the same
+run share the same run_started time.
+"""
+METRICS_FILENAME = "metrics.log"
+METRICS_FILE_PATH = PROCESSED_DATA_DIRECTORY + METRICS_FILENAME
+
+"""
+File path to the checkpoint written every CHECKPOINT_INTERVAL seconds while
+process_data cleans stories.  It is deleted once process_data finishes.
+"""
+CHECKPOINT_FILENAME = "stories_checkpoint.pickle"
+CHECKPOINT_FILE_PATH = PROCESSED_DATA_DIRECTORY + CHECKPOINT_FILENAME
+
+"""
+File path to the manifest of the renames and removals that put the files written
+by update_processed_data into place, along with the raw log file offsets to
+record in INGEST_STATE_FILE_PATH once they are done.  It is written atomically
+before the first rename and deleted once the ingest state is updated, so an
+update that is interrupted while putting its files into place is finished by the
+next update.
+"""
+UPDATE_MANIFEST_FILENAME = "update_manifest.json"
+UPDATE_MANIFEST_FILE_PATH = PROCESSED_DATA_DIRECTORY + UPDATE_MANIFEST_FILENAME
+
+# The extension of processed files while they are being rewritten.
+TEMPORARY_EXTENSION = ".tmp"
+
+# The extension and column names of the binary column files.
+COLUMN_EXTENSION = ".col"
+EVENT_COLUMN_NAMES = ("user_id", "story_id", "time_occurred")
+STORY_COLUMN_NAMES = ("feed_id", "time_first_read")
+
+"""
+The extension of the user index that accompanies each processed event log file,
+e.g., user_story_reads_v2.user_index.  Each row of an index holds a user ID and
+the byte offset in the uncompressed log file of that user's first event.  Rather
+than a row for every user, the index holds a row for the first user whose events
+begin at least USER_INDEX_INTERVAL events after the previous row's, so that the
+events of a range of users can be read without scanning the whole log file.
+"""
+USER_INDEX_EXTENSION = ".user_index"
+USER_INDEX_INTERVAL = 4096
+
+"""
+The extension of the pending events file that accompanies each processed event
+log file, e.g., user_story_reads_v2.pending.  It holds the raw rows of the
+events that were discarded because they referenced unknown stories, whose rows
+may simply not have been appended to the raw stories log file yet.
+update_processed_data cleans them again along with the rows appended to the raw
+event log file, so that they are processed once their stories appear.
+"""
+PENDING_EVENTS_EXTENSION = ".pending"
+
 # Brief descriptions of the type of data in each input and/or output log file.
 STORIES_DESCRIPTOR = "stories"
 READS_DESCRIPTOR = "user story reads"
@@ -76,6 +363,55 @@ LATEST_ACCEPTABLE_TIMESTAMP = 1314835199
 
 LATEST_ACCEPTABLE_YEAR = time.gmtime(LATEST_ACCEPTABLE_TIMESTAMP).tm_year
 
+# The format of the timestamps in all of the raw Pulse log files.
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# The format of the date prefix of the timestamps in the raw Pulse log files.
+DATE_FORMAT = "%Y-%m-%d"
+
+SECONDS_IN_DAY = 86400
+
+"""
+Values stored in _day_start_timestamps for dates that cannot take the fast path
+in _parse_timestamp.  Dates that are malformed or that don't last exactly
+SECONDS_IN_DAY seconds in local time, such as those on which daylight saving
+time begins or ends, are irregular and fall back to _parse_timestamp_slowly.
+Dates with no second inside the acceptable window are out of window.
+"""
+_IRREGULAR_DAY = -1
+_OUT_OF_WINDOW_DAY = -2
+
+"""
+A cache mapping from the date prefixes of raw timestamps (e.g., "2011-08-01")
+to the local time at the start of that day represented in seconds since the
+Unix epoch, _IRREGULAR_DAY, or _OUT_OF_WINDOW_DAY.  The raw logs only span a
+handful of days, so this stays tiny.
+"""
+_day_start_timestamps = {}
+
+"""
+The names of the reasons for which rows of the raw log files are discarded, as
+counted in the metrics records.  Rows are checked for these problems in the
+order in which the reasons are listed, and only the first problem found counts.
+Stories without contents are only discarded if FETCH_FULL_STORIES is True.
+Duplicates are counted as the rows that remain unaccounted for, so they are
+approximate if events are spilled to disk.
+"""
+DISCARDED_FIELD_COUNT = "discarded_field_count"
+DISCARDED_BAD_TIMESTAMP = "discarded_bad_timestamp"
+DISCARDED_OUT_OF_WINDOW = "discarded_out_of_window"
+DISCARDED_EMPTY_FIELD = "discarded_empty_field"
+DISCARDED_UNKNOWN_STORY = "discarded_unknown_story"
+DISCARDED_NO_STORY_CONTENTS = "discarded_no_story_contents"
+DISCARDED_DUPLICATE = "discarded_duplicate"
+
+"""
+The time at which the current run of process_data or update_processed_data
+started, in seconds since the Unix epoch, which identifies the run in the
+metrics records.
+"""
+_run_start_time = None
+
 """
 Zero-based field indices for raw story data.  The story log file format differs
 from that of the other two input files.
@@ -117,6 +453,7 @@ feed_url, and feed_title fields are replaced by a single story_id field.
 """
 EVENTS_STORY_ID_INDEX = 1
 NEW_EVENTS_TIMESTAMP_INDEX = 2
+NEW_EVENTS_NUM_FIELDS = 3
 
 """
 Adds the given story to the given defaultdict if no stories already in the
@@ -149,9 +486,11 @@ story_urls for which a previous attempt to fetch story content failed.  story is
 a row of data, formatted as a list, from the stories log file.  time_first_read
 is one of the times at which the given story is purported to have first been
 read.  time_first_read is represented as seconds since the Unix epoch.
-story_contents_dict is a dict mapping from story_urls to a best guess at the
-full contents of the story at said URL or None if the story contents could not
-be extracted.  Intended for use as a callback function in _clean_data.
+story_contents_dict is a dict mapping from the get_story_contents_key of
+story_urls to a best guess at the full contents of the story at said URL or None
+if the story contents could not be extracted, so stories whose URLs share a key
+are fetched once.  Returns DISCARDED_NO_STORY_CONTENTS if the story was skipped
+for lack of contents.  Intended for use as a callback function in _clean_data.
 
 TODO: Handle the authorization problem with websites like
 www.filmschoolrejects.com, which immediately follows
@@ -167,38 +506,564 @@ def _insert_full_story(story, time_first_read, stories_dict,
     if key in stories_dict:
         value = stories_dict[key]
         value[0] = min(value[0], time_first_read)
-    elif story_url in story_contents_dict:
-        story_contents = story_contents_dict[story_url]
-        if story_contents is not None:
-            stories_dict[key] = [time_first_read, story_contents]
+        return None
+    story_contents_key = get_story_contents_key(story_url)
+    if story_contents_key in story_contents_dict:
+        story_contents = story_contents_dict[story_contents_key]
     else:
         pprint.pprint(key, sys.stderr)
-        story_contents = html2text.extractFromURL(story_url)
-        if (story_contents is not None) and \
-                (len(story_contents) >= MIN_STORY_LENGTH):
-            stories_dict[key] = [time_first_read, story_contents]
-            story_contents_dict[story_url] = story_contents
+        story_contents = _share_story_contents(_fetch_story_contents(story_url))
+        story_contents_dict[story_contents_key] = story_contents
+    if story_contents is None:
+        return DISCARDED_NO_STORY_CONTENTS
+    stories_dict[key] = [time_first_read, story_contents]
+
+"""
+The StoryContentsCache consulted by _fetch_story_contents, or None if
+STORY_CACHE_FILE_PATH is None.  It is open only while process_data runs.
+"""
+_story_cache = None
+
+"""
+A dict mapping from the MD5 digest of each distinct story contents fetched to
+the contents, or None if story contents aren't being fetched.  It is filled only
+while process_data cleans stories.
+"""
+_story_contents_by_digest = None
+
+"""
+Returns the str in _story_contents_by_digest that is equal to the given story
+contents, adding the contents if there is none, so that stories with the same
+contents, such as syndicated stories under different URLs, share a single str
+in story_contents_dict and stories_dict.  Returns the contents unchanged if they
+are None or _story_contents_by_digest is None.
+"""
+def _share_story_contents(story_contents):
+    if (story_contents is None) or (_story_contents_by_digest is None):
+        return story_contents
+    return _story_contents_by_digest.setdefault(md5(story_contents).digest(),
+                                                story_contents)
+
+"""
+Returns the hexadecimal MD5 digest of the given story contents, as written to
+STORY_CONTENTS_HASHES_FILE_PATH.
+"""
+def get_story_contents_hash(story_contents):
+    return md5(story_contents).hexdigest()
+
+"""
+Returns generators of the rows of the story keys and contents hashes files that
+are next to the given processed stories log file, as written to
+STORY_KEYS_FILE_PATH and STORY_CONTENTS_HASHES_FILE_PATH, or (None, None) if
+either file is missing.  The caller is responsible for closing the generators.
+"""
+def read_story_sidecars(stories_file_path):
+    stories_directory = os.path.dirname(stories_file_path)
+    keys_file_path = find_file_path(os.path.join(stories_directory,
+                                                 STORY_KEYS_FILENAME))
+    hashes_file_path = find_file_path(os.path.join(
+        stories_directory, STORY_CONTENTS_HASHES_FILENAME))
+    if not (os.path.exists(keys_file_path) and \
+            os.path.exists(hashes_file_path)):
+        return (None, None)
+    return (read_tsv(keys_file_path), read_lines(hashes_file_path))
+
+"""
+Returns the (title, story_contents) tuple that makes up the given story_title
+field of a processed stories log file, as split by the given row of the story
+keys file and the given contents hash, or None if they don't match the field,
+such as when the story keys and contents hashes files are stale.
+"""
+def split_story_title(story_title, story_key, story_contents_hash):
+    title = story_key[NEW_STORIES_TITLE_INDEX]
+    if not story_title.startswith(title + " "):
+        return None
+    story_contents = story_title[len(title) + 1:]
+    if get_story_contents_hash(story_contents) != story_contents_hash:
+        return None
+    return (title, story_contents)
+
+"""
+Returns a new StoryContentsCache configured by the STORY_CACHE_* constants, or
+None if STORY_CACHE_FILE_PATH is None.  The caller is responsible for closing
+the cache.
+"""
+def open_story_cache():
+    if STORY_CACHE_FILE_PATH is None:
+        return None
+    return StoryContentsCache(STORY_CACHE_FILE_PATH, STORY_CACHE_MAX_SIZE,
+                              STORY_CACHE_FAILURE_TTL)
+
+"""
+The HttpFetcher with which _fetch_story_contents fetches stories, or None if
+story contents aren't being fetched.  It is open only while process_data runs.
+"""
+_http_fetcher = None
+
+"""
+Returns a new HttpFetcher that skips pages that aren't HTML, are larger than
+MAX_STORY_PAGE_SIZE, or take longer than STORY_FETCH_DEADLINE seconds to fetch,
+and hosts that seem to be down according to MAX_CONSECUTIVE_HOST_FAILURES and
+HOST_FAILURE_COOLDOWN.  If REUSE_CONNECTIONS is False, then the fetcher neither
+keeps idle connections nor caches DNS lookups.  The caller is responsible for
+closing the fetcher.
+"""
+def open_http_fetcher():
+    circuit_breaker = None
+    if MAX_CONSECUTIVE_HOST_FAILURES is not None:
+        circuit_breaker = CircuitBreaker(MAX_CONSECUTIVE_HOST_FAILURES,
+                                         HOST_FAILURE_COOLDOWN)
+    if REUSE_CONNECTIONS:
+        return HttpFetcher(max_idle_connections_per_host = \
+                               max(1, NUM_FETCH_THREADS_PER_HOST),
+                           max_body_size = MAX_STORY_PAGE_SIZE,
+                           deadline = STORY_FETCH_DEADLINE,
+                           circuit_breaker = circuit_breaker)
+    return HttpFetcher(DnsCache(0, 0), 0, MAX_STORY_PAGE_SIZE,
+                       STORY_FETCH_DEADLINE, circuit_breaker = circuit_breaker)
+
+"""
+Returns a function that extracts the contents of the story at a given URL with
+html2text.extractFromURL, fetching the story with the given HttpFetcher, or with
+urllib2 if http_fetcher is None.  The function raises HostDown if the fetcher
+refuses to request the story because its host seems to be down.
+"""
+def get_story_extractor(http_fetcher):
+    if http_fetcher is None:
+        return html2text.extractFromURL
+    return functools.partial(html2text.extractFromURL,
+                             urlopen = raise_host_down(http_fetcher.urlopen))
+
+"""
+Returns a function that downloads the story at a given URL with
+html2text.downloadDocument, fetching the story with the given HttpFetcher, or
+with urllib2 if http_fetcher is None.  The function raises HostDown if the
+fetcher refuses to request the story because its host seems to be down.
+"""
+def get_story_downloader(http_fetcher):
+    if http_fetcher is None:
+        return html2text.downloadDocument
+    return functools.partial(html2text.downloadDocument,
+                             urlopen = raise_host_down(http_fetcher.urlopen))
+
+"""
+Returns the key under which the contents of the story at the given URL are
+stored in a story_contents_dict, which is the canonical form of the URL if
+CANONICALIZE_STORY_URLS is True and the URL itself otherwise.
+"""
+def get_story_contents_key(story_url):
+    if CANONICALIZE_STORY_URLS:
+        return canonicalize_url(story_url)
+    return story_url
+
+"""
+Returns a best guess at the full contents of the story at the given URL, or None
+if the story contents could not be extracted or were less than MIN_STORY_LENGTH
+characters long.  Consults _story_cache before fetching the story with
+_http_fetcher, and caches what html2text extracted before MIN_STORY_LENGTH is
+applied.  Stories that weren't requested because their hosts seem to be down
+are failures for this run only, so they aren't cached.  Safe to call from
+several threads at once.
+"""
+def _fetch_story_contents(story_url):
+    extract_fn = get_story_extractor(_http_fetcher)
+    try:
+        if _story_cache is None:
+            story_contents = extract_fn(story_url)
+        else:
+            story_contents = _story_cache.fetch(story_url, extract_fn)
+    except HostDown:
+        return None
+    return _check_story_length(story_contents)
+
+"""
+Returns the (html, encoding) tuple downloaded from the given story URL by
+get_story_downloader with _http_fetcher, or None if the story wasn't requested
+because its host seems to be down.
+"""
+def _download_story(story_url):
+    try:
+        return get_story_downloader(_http_fetcher)(story_url)
+    except HostDown:
+        return None
+
+"""
+Returns the given story contents, or None if they are None or less than
+MIN_STORY_LENGTH characters long.
+"""
+def _check_story_length(story_contents):
+    if (story_contents is not None) and \
+            (len(story_contents) >= MIN_STORY_LENGTH):
+        return story_contents
+    return None
+
+"""
+Returns a dict mapping from each of the given story URLs to its contents exactly
+as _fetch_story_contents would return them.  The stories that aren't in
+_story_cache are downloaded with _http_fetcher by NUM_FETCH_THREADS threads, at
+most NUM_FETCH_THREADS_PER_HOST of which download from the same host at once,
+and their text is then extracted in a pool of NUM_EXTRACTION_PROCESSES
+processes by html2text.extractFromDocuments, so that the fetch threads never
+wait for extraction.  Stories that weren't requested because their hosts seem to
+be down aren't cached, as in _fetch_story_contents.
+"""
+def _fetch_and_extract_stories(story_urls):
+    fetched_contents = {}
+    urls_to_download = []
+    for story_url in story_urls:
+        hit = False
+        if _story_cache is not None:
+            hit, story_contents = _story_cache.get(story_url)
+        if hit:
+            fetched_contents[story_url] = _check_story_length(story_contents)
+        else:
+            urls_to_download.append(story_url)
+    documents = fetch_concurrently(urls_to_download, _download_story,
+                                   NUM_FETCH_THREADS,
+                                   NUM_FETCH_THREADS_PER_HOST)
+    documents_to_extract = []
+    for story_url in urls_to_download:
+        if documents[story_url] is None:
+            fetched_contents[story_url] = None
+        else:
+            documents_to_extract.append((story_url, ) + documents[story_url])
+    for story_url, story_contents in html2text.extractFromDocuments(
+            documents_to_extract, numProcesses = NUM_EXTRACTION_PROCESSES):
+        if _story_cache is not None:
+            _story_cache.put(story_url, story_contents)
+        fetched_contents[story_url] = _check_story_length(story_contents)
+    return fetched_contents
+
+"""
+Returns a (num_hits, num_misses) tuple that counts the story contents looked up
+so far.  Hits were found in _story_cache, and misses were fetched.  If there is
+no cache, a story was fetched for every key in story_contents_dict, which maps
+from the get_story_contents_key of the story URLs looked up to their contents.
+"""
+def _get_fetch_counts(story_contents_dict):
+    if _story_cache is None:
+        return (0, len(story_contents_dict))
+    return (_story_cache.num_hits, _story_cache.num_misses)
+
+"""
+Counts the fetch hits and misses between the given tuples returned by
+_get_fetch_counts in the given StageMetrics.
+"""
+def _count_fetches(metrics, fetch_counts_before, fetch_counts_after):
+    metrics.count("fetch_hits", fetch_counts_after[0] - fetch_counts_before[0])
+    metrics.count("fetch_misses",
+                  fetch_counts_after[1] - fetch_counts_before[1])
+
+"""
+Finishes the given StageMetrics and appends its record, tagged with
+_run_start_time, to METRICS_FILE_PATH unless METRICS_FILE_PATH is None.
+"""
+def _record_stage_metrics(metrics):
+    if METRICS_FILE_PATH is None:
+        return
+    record = metrics.finish()
+    record["run_started"] = _run_start_time
+    write_metrics_record(record, METRICS_FILE_PATH)
+
+"""
+Returns the total size in bytes of the files with the given paths.
+"""
+def _get_total_size(file_paths):
+    return sum([os.path.getsize(file_path) for file_path in file_paths])
+
+"""
+Adds the URL of the given story to the given set.  Intended for use as a
+callback function in _clean_row, so that only the URLs of well-formed stories
+are collected.  stories_dict is unused.
+"""
+def _insert_story_url(story, time_first_read, stories_dict, story_urls):
+    story_urls.add(story[OLD_STORIES_URL_INDEX])
+
+"""
+Fetches the contents of every story in RAW_STORIES_FILE_PATH that is not yet in
+the given dict using NUM_FETCH_THREADS threads, at most
+NUM_FETCH_THREADS_PER_HOST of which fetch from the same host at once.  The
+contents, or None for stories that _fetch_story_contents rejected, are stored in
+story_contents_dict under get_story_contents_key of the story URL exactly as
+_insert_full_story would store them.  When the raw stories log file is cleaned
+afterwards, _insert_full_story therefore finds every URL in story_contents_dict
+and fetches nothing.  Well-formed rows are determined with _clean_row, so
+precisely the stories that a serial run would fetch are fetched.  Of the URLs
+that share a key, only the least is fetched, and the number of fetches saved is
+reported.  Only the rows in the byte range [start_offset, end_offset) are
+considered, as in utilities.read_lines.  If NUM_EXTRACTION_PROCESSES is greater
+than 1, then the text of the stories is extracted by _fetch_and_extract_stories
+in a pool of processes rather than by the fetch threads.  If checkpoint_fn is
+not None or the text is extracted in a pool, then URLs are fetched in batches of
+FETCH_BATCH_SIZE, and checkpoint_fn, if any, is called with start_offset after
+each batch, as in _clean_data.  A metrics record for the stage counts the URLs
+fetched as rows and the extracted contents as bytes read.
+"""
+def _prefetch_full_stories(story_contents_dict, start_offset = 0,
+                           end_offset = None, checkpoint_fn = None):
+    start_time = time.time()
+    metrics = StageMetrics("fetch " + STORIES_DESCRIPTOR)
+    fetch_counts_before = _get_fetch_counts(story_contents_dict)
+    story_urls = set()
+    for row in read_lines(RAW_STORIES_FILE_PATH, start_offset, end_offset):
+        _clean_row(row, STORIES_NUM_FIELDS, STORIES_TIMESTAMP_INDEX,
+                   _insert_story_url, None, story_urls)
+    
+    story_urls_by_key = {}
+    num_urls_missing = 0
+    for story_url in story_urls:
+        story_contents_key = get_story_contents_key(story_url)
+        if story_contents_key in story_contents_dict:
+            continue
+        num_urls_missing += 1
+        if (story_contents_key not in story_urls_by_key) or \
+                (story_url < story_urls_by_key[story_contents_key]):
+            story_urls_by_key[story_contents_key] = story_url
+    urls_to_fetch = interleave_hosts(sorted(story_urls_by_key.itervalues()))
+    num_fetches_saved = num_urls_missing - len(urls_to_fetch)
+    if (checkpoint_fn is None) and (NUM_EXTRACTION_PROCESSES == 1):
+        batch_size = max(1, len(urls_to_fetch))
+    else:
+        batch_size = FETCH_BATCH_SIZE
+    fetched_contents = {}
+    for batch_start in xrange(0, len(urls_to_fetch), batch_size):
+        batch_urls = urls_to_fetch[batch_start:batch_start + batch_size]
+        if NUM_EXTRACTION_PROCESSES == 1:
+            batch_contents = fetch_concurrently(batch_urls,
+                                                _fetch_story_contents,
+                                                NUM_FETCH_THREADS,
+                                                NUM_FETCH_THREADS_PER_HOST)
         else:
-            story_contents_dict[story_url] = None
+            batch_contents = _fetch_and_extract_stories(batch_urls)
+        for story_url, story_contents in batch_contents.iteritems():
+            story_contents_dict[get_story_contents_key(story_url)] = \
+                _share_story_contents(story_contents)
+        fetched_contents.update(batch_contents)
+        if checkpoint_fn is not None:
+            checkpoint_fn(start_offset)
+    num_failed = len([story_contents for story_contents in \
+                      fetched_contents.itervalues() if story_contents is None])
+    print(("Fetched the contents of %d distinct %s with %d threads, %d of " +
+           "which could not be extracted.") %
+          (len(urls_to_fetch), STORIES_DESCRIPTOR, NUM_FETCH_THREADS,
+           num_failed))
+    print(("Saved %d fetches of URLs that lead to the same stories as the " +
+           "URLs fetched.") % num_fetches_saved)
+    if _story_cache is not None:
+        print("Found %d of these in the story contents cache at %s." %
+              (_story_cache.num_hits, STORY_CACHE_FILE_PATH))
+    if _http_fetcher is not None:
+        print(("Opened %d connections, reused connections %d times, and " +
+               "looked up %d host names.") %
+              (_http_fetcher.num_connections_opened,
+               _http_fetcher.num_connections_reused,
+               _http_fetcher.dns_cache.num_misses))
+        print(_http_fetcher.get_skip_summary())
+    report_time_elapsed(start_time)
+    
+    metrics.num_rows = len(urls_to_fetch)
+    metrics.bytes_read = sum([len(story_contents) for story_contents in \
+                              fetched_contents.itervalues() if \
+                              story_contents is not None])
+    metrics.count("fetch_failures", num_failed)
+    metrics.count("fetches_saved_by_canonical_urls", num_fetches_saved)
+    _count_fetches(metrics, fetch_counts_before,
+                   _get_fetch_counts(story_contents_dict))
+    if _http_fetcher is not None:
+        metrics.count("connections_opened",
+                      _http_fetcher.num_connections_opened)
+        metrics.count("connections_reused",
+                      _http_fetcher.num_connections_reused)
+        for reason in SKIP_REASONS:
+            metrics.count("fetches_skipped_" + reason,
+                          _http_fetcher.skip_counts[reason])
+        metrics.count("bytes_not_downloaded", _http_fetcher.num_bytes_avoided)
+        if _http_fetcher.circuit_breaker is not None:
+            metrics.count("hosts_assumed_down",
+                          _http_fetcher.circuit_breaker.num_trips)
+    _record_stage_metrics(metrics)
+
+"""
+Returns the fingerprint of the story with the given (feed_url, feed_title,
+story_url, story_title) key.  A fingerprint is the 16-byte MD5 digest of the
+story_url, story_title, feed_url, and feed_title fields joined by DELIMITER, the
+order in which they appear in the raw log files, so _insert_event can compute it
+from a slice of an event row without reordering fields.  Computing a digest
+costs about as much per event as looking up the full key did, so the index saves
+memory rather than time.  Shorter fingerprints, such as the built-in hash, are
+cheaper, but they are as narrow as a C long, which is 32 bits on some
+platforms, and easy to make collide, so events for unknown stories could be
+attributed to known ones.
+"""
+def _get_story_fingerprint(story_key):
+    story_fields = (story_key[NEW_STORIES_URL_INDEX],
+                    story_key[NEW_STORIES_TITLE_INDEX],
+                    story_key[NEW_STORIES_FEED_URL_INDEX],
+                    story_key[NEW_STORIES_FEED_TITLE_INDEX])
+    return md5(DELIMITER.join(story_fields)).digest()
+
+"""
+Returns a story index built from the given dict, which maps from (feed_url,
+feed_title, story_url, story_title) tuples to story IDs as it does after
+_write_stories.  The index maps from the fingerprint of each story to its story
+ID, so it holds one short str per story instead of a tuple of four long ones,
+and the dict can be discarded once the index is built.  Fingerprints are
+checked for collisions against the full keys.  In the astronomically unlikely
+event that distinct stories share a fingerprint, the fingerprint maps to a dict
+from the keys of those stories to their IDs instead.  An event for an unknown
+story is only checked against its fingerprint, so it is attributed to a known
+story only if their 128-bit digests collide, which is negligible for stories
+that aren't crafted to collide.
+"""
+def _build_story_index(stories_dict):
+    story_index = {}
+    colliding_stories = {}
+    for story_key, story_id in stories_dict.iteritems():
+        story_fingerprint = _get_story_fingerprint(story_key)
+        if story_fingerprint in colliding_stories:
+            colliding_stories[story_fingerprint][story_key] = story_id
+        elif story_fingerprint in story_index:
+            colliding_stories[story_fingerprint] = \
+                {story_key: story_id,
+                 _find_story_key(stories_dict, story_fingerprint,
+                                 story_index[story_fingerprint]): \
+                     story_index[story_fingerprint]}
+        else:
+            story_index[story_fingerprint] = story_id
+    story_index.update(colliding_stories)
+    if len(colliding_stories) > 0:
+        print >> sys.stderr, ("Found %d story fingerprints shared by " +
+                              "distinct stories.") % len(colliding_stories)
+    return story_index
+
+"""
+Returns the key in the given dict of the story with the given fingerprint and
+ID.  Only called when fingerprints collide, so a linear scan suffices.
+"""
+def _find_story_key(stories_dict, story_fingerprint, story_id):
+    for story_key, other_story_id in stories_dict.iteritems():
+        if (other_story_id == story_id) and \
+                (_get_story_fingerprint(story_key) == story_fingerprint):
+            return story_key
 
 """
 Adds the given user event to the given set to filter out duplicates.  Events are
 represented as (user_id, story_id, time_occurred) tuples.  Skips events that
-reference stories that don't appear in the given dict because the time at which
-such stories were first read is unknown.  event is a row, formatted as a list,
-from either the user reads or clickthroughs log file.  time_occurred is the time
-at which the given event occurred.  time_occurred is represented as seconds
-since the Unix epoch.  stories_dict is a mapping from (feed_url, feed_title,
-story_url, story_title) tuples to the corresponding story_id.  Intended for use
-as a callback function in _clean_data.
-"""
-def _insert_event(event, time_occurred, stories_dict, events_set):
-    key = (event[EVENTS_FEED_URL_INDEX], event[EVENTS_FEED_TITLE_INDEX],
-           event[EVENTS_STORY_URL_INDEX], event[EVENTS_STORY_TITLE_INDEX])
-    if key in stories_dict:
-        story_id = stories_dict[key]
-        element = (event[EVENTS_USER_ID_INDEX], story_id, time_occurred)
-        events_set.add(element)
+reference stories that don't appear in the given story index because the time
+at which such stories were first read is unknown.  event is a row, formatted as
+a list, from either the user reads or clickthroughs log file.  time_occurred is
+the time at which the given event occurred.  time_occurred is represented as
+seconds since the Unix epoch.  story_index is a story index built by
+_build_story_index.  Returns DISCARDED_UNKNOWN_STORY if the event was skipped.
+Intended for use as a callback function in _clean_data.
+"""
+def _insert_event(event, time_occurred, story_index, events_set):
+    # The story fields of an event row are in _get_story_fingerprint's order.
+    story_id = story_index.get(md5(DELIMITER.join(
+        event[EVENTS_STORY_URL_INDEX:EVENTS_FEED_TITLE_INDEX + 1])).digest())
+    if story_id is None:
+        return DISCARDED_UNKNOWN_STORY
+    if type(story_id) is dict:
+        story_id = story_id.get((event[EVENTS_FEED_URL_INDEX],
+                                 event[EVENTS_FEED_TITLE_INDEX],
+                                 event[EVENTS_STORY_URL_INDEX],
+                                 event[EVENTS_STORY_TITLE_INDEX]))
+        if story_id is None:
+            return DISCARDED_UNKNOWN_STORY
+    events_set.add((event[EVENTS_USER_ID_INDEX], story_id, time_occurred))
+
+"""
+Returns the given timestamp, formatted according to TIMESTAMP_FORMAT and
+interpreted in local time, as an int representing seconds since the Unix epoch.
+Returns None if the timestamp is well-formed but unrealistic, meaning that it
+lies outside of [EARLIEST_ACCEPTABLE_TIMESTAMP, LATEST_ACCEPTABLE_TIMESTAMP].
+Raises ValueError if the timestamp is improperly formatted.  This is the
+reference implementation built on time.strptime and time.mktime that
+_parse_timestamp must agree with exactly.
+"""
+def _parse_timestamp_slowly(timestamp_as_str):
+    timestamp_as_struct = time.strptime(timestamp_as_str, TIMESTAMP_FORMAT)
+    if (timestamp_as_struct.tm_year < EARLIEST_ACCEPTABLE_YEAR) or \
+           (timestamp_as_struct.tm_year > LATEST_ACCEPTABLE_YEAR):
+        return None
+    timestamp_as_int = int(time.mktime(timestamp_as_struct))
+    if (timestamp_as_int < EARLIEST_ACCEPTABLE_TIMESTAMP) or \
+           (timestamp_as_int > LATEST_ACCEPTABLE_TIMESTAMP):
+        return None
+    return timestamp_as_int
+
+"""
+Returns the value to store in _day_start_timestamps for the given date prefix
+of a raw timestamp.  Only dates that are formatted with exactly two digits for
+both the month and the day are considered regular, which guarantees that the
+remainder of any 19-character timestamp with this prefix is the time of day.
+"""
+def _get_day_start_timestamp(date_as_str):
+    if (len(date_as_str) != 10) or (date_as_str[4] != "-") or \
+            (date_as_str[7] != "-") or \
+            not (date_as_str[:4] + date_as_str[5:7] +
+                 date_as_str[8:]).isdigit():
+        return _IRREGULAR_DAY
+    try:
+        date_as_struct = time.strptime(date_as_str, DATE_FORMAT)
+    except ValueError:
+        # Let _parse_timestamp_slowly raise the appropriate error.
+        return _IRREGULAR_DAY
+    if (date_as_struct.tm_year < EARLIEST_ACCEPTABLE_YEAR) or \
+           (date_as_struct.tm_year > LATEST_ACCEPTABLE_YEAR):
+        return _OUT_OF_WINDOW_DAY
+    day_start = int(time.mktime(date_as_struct))
+    next_day_start = int(time.mktime((date_as_struct.tm_year,
+                                      date_as_struct.tm_mon,
+                                      date_as_struct.tm_mday + 1, 0, 0, 0, 0, 0,
+                                      -1)))
+    if next_day_start - day_start != SECONDS_IN_DAY:
+        return _IRREGULAR_DAY
+    # Seconds may run up to 61 in TIMESTAMP_FORMAT to allow for leap seconds.
+    if (day_start + SECONDS_IN_DAY + 1 < EARLIEST_ACCEPTABLE_TIMESTAMP) or \
+           (day_start > LATEST_ACCEPTABLE_TIMESTAMP):
+        return _OUT_OF_WINDOW_DAY
+    return day_start
+
+"""
+Behaves exactly like _parse_timestamp_slowly, but much faster.  The start of
+each day is computed once with time.mktime and memoized in
+_day_start_timestamps, and the time of day is added arithmetically.  Rows from
+days outside of the acceptable window are rejected without building a
+struct_time.  Timestamps that deviate from the fixed-width layout of
+TIMESTAMP_FORMAT, or that fall on irregular days, are handed off to
+_parse_timestamp_slowly.
+"""
+def _parse_timestamp(timestamp_as_str):
+    if (len(timestamp_as_str) != 19) or (timestamp_as_str[10] != " ") or \
+            (timestamp_as_str[13] != ":") or (timestamp_as_str[16] != ":"):
+        return _parse_timestamp_slowly(timestamp_as_str)
+    hours_as_str = timestamp_as_str[11:13]
+    minutes_as_str = timestamp_as_str[14:16]
+    seconds_as_str = timestamp_as_str[17:19]
+    if not (hours_as_str + minutes_as_str + seconds_as_str).isdigit():
+        return _parse_timestamp_slowly(timestamp_as_str)
+    hours = int(hours_as_str)
+    minutes = int(minutes_as_str)
+    seconds = int(seconds_as_str)
+    if (hours > 23) or (minutes > 59) or (seconds > 61):
+        return _parse_timestamp_slowly(timestamp_as_str)
+    
+    date_as_str = timestamp_as_str[:10]
+    day_start = _day_start_timestamps.get(date_as_str)
+    if day_start is None:
+        day_start = _get_day_start_timestamp(date_as_str)
+        _day_start_timestamps[date_as_str] = day_start
+    if day_start == _OUT_OF_WINDOW_DAY:
+        return None
+    if day_start == _IRREGULAR_DAY:
+        return _parse_timestamp_slowly(timestamp_as_str)
+    
+    timestamp_as_int = day_start + (3600 * hours) + (60 * minutes) + seconds
+    if (timestamp_as_int < EARLIEST_ACCEPTABLE_TIMESTAMP) or \
+           (timestamp_as_int > LATEST_ACCEPTABLE_TIMESTAMP):
+        return None
+    return timestamp_as_int
 
 """
 Calls the given callback function with a nicely formatted version of the given
@@ -211,29 +1076,175 @@ zero-based index of the field containing the timestamp in the input row.
 insert_data_fn is a callback function that accepts four parameters: a row,
 formatted as a list, from the log file; the row's timestamp represented as
 seconds since the Unix epoch; stories_dict; and callback_data.  stories_dict is
-a dict with keys corresponding to valid stories.  stories_dict is either built
-up by insert_data_fn during the execution of _clean_data or has already been
-constructed during a prior call to _clean_data.  The callee of _clean_data can
-pass additional state to insert_data_fn using the callback_data parameter.
+either a dict with keys corresponding to valid stories that is built up by
+insert_data_fn during the execution of _clean_data or a story index built by
+_build_story_index after a prior call to _clean_data.  The callee of
+_clean_data can pass additional state to insert_data_fn using the callback_data
+parameter.
+Returns the DISCARDED_* reason for which the row was discarded, or whatever
+insert_data_fn returns, which is either None or such a reason.
 """
 def _clean_row(row, num_fields, timestamp_index, insert_data_fn, stories_dict,
                callback_data):
     split_row = row.split(DELIMITER)
-    if len(split_row) == num_fields:
-        try:
-            timestamp_as_struct = time.strptime(split_row[timestamp_index],
-                                                "%Y-%m-%d %H:%M:%S")
-        except ValueError:
-            return
-        if (timestamp_as_struct.tm_year >= EARLIEST_ACCEPTABLE_YEAR) and \
-               (timestamp_as_struct.tm_year <= LATEST_ACCEPTABLE_YEAR):
-            timestamp_as_float = time.mktime(timestamp_as_struct)
-            timestamp_as_int = int(timestamp_as_float)
-            if (timestamp_as_int >= EARLIEST_ACCEPTABLE_TIMESTAMP) and \
-                   (timestamp_as_int <= LATEST_ACCEPTABLE_TIMESTAMP):
-                if all([field != "" for field in split_row]):
-                    insert_data_fn(split_row, timestamp_as_int, stories_dict,
-                                   callback_data)
+    if len(split_row) != num_fields:
+        return DISCARDED_FIELD_COUNT
+    try:
+        timestamp_as_int = _parse_timestamp(split_row[timestamp_index])
+    except ValueError:
+        return DISCARDED_BAD_TIMESTAMP
+    if timestamp_as_int is None:
+        return DISCARDED_OUT_OF_WINDOW
+    if not all([field != "" for field in split_row]):
+        return DISCARDED_EMPTY_FIELD
+    return insert_data_fn(split_row, timestamp_as_int, stories_dict,
+                          callback_data)
+
+"""
+The story index, passed as the stories_dict parameter of _clean_data, that
+cleaning processes consult.  It is set in the parent process immediately before
+the pool of cleaning processes is created, so each process inherits a read-only
+copy when it is forked.
+"""
+_cleaning_stories_dict = None
+
+"""
+Returns the byte offset just past the last newline character in the given file,
+which is the end of the last complete row.  Rows after this offset may still be
+being appended to the file.  Offsets into compressed files are offsets into
+their uncompressed contents, so such files are decompressed from the start.
+"""
+def _get_complete_rows_end(input_file_path):
+    block_size = 65536
+    input_file_path = find_file_path(input_file_path)
+    if get_compression_extension(input_file_path) is not None:
+        complete_rows_end = 0
+        position = 0
+        input_stream = open_safely(input_file_path)
+        block = input_stream.read(block_size)
+        while block != "":
+            newline_index = block.rfind("\n")
+            if newline_index >= 0:
+                complete_rows_end = position + newline_index + 1
+            position += len(block)
+            block = input_stream.read(block_size)
+        input_stream.close()
+        return complete_rows_end
+    position = os.path.getsize(input_file_path)
+    input_stream = open_safely(input_file_path)
+    while position > 0:
+        block_start = max(0, position - block_size)
+        input_stream.seek(block_start)
+        block = input_stream.read(position - block_start)
+        newline_index = block.rfind("\n")
+        if newline_index >= 0:
+            input_stream.close()
+            return block_start + newline_index + 1
+        position = block_start
+    input_stream.close()
+    return 0
+
+"""
+Returns a list of (start, end) byte offsets that divide the byte range
+[start_offset, end_offset) of the given file into at most num_chunks contiguous
+ranges.  If end_offset is None, then the range extends to the end of the file.
+Every range except possibly the last ends immediately after a newline
+character, so no row is split between two ranges.
+"""
+def _split_file(input_file_path, num_chunks, start_offset = 0,
+                end_offset = None):
+    if end_offset is None:
+        end_offset = os.path.getsize(input_file_path)
+    range_size = end_offset - start_offset
+    boundaries = [start_offset]
+    input_stream = open_safely(input_file_path)
+    for chunk_num in range(1, num_chunks):
+        approximate_boundary = start_offset + \
+            (range_size * chunk_num) // num_chunks
+        if approximate_boundary <= boundaries[-1]:
+            continue
+        input_stream.seek(approximate_boundary)
+        input_stream.readline()
+        boundaries.append(min(input_stream.tell(), end_offset))
+    input_stream.close()
+    boundaries.append(end_offset)
+    return [(start, end) for (start, end) in \
+            zip(boundaries[:-1], boundaries[1:])
+            if start < end]
+
+"""
+Cleans the rows in a single byte range of a Pulse log file in a cleaning
+process.  chunk is an (input_file_path, start, end, num_fields,
+timestamp_index, insert_data_fn, keep_pending_events) tuple, where start and end
+are byte offsets produced by _split_file, keep_pending_events is a boolean, and
+the remaining elements are as in _clean_data.  Returns a (num_rows, events_set,
+discard_counts, pending_events) tuple, where num_rows is the number of rows in
+the range, events_set is the set that insert_data_fn built from them using
+_cleaning_stories_dict, discard_counts is a dict mapping from each DISCARDED_*
+reason to the number of rows discarded for it, and pending_events is a list of
+the rows discarded as DISCARDED_UNKNOWN_STORY if keep_pending_events is True and
+is empty otherwise.
+"""
+def _clean_chunk(chunk):
+    input_file_path, start, end, num_fields, timestamp_index, insert_data_fn, \
+        keep_pending_events = chunk
+    num_rows = 0
+    events_set = set()
+    discard_counts = defaultdict(int)
+    pending_events = []
+    for row in read_lines(input_file_path, start, end):
+        num_rows += 1
+        discard_reason = _clean_row(row, num_fields, timestamp_index,
+                                    insert_data_fn, _cleaning_stories_dict,
+                                    events_set)
+        if discard_reason is not None:
+            discard_counts[discard_reason] += 1
+            if keep_pending_events and \
+                    (discard_reason == DISCARDED_UNKNOWN_STORY):
+                pending_events.append(row)
+    return (num_rows, events_set, dict(discard_counts), pending_events)
+
+"""
+Behaves like the loop over rows in _clean_data, but splits the given raw event
+log file into newline-aligned byte ranges and cleans them in a pool of
+NUM_CLEANING_PROCESSES processes.  The deduplicated events from each range are
+merged into events_set.  Since events are only ever sorted after cleaning, the
+order in which ranges finish does not affect the output.  The number of rows
+discarded for each DISCARDED_* reason is added to discard_counts, a
+defaultdict(int).  Only the rows in the byte range [start_offset, end_offset)
+are cleaned, as in utilities.read_lines.  Rows discarded as
+DISCARDED_UNKNOWN_STORY are written to pending_events_writer as in _clean_data.
+Returns the number of rows cleaned.
+"""
+def _clean_data_in_parallel(input_file_path, num_fields, timestamp_index,
+                            insert_data_fn, stories_dict, events_set,
+                            discard_counts, start_offset = 0,
+                            end_offset = None, pending_events_writer = None):
+    global _cleaning_stories_dict
+    num_chunks = NUM_CLEANING_PROCESSES * CHUNKS_PER_CLEANING_PROCESS
+    chunks = [(input_file_path, start, end, num_fields, timestamp_index,
+               insert_data_fn, pending_events_writer is not None) for \
+              (start, end) in _split_file(input_file_path, num_chunks,
+                                          start_offset, end_offset)]
+    num_rows = 0
+    _cleaning_stories_dict = stories_dict
+    pool = multiprocessing.Pool(NUM_CLEANING_PROCESSES)
+    try:
+        for num_chunk_rows, chunk_events_set, chunk_discard_counts, \
+                chunk_pending_events in pool.imap_unordered(_clean_chunk,
+                                                            chunks):
+            num_rows += num_chunk_rows
+            events_set.update(chunk_events_set)
+            for discard_reason, count in chunk_discard_counts.iteritems():
+                discard_counts[discard_reason] += count
+            for row in chunk_pending_events:
+                pending_events_writer.write_row((row, ))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _cleaning_stories_dict = None
+    return num_rows
 
 """
 Reads the given Pulse log file, filtering out corrupted rows, and calling the
@@ -245,39 +1256,86 @@ briefly describing the data in the plural form that is used to notify the user
 upon completion.  insert_data_fn is a callback function that accepts four
 parameters: a row, formatted as a list, from the log file; the row's timestamp
 represented as seconds since the Unix epoch; stories_dict; and callback_data.
-stories_dict is a dict mapping with keys corresponding to valid stories.
-stories_dict is either built up by insert_data_fn during the execution of
-_clean_data or has already been constructed during a prior call to _clean_data.
-stories_dict is assumed to already have been built if and only if it isn't empty
-when passed in.  The callee can pass additional state to insert_data_fn using
-the callback_data parameter.
+stories_dict is either a dict mapping with keys corresponding to valid stories
+that is built up by insert_data_fn during the execution of _clean_data or a
+story index built by _build_story_index after a prior call to _clean_data.
+stories_dict is assumed to be a story index if and only if insert_data_fn is
+_insert_event.  The callee can pass additional state to insert_data_fn using
+the callback_data parameter.  Once stories_dict has been built, rows are
+cleaned in parallel by _clean_data_in_parallel if NUM_CLEANING_PROCESSES is
+greater than 1 and the log file is not compressed.  Only the rows in the byte
+range [start_offset, end_offset) are cleaned, as in utilities.read_lines.  If
+checkpoint_fn is not None, then it is called after each row with the byte offset
+of the next row so that the state built so far can be checkpointed.  Rows are
+cleaned serially in that case.  If pending_events_writer is not None, then it is
+a TsvWriter of one field to which each row discarded as DISCARDED_UNKNOWN_STORY
+is written, in no particular order.  A metrics record for the stage is written
+with the number of rows discarded for each reason and, if insert_data_fn is
+_insert_full_story, the number of stories fetched.
 """
 def _clean_data(input_file_path, num_fields, timestamp_index, data_descriptor,
-                insert_data_fn, stories_dict, callback_data = None):
+                insert_data_fn, stories_dict, callback_data = None,
+                start_offset = 0, end_offset = None, checkpoint_fn = None,
+                pending_events_writer = None):
     start_time = time.time()
-    stories_dict_already_built = (len(stories_dict) > 0)
-    num_rows = 0
-    input_stream = open_safely(input_file_path)
-    for row in input_stream:
-        num_rows += 1
-        row_without_newline = row[:-1]
-        _clean_row(row_without_newline, num_fields, timestamp_index,
-                   insert_data_fn, stories_dict, callback_data)
-    
-    input_stream.close()
+    metrics = StageMetrics("clean " + data_descriptor)
+    if insert_data_fn is _insert_full_story:
+        fetch_counts_before = _get_fetch_counts(callback_data)
+    stories_dict_already_built = (insert_data_fn is _insert_event)
+    num_stories_before = len(stories_dict)
+    discard_counts = defaultdict(int)
+    is_compressed = (get_compression_extension(
+        find_file_path(input_file_path)) is not None)
+    if stories_dict_already_built and (NUM_CLEANING_PROCESSES > 1) and \
+            (checkpoint_fn is None) and not is_compressed:
+        num_rows = _clean_data_in_parallel(input_file_path, num_fields,
+                                           timestamp_index, insert_data_fn,
+                                           stories_dict, callback_data,
+                                           discard_counts, start_offset,
+                                           end_offset, pending_events_writer)
+        if end_offset is None:
+            end_offset = os.path.getsize(input_file_path)
+        metrics.bytes_read = end_offset - start_offset
+    else:
+        num_rows = 0
+        position = start_offset
+        for row in read_lines(input_file_path, start_offset, end_offset):
+            num_rows += 1
+            discard_reason = _clean_row(row, num_fields, timestamp_index,
+                                        insert_data_fn, stories_dict,
+                                        callback_data)
+            if discard_reason is not None:
+                discard_counts[discard_reason] += 1
+                if (pending_events_writer is not None) and \
+                        (discard_reason == DISCARDED_UNKNOWN_STORY):
+                    pending_events_writer.write_row((row, ))
+            position += len(row) + 1
+            if checkpoint_fn is not None:
+                checkpoint_fn(position)
+        metrics.bytes_read = position - start_offset
     
     if stories_dict_already_built:
         # We just cleaned user reads or clickthroughs.
         num_valid_rows = len(callback_data)
     else:
         # We just cleaned stories.
-        num_valid_rows = len(stories_dict)
+        num_valid_rows = len(stories_dict) - num_stories_before
     
     num_invalid_rows = num_rows - num_valid_rows
-    discard_rate = float(100 * num_invalid_rows) / float(num_rows)
+    discard_rate = float(100 * num_invalid_rows) / float(max(num_rows, 1))
     print("Read a total of %d %s, %d (%.2f%%) of which were discarded." %
           (num_rows, data_descriptor, num_invalid_rows, discard_rate))
     report_time_elapsed(start_time)
+    
+    metrics.num_rows = num_rows
+    for discard_reason, count in discard_counts.iteritems():
+        metrics.count(discard_reason, count)
+    metrics.count(DISCARDED_DUPLICATE,
+                  max(0, num_invalid_rows - sum(discard_counts.values())))
+    if insert_data_fn is _insert_full_story:
+        _count_fetches(metrics, fetch_counts_before,
+                       _get_fetch_counts(callback_data))
+    _record_stage_metrics(metrics)
 
 """
 Replaces the original 38-character hexadecimal user IDs found in the input log
@@ -318,6 +1376,212 @@ def get_user_ids(reads_list, clickthroughs_list):
     report_time_elapsed(start_time)
     return user_ids_list
 
+"""
+Generates the distinct original user IDs found in the given iterables of user
+events in ascending lexicographic order.  Both iterables must generate events in
+ascending order, as SpilledEventSet does, so the user IDs in each are already
+sorted and are merged without being held in memory.
+"""
+def _merge_user_ids(sorted_reads, sorted_clickthroughs):
+    reads_user_ids = (read[EVENTS_USER_ID_INDEX] for read in sorted_reads)
+    clickthroughs_user_ids = (clickthrough[EVENTS_USER_ID_INDEX] for \
+                              clickthrough in sorted_clickthroughs)
+    previous_user_id = None
+    for user_id in heapq.merge(reads_user_ids, clickthroughs_user_ids):
+        if user_id != previous_user_id:
+            yield user_id
+            previous_user_id = user_id
+
+"""
+Generates the events in the given iterable with their original user IDs replaced
+by the row numbers of these IDs in USER_IDS_FILE_PATH, which must already have
+been written.  Events must be generated in ascending order, so the file is read
+in lockstep with the events rather than loaded into a dict.
+"""
+def _reassign_user_ids_while_streaming(sorted_events):
+    user_ids = read_lines(USER_IDS_FILE_PATH)
+    original_user_id = None
+    new_user_id = -1
+    for event in sorted_events:
+        while event[EVENTS_USER_ID_INDEX] != original_user_id:
+            original_user_id = user_ids.next()
+            new_user_id += 1
+        yield (new_user_id, event[EVENTS_STORY_ID_INDEX],
+               event[NEW_EVENTS_TIMESTAMP_INDEX])
+    user_ids.close()
+
+"""
+Writes the user IDs and the user events in the given SpilledEventSets to their
+processed log files without holding them all in memory.  The output is identical
+to that of sorting the events in memory, calling get_user_ids, and writing the
+results.
+"""
+def _write_spilled_events(reads_set, clickthroughs_set):
+    _write_user_ids(_merge_user_ids(reads_set, clickthroughs_set))
+    _write_events(_reassign_user_ids_while_streaming(reads_set),
+                  PROCESSED_READS_FILE_PATH, READS_DESCRIPTOR)
+    _write_events(_reassign_user_ids_while_streaming(clickthroughs_set),
+                  PROCESSED_CLICKTHROUGHS_FILE_PATH, CLICKTHROUGHS_DESCRIPTOR)
+
+"""
+Returns the row of the processed stories log file for the story with the given
+key and value in stories_dict as a tuple of fields.
+"""
+def _format_story(story_key, story_value):
+    if FETCH_FULL_STORIES:
+        story_timestamp, story_contents = story_value
+        story_title_with_contents = story_key[NEW_STORIES_TITLE_INDEX] + \
+            " " + story_contents
+        return (story_key[NEW_STORIES_FEED_URL_INDEX],
+                story_key[NEW_STORIES_FEED_TITLE_INDEX],
+                story_key[NEW_STORIES_URL_INDEX], story_title_with_contents,
+                story_timestamp)
+    return story_key + (story_value, )
+
+"""
+Returns the file paths of the binary column files with the given names that
+accompany the processed log file with the given file path.
+"""
+def get_column_file_paths(file_path, column_names):
+    file_path_sans_extension = os.path.splitext(file_path)[0]
+    return [file_path_sans_extension + "." + column_name + COLUMN_EXTENSION \
+            for column_name in column_names]
+
+"""
+Returns the file path of the user index that accompanies the processed event log
+file with the given file path.
+"""
+def get_user_index_file_path(file_path):
+    return os.path.splitext(file_path)[0] + USER_INDEX_EXTENSION
+
+"""
+Returns the file path of the pending events file that accompanies the processed
+event log file with the given file path.
+"""
+def _get_pending_events_file_path(file_path):
+    return os.path.splitext(file_path)[0] + PENDING_EVENTS_EXTENSION
+
+"""
+Returns a (start_offset, end_offset) tuple of the byte offsets in the processed
+event log file with the given file path between which the events of the users
+with IDs in the range [min_user_id, max_user_id] lie, as read_int_tsv takes
+them.  end_offset is None if those events may extend to the end of the file.
+Returns None if the log file has no user index, or if its index is older than
+it and so may not describe it.
+"""
+def find_user_offsets(file_path, min_user_id, max_user_id):
+    index_file_path = get_user_index_file_path(file_path)
+    if (not os.path.exists(index_file_path)) or \
+            (os.path.getmtime(index_file_path) <
+             os.path.getmtime(find_file_path(file_path))):
+        return None
+    start_offset = 0
+    end_offset = None
+    for user_id, offset in read_int_tsv(index_file_path, 2):
+        if user_id <= min_user_id:
+            start_offset = offset
+        elif user_id > max_user_id:
+            end_offset = offset
+            break
+    return (start_offset, end_offset)
+
+"""
+Returns a list of BinaryColumnWriters for the binary column files with the given
+names that accompany the processed log file with the given file path, or None if
+WRITE_BINARY_COLUMNS is False.  If temporary is True, then each column file is
+created under its name plus TEMPORARY_EXTENSION.
+"""
+def _open_column_writers(file_path, column_names, temporary = False):
+    if not WRITE_BINARY_COLUMNS:
+        return None
+    return [BinaryColumnWriter(column_file_path) for column_file_path in \
+            _get_written_file_paths(file_path, column_names, temporary)[1:]]
+
+"""
+Returns the path to which the processed log file with the given file path is
+written, which is the file path plus COMPRESSED_OUTPUT_EXTENSION if it is not
+None.
+"""
+def _get_output_file_path(file_path):
+    if COMPRESSED_OUTPUT_EXTENSION is None:
+        return file_path
+    return file_path + COMPRESSED_OUTPUT_EXTENSION
+
+"""
+Returns the paths to the existing uncompressed and compressed versions of the
+processed log files with the given file paths other than the ones that are
+written, as returned by _get_output_file_path.
+"""
+def _get_stale_output_file_paths(file_paths):
+    stale_file_paths = []
+    for file_path in file_paths:
+        output_file_path = _get_output_file_path(file_path)
+        for stale_file_path in [file_path] + [file_path + extension for \
+                                              extension in \
+                                              COMPRESSED_EXTENSIONS]:
+            if (stale_file_path != output_file_path) and \
+                    os.path.exists(stale_file_path):
+                stale_file_paths.append(stale_file_path)
+    return stale_file_paths
+
+"""
+Removes the uncompressed and compressed versions of the processed log files with
+the given file paths other than the ones that were just written, as returned by
+_get_output_file_path.  Otherwise, a version left over from a run with a
+different COMPRESSED_OUTPUT_EXTENSION could be read in place of the new one.
+"""
+def _remove_stale_outputs(file_paths):
+    for stale_file_path in _get_stale_output_file_paths(file_paths):
+        os.remove(stale_file_path)
+
+"""
+Returns the paths to which the processed log file with the given file path and
+the binary column files with the given names that accompany it are written, in
+that order.  The log file path is as returned by _get_output_file_path.  Column
+files are only included if WRITE_BINARY_COLUMNS is True.  If temporary is True,
+then TEMPORARY_EXTENSION is appended to each path, but before any compression
+extension so that the temporary log file is still compressed.
+"""
+def _get_written_file_paths(file_path, column_names, temporary = False):
+    file_paths = []
+    if WRITE_BINARY_COLUMNS:
+        file_paths.extend(get_column_file_paths(file_path, column_names))
+    if temporary:
+        file_path += TEMPORARY_EXTENSION
+        file_paths = [column_file_path + TEMPORARY_EXTENSION for \
+                      column_file_path in file_paths]
+    return [_get_output_file_path(file_path)] + file_paths
+
+"""
+Closes the given list of BinaryColumnWriters returned by _open_column_writers.
+"""
+def _close_column_writers(column_writers):
+    if column_writers is not None:
+        for column_writer in column_writers:
+            column_writer.close()
+
+"""
+Appends the feed ID and time first read of the story with the given key to the
+given story column writers.  feed_ids_dict maps from the feed URLs written so
+far to their feed IDs.  Since stories are written in ascending order, new feed
+URLs are assigned ascending feed IDs.
+"""
+def _append_story_columns(column_writers, story_key, story_timestamp,
+                          feed_ids_dict):
+    feed_id = feed_ids_dict.setdefault(story_key[NEW_STORIES_FEED_URL_INDEX],
+                                       len(feed_ids_dict))
+    column_writers[0].append(feed_id)
+    column_writers[1].append(story_timestamp)
+
+"""
+Returns the time at which the story with the given value in stories_dict was
+first read.
+"""
+def _get_story_timestamp(story_value):
+    if FETCH_FULL_STORIES:
+        return story_value[0]
+    return story_value
+
 """
 Writes the stories in the given dict to PROCESSED_STORIES_FILE_PATH in ascending
 lexicographic order.  Stories are output in newline-delimited raw text format.
@@ -327,71 +1591,814 @@ PROCESSED_STORIES_FILE_PATH.  Thus, when the function returns, stories_dict
 contains a mapping from stories to their IDs.  The output fields are (feed_url,
 feed_title, story_url, story_title) if FETCH_FULL_STORIES is False.  If
 FETCH_FULL_STORIES is true, then feed_title is replaced by feed_title + " " +
-story_contents.
+story_contents, and the keys of the stories and the hashes of their contents are
+also written to STORY_KEYS_FILE_PATH and STORY_CONTENTS_HASHES_FILE_PATH.  If
+WRITE_BINARY_COLUMNS is True, then the story columns are also written.
 """
 def _write_stories(stories_dict):
     start_time = time.time()
     sorted_stories = sorted(stories_dict.keys())
     row_num = 0
-    output_stream = open_safely(PROCESSED_STORIES_FILE_PATH, "w")
+    stories_writer = TsvWriter(_get_output_file_path(
+        PROCESSED_STORIES_FILE_PATH), STORIES_NUM_FIELDS)
+    if FETCH_FULL_STORIES:
+        keys_writer = TsvWriter(_get_output_file_path(STORY_KEYS_FILE_PATH),
+                                STORIES_TIMESTAMP_INDEX)
+        hashes_writer = TsvWriter(_get_output_file_path(
+            STORY_CONTENTS_HASHES_FILE_PATH), 1)
+        story_contents_hashes = set()
+    column_writers = _open_column_writers(PROCESSED_STORIES_FILE_PATH,
+                                          STORY_COLUMN_NAMES)
+    feed_ids_dict = {}
     for story_key in sorted_stories:
+        story_value = stories_dict[story_key]
+        stories_writer.write_row(_format_story(story_key, story_value))
         if FETCH_FULL_STORIES:
-            story_timestamp, story_contents = stories_dict[story_key]
-            story_title_with_contents = story_key[NEW_STORIES_TITLE_INDEX] + \
-                " " + story_contents
-            story_sans_timestamp_as_tuple = \
-                (story_key[NEW_STORIES_FEED_URL_INDEX],
-                 story_key[NEW_STORIES_FEED_TITLE_INDEX],
-                    story_key[NEW_STORIES_URL_INDEX],
-                    story_title_with_contents)
-            story_sans_timestamp_as_str = \
-                DELIMITER.join(story_sans_timestamp_as_tuple)
-        else:
-            story_timestamp = stories_dict[story_key]
-            story_sans_timestamp_as_str = DELIMITER.join(story_key)
-        story_timestamp_as_str = DELIMITER + str(story_timestamp)
-        story_as_str = story_sans_timestamp_as_str + story_timestamp_as_str
-        output_stream.write(story_as_str + "\n")
+            keys_writer.write_row(story_key)
+            story_contents_hash = get_story_contents_hash(story_value[1])
+            hashes_writer.write_row((story_contents_hash, ))
+            story_contents_hashes.add(story_contents_hash)
+        if column_writers is not None:
+            _append_story_columns(column_writers, story_key,
+                                  _get_story_timestamp(story_value),
+                                  feed_ids_dict)
         stories_dict[story_key] = row_num
         row_num += 1
-    output_stream.close()
+    stories_writer.close()
+    if FETCH_FULL_STORIES:
+        keys_writer.close()
+        hashes_writer.close()
+    _close_column_writers(column_writers)
     print("Wrote %d cleaned and sorted %s to %s" %
           (row_num, STORIES_DESCRIPTOR, PROCESSED_STORIES_FILE_PATH))
+    if FETCH_FULL_STORIES:
+        print("These %s have %d distinct contents." %
+              (STORIES_DESCRIPTOR, len(story_contents_hashes)))
     report_time_elapsed(start_time)
+    _record_write_metrics(STORIES_DESCRIPTOR, start_time, row_num,
+                          PROCESSED_STORIES_FILE_PATH, STORY_COLUMN_NAMES)
 
 """
-Writes the user events in the given list to the given output file.  Events are
-output in newline-delimited raw text format.  Within a given row, fields are
-delimited by DELIMITER.  event_descriptor is a string briefly describing the
-events in the plural form that is used to notify the user upon completion.
+Writes the user events in the given iterable to the given output file.  Events
+are output in newline-delimited raw text format.  Within a given row, fields are
+delimited by DELIMITER.  If WRITE_BINARY_COLUMNS is True, then the event
+columns are also written.  The events must be sorted by user ID, and their user
+index is written too.  event_descriptor is a string briefly describing the
+events in the plural form that is used to notify the user upon completion.  If
+temporary is True, then every file is written under its name plus
+TEMPORARY_EXTENSION.
 """
-def _write_events(events_list, output_file_path, event_descriptor):
+def _write_events(events_list, output_file_path, event_descriptor,
+                  temporary = False):
     start_time = time.time()
-    output_stream = open_safely(output_file_path, "w")
+    num_events = 0
+    column_writers = _open_column_writers(output_file_path, EVENT_COLUMN_NAMES,
+                                          temporary)
+    events_writer = TsvWriter(_get_written_file_paths(output_file_path, (),
+                                                      temporary)[0],
+                              NEW_EVENTS_NUM_FIELDS)
+    index_file_path = get_user_index_file_path(output_file_path)
+    if temporary:
+        index_file_path += TEMPORARY_EXTENSION
+    index_writer = TsvWriter(index_file_path, 2)
+    previous_user_id = None
+    num_events_since_indexed = USER_INDEX_INTERVAL
     for event in events_list:
-        output_stream.write(DELIMITER.join(map(str, event)) + "\n")
-    output_stream.close()
-    num_events = len(events_list)
+        user_id = event[EVENTS_USER_ID_INDEX]
+        if (user_id != previous_user_id) and \
+                (num_events_since_indexed >= USER_INDEX_INTERVAL):
+            index_writer.write_row((user_id, events_writer.tell()))
+            num_events_since_indexed = 0
+        previous_user_id = user_id
+        num_events_since_indexed += 1
+        events_writer.write_row(event)
+        if column_writers is not None:
+            for column_writer, field in zip(column_writers, event):
+                column_writer.append(field)
+        num_events += 1
+    events_writer.close()
+    # Close the index last so that it is never older than the log file.
+    index_writer.close()
+    _close_column_writers(column_writers)
     print("Wrote %d cleaned and sorted %s to %s" %
           (num_events, event_descriptor, output_file_path))
     report_time_elapsed(start_time)
+    _record_write_metrics(event_descriptor, start_time, num_events,
+                          output_file_path, EVENT_COLUMN_NAMES, temporary)
 
 """
-Writes the user IDs in the given list to USER_IDS_FILE_PATH.  User IDs are
+Writes the user IDs in the given iterable to USER_IDS_FILE_PATH.  User IDs are
 output in newline-delimited raw text format.  The IDs written are the original
 hexadecimal IDs from the raw Pulse log files, and the new IDs are the row
-numbers of the old IDs in the output file, USER_IDS_FILE_PATH.
+numbers of the old IDs in the output file, USER_IDS_FILE_PATH.  If temporary is
+True, then the file is written under its name plus TEMPORARY_EXTENSION.
 """
-def _write_user_ids(user_ids_list):
+def _write_user_ids(user_ids_list, temporary = False):
     start_time = time.time()
-    output_stream = open_safely(USER_IDS_FILE_PATH, "w")
+    num_users = 0
+    user_ids_writer = TsvWriter(_get_written_file_paths(USER_IDS_FILE_PATH, (),
+                                                        temporary)[0], 1)
     for user_id in user_ids_list:
-        output_stream.write(user_id + "\n")
-    output_stream.close()
-    num_users = len(user_ids_list)
+        user_ids_writer.write_row((user_id, ))
+        num_users += 1
+    user_ids_writer.close()
     print(("Wrote %d cleaned and sorted original 38-character hexadecimal %s " +
            "to %s") % (num_users, USER_IDS_DESCRIPTOR, USER_IDS_FILE_PATH))
     report_time_elapsed(start_time)
+    _record_write_metrics(USER_IDS_DESCRIPTOR, start_time, num_users,
+                          USER_IDS_FILE_PATH, (), temporary)
+
+"""
+Writes a metrics record for a stage, started at the given time, that wrote the
+given number of rows of data of the type described by the given descriptor to
+the given processed log file and its binary columns with the given names.  If
+temporary is True, then the files were written under temporary names.
+"""
+def _record_write_metrics(data_descriptor, start_time, num_rows, file_path,
+                          column_names, temporary = False):
+    metrics = StageMetrics("write " + data_descriptor)
+    metrics.start_time = start_time
+    metrics.num_rows = num_rows
+    metrics.bytes_written = _get_total_size(
+        _get_written_file_paths(file_path, column_names, temporary))
+    _record_stage_metrics(metrics)
+
+"""
+Cleans the rows of the given raw event log file in the byte range [start_offset,
+end_offset) into events_set with _insert_event, as in _clean_data, and writes
+those that reference stories that aren't in story_index to the pending events
+file of the given processed event log file.  If retry_pending is True, then the
+events in the existing pending events file, if any, are cleaned again into
+events_set as well, and the new pending events file is written under its name
+plus TEMPORARY_EXTENSION.  event_descriptor is as in _clean_data.
+"""
+def _clean_events(raw_file_path, processed_file_path, event_descriptor,
+                  story_index, events_set, start_offset, end_offset,
+                  retry_pending = False):
+    pending_file_path = _get_pending_events_file_path(processed_file_path)
+    if retry_pending:
+        pending_events_writer = TsvWriter(pending_file_path +
+                                          TEMPORARY_EXTENSION, 1)
+    else:
+        pending_events_writer = TsvWriter(pending_file_path, 1)
+    if retry_pending and os.path.exists(pending_file_path):
+        # Clean them into a set of their own, since _clean_data counts the
+        # events in the set to report how many rows it discarded.
+        pending_events_set = set()
+        _clean_data(pending_file_path, OLD_EVENTS_NUM_FIELDS,
+                    OLD_EVENTS_TIMESTAMP_INDEX, "pending " + event_descriptor,
+                    _insert_event, story_index, pending_events_set, 0, None,
+                    None, pending_events_writer)
+    else:
+        pending_events_set = ()
+    _clean_data(raw_file_path, OLD_EVENTS_NUM_FIELDS,
+                OLD_EVENTS_TIMESTAMP_INDEX, event_descriptor, _insert_event,
+                story_index, events_set, start_offset, end_offset, None,
+                pending_events_writer)
+    pending_events_writer.close()
+    for event in pending_events_set:
+        events_set.add(event)
+
+"""
+Cleans the raw user reads and clickthroughs log files and writes the processed
+event and user ID log files while holding roughly EVENTS_MEMORY_BUDGET bytes of
+events in memory.  The budget is shared by the reads and clickthroughs, which
+are cleaned one after the other.  story_index is a story index built by
+_build_story_index, and only the rows before the offsets in the given dict, as
+returned by _get_raw_end_offsets, are cleaned.
+"""
+def _process_events_externally(story_index, end_offsets):
+    max_events_in_memory = max(1, EVENTS_MEMORY_BUDGET // BYTES_PER_EVENT)
+    reads_set = SpilledEventSet(max_events_in_memory, EVENTS_SPILL_DIRECTORY)
+    clickthroughs_set = SpilledEventSet(max_events_in_memory,
+                                        EVENTS_SPILL_DIRECTORY)
+    try:
+        _clean_events(RAW_READS_FILE_PATH, PROCESSED_READS_FILE_PATH,
+                      READS_DESCRIPTOR, story_index, reads_set, 0,
+                      end_offsets[READS_FILENAME])
+        reads_set.spill()
+        _clean_events(RAW_CLICKTHROUGHS_FILE_PATH,
+                      PROCESSED_CLICKTHROUGHS_FILE_PATH,
+                      CLICKTHROUGHS_DESCRIPTOR, story_index, clickthroughs_set,
+                      0, end_offsets[CLICKTHROUGHS_FILENAME])
+        clickthroughs_set.spill()
+        _write_spilled_events(reads_set, clickthroughs_set)
+    finally:
+        reads_set.close()
+        clickthroughs_set.close()
+
+"""
+Cleans the raw user reads and clickthroughs log files into CompactEventSets and
+writes the processed event and user ID log files.  Instead of rebuilding every
+event as get_user_ids does, the sorted original user IDs are mapped to 0, 1, 2,
+etc. with a single vectorized lookup per column before the columns are sorted.
+The output is identical to that of the set-based path.  story_index and
+end_offsets are as in _process_events_externally.
+"""
+def _process_events_compactly(story_index, end_offsets):
+    user_ids = UserIdInterner()
+    reads_set = CompactEventSet(user_ids)
+    _clean_events(RAW_READS_FILE_PATH, PROCESSED_READS_FILE_PATH,
+                  READS_DESCRIPTOR, story_index, reads_set, 0,
+                  end_offsets[READS_FILENAME])
+    clickthroughs_set = CompactEventSet(user_ids)
+    _clean_events(RAW_CLICKTHROUGHS_FILE_PATH,
+                  PROCESSED_CLICKTHROUGHS_FILE_PATH,
+                  CLICKTHROUGHS_DESCRIPTOR, story_index, clickthroughs_set, 0,
+                  end_offsets[CLICKTHROUGHS_FILENAME])
+    
+    start_time = time.time()
+    metrics = StageMetrics("reassign " + USER_IDS_DESCRIPTOR)
+    user_ids_list, new_user_ids = user_ids.sort()
+    reads_columns = reads_set.get_sorted_columns(new_user_ids)
+    del reads_set
+    clickthroughs_columns = clickthroughs_set.get_sorted_columns(new_user_ids)
+    del clickthroughs_set
+    print("Reassigned %s from original values to 0, 1, 2, etc." % \
+          USER_IDS_DESCRIPTOR)
+    report_time_elapsed(start_time)
+    metrics.num_rows = len(reads_columns[0]) + len(clickthroughs_columns[0])
+    _record_stage_metrics(metrics)
+    _write_events(iterate_rows(reads_columns), PROCESSED_READS_FILE_PATH,
+                  READS_DESCRIPTOR)
+    _write_events(iterate_rows(clickthroughs_columns),
+                  PROCESSED_CLICKTHROUGHS_FILE_PATH, CLICKTHROUGHS_DESCRIPTOR)
+    _write_user_ids(user_ids_list)
+
+"""
+Cleans the raw user reads and clickthroughs log files and writes the processed
+event and user ID log files, holding events in sets of tuples, in
+CompactEventSets, or in SpilledEventSets as configured.  story_index and
+end_offsets are as in _process_events_externally.  The events that reference
+unknown stories are written to the pending events files.
+"""
+def _process_events(story_index, end_offsets):
+    if EVENTS_MEMORY_BUDGET is not None:
+        _process_events_externally(story_index, end_offsets)
+        return
+    if COMPACT_EVENTS and (CompactEventSet is not None):
+        _process_events_compactly(story_index, end_offsets)
+        return
+    
+    reads_set = set()
+    _clean_events(RAW_READS_FILE_PATH, PROCESSED_READS_FILE_PATH,
+                  READS_DESCRIPTOR, story_index, reads_set, 0,
+                  end_offsets[READS_FILENAME])
+    clickthroughs_set = set()
+    _clean_events(RAW_CLICKTHROUGHS_FILE_PATH,
+                  PROCESSED_CLICKTHROUGHS_FILE_PATH,
+                  CLICKTHROUGHS_DESCRIPTOR, story_index, clickthroughs_set, 0,
+                  end_offsets[CLICKTHROUGHS_FILENAME])
+    
+    metrics = StageMetrics("reassign " + USER_IDS_DESCRIPTOR)
+    reads_list = sorted(reads_set)
+    clickthroughs_list = sorted(clickthroughs_set)
+    user_ids_list = get_user_ids(reads_list, clickthroughs_list)
+    metrics.num_rows = len(reads_list) + len(clickthroughs_list)
+    _record_stage_metrics(metrics)
+    _write_events(reads_list, PROCESSED_READS_FILE_PATH, READS_DESCRIPTOR)
+    _write_events(clickthroughs_list, PROCESSED_CLICKTHROUGHS_FILE_PATH,
+                  CLICKTHROUGHS_DESCRIPTOR)
+    _write_user_ids(user_ids_list)
+
+"""
+Cleans the rows of RAW_STORIES_FILE_PATH in the byte range [start_offset,
+end_offset) into stories_dict with insert_story_fn, as in _clean_data.  If
+FETCH_FULL_STORIES is True, then the story contents cache and the HttpFetcher are
+opened for the duration of the cleaning, story contents are prefetched
+concurrently if NUM_FETCH_THREADS is greater than 1, and equal contents are
+shared with _share_story_contents, including those already in
+story_contents_dict from a checkpoint.  If raw_end_offsets is not
+None and CHECKPOINT_INTERVAL is not None, then checkpoints are written with
+_write_checkpoint as the stories are cleaned, and once more when they are done.
+raw_end_offsets is then the dict that process_data records in
+INGEST_STATE_FILE_PATH.
+"""
+def _clean_stories(stories_dict, insert_story_fn, story_contents_dict,
+                   start_offset = 0, end_offset = None, raw_end_offsets = None):
+    global _story_cache, _http_fetcher, _story_contents_by_digest
+    if (raw_end_offsets is None) or (CHECKPOINT_INTERVAL is None):
+        checkpoint_fn = None
+    else:
+        checkpoint_fn = functools.partial(_write_checkpoint, stories_dict,
+                                          story_contents_dict, raw_end_offsets)
+    if FETCH_FULL_STORIES:
+        _story_cache = open_story_cache()
+        _http_fetcher = open_http_fetcher()
+        _story_contents_by_digest = {}
+        for story_contents_key, story_contents in \
+                story_contents_dict.items():
+            story_contents_dict[story_contents_key] = \
+                _share_story_contents(story_contents)
+    try:
+        if FETCH_FULL_STORIES and (NUM_FETCH_THREADS > 1):
+            _prefetch_full_stories(story_contents_dict, start_offset,
+                                   end_offset, checkpoint_fn)
+        _clean_data(RAW_STORIES_FILE_PATH, STORIES_NUM_FIELDS,
+                    STORIES_TIMESTAMP_INDEX, STORIES_DESCRIPTOR,
+                    insert_story_fn, stories_dict, story_contents_dict,
+                    start_offset, end_offset, checkpoint_fn)
+        if checkpoint_fn is not None:
+            if end_offset is None:
+                end_offset = _get_complete_rows_end(RAW_STORIES_FILE_PATH)
+            checkpoint_fn(max(start_offset, end_offset), True)
+    finally:
+        if _story_cache is not None:
+            _story_cache.close()
+            _story_cache = None
+        if _http_fetcher is not None:
+            _http_fetcher.close()
+            _http_fetcher = None
+        _story_contents_by_digest = None
+
+"""
+The time at which the last checkpoint was written, or at which the current run
+started if no checkpoint has been written yet, in seconds since the Unix epoch.
+"""
+_last_checkpoint_time = None
+
+"""
+Atomically writes a checkpoint to CHECKPOINT_FILE_PATH from which process_data
+can resume cleaning stories at the given byte offset into RAW_STORIES_FILE_PATH
+if CHECKPOINT_INTERVAL seconds have passed since the last checkpoint or if
+force is True.  stories_dict and story_contents_dict are as built by the
+callbacks passed to _clean_data, and raw_end_offsets is the dict of raw log file
+offsets that process_data will record in INGEST_STATE_FILE_PATH.  The checkpoint
+is pickled to a temporary file, which is flushed to disk before it is renamed
+over the previous checkpoint, so a crash never leaves a partial checkpoint.
+"""
+def _write_checkpoint(stories_dict, story_contents_dict, raw_end_offsets,
+                      stories_offset, force = False):
+    global _last_checkpoint_time
+    if (not force) and \
+            (time.time() - _last_checkpoint_time < CHECKPOINT_INTERVAL):
+        return
+    start_time = time.time()
+    checkpoint = {"fetch_full_stories": FETCH_FULL_STORIES,
+                  "raw_end_offsets": raw_end_offsets,
+                  "stories_offset": stories_offset,
+                  "stories_dict": dict(stories_dict),
+                  "story_contents_dict": story_contents_dict}
+    temporary_file_path = CHECKPOINT_FILE_PATH + TEMPORARY_EXTENSION
+    output_stream = open_safely(temporary_file_path, "wb")
+    cPickle.dump(checkpoint, output_stream, cPickle.HIGHEST_PROTOCOL)
+    output_stream.flush()
+    os.fsync(output_stream.fileno())
+    output_stream.close()
+    os.rename(temporary_file_path, CHECKPOINT_FILE_PATH)
+    _last_checkpoint_time = time.time()
+    print("Checkpointed %d %s at byte %d of %s to %s" %
+          (len(stories_dict), STORIES_DESCRIPTOR, stories_offset,
+           RAW_STORIES_FILE_PATH, CHECKPOINT_FILE_PATH))
+    report_time_elapsed(start_time)
+
+"""
+Returns the checkpoint written by _write_checkpoint as a dict.  Prints an error
+message to sys.stderr and exits the program if there is no usable checkpoint.
+"""
+def _read_checkpoint():
+    if not os.path.exists(CHECKPOINT_FILE_PATH):
+        print >> sys.stderr, ("Could not find %s.  Run %s without %s to " +
+                              "start from the beginning.") % \
+                              (CHECKPOINT_FILE_PATH, __file__, RESUME_FLAG)
+        sys.exit(errno.ENOENT)
+    input_stream = open_safely(CHECKPOINT_FILE_PATH, "rb")
+    checkpoint = cPickle.load(input_stream)
+    input_stream.close()
+    if checkpoint["fetch_full_stories"] != FETCH_FULL_STORIES:
+        print >> sys.stderr, ("The checkpoint was written with " +
+                              "FETCH_FULL_STORIES = %s.  Run %s without %s " +
+                              "to start from the beginning.") % \
+                              (checkpoint["fetch_full_stories"], __file__,
+                               RESUME_FLAG)
+        sys.exit(errno.EINVAL)
+    if _get_complete_rows_end(RAW_STORIES_FILE_PATH) < \
+            checkpoint["stories_offset"]:
+        print >> sys.stderr, ("%s is shorter than when the checkpoint was " +
+                              "written.  Run %s without %s to start from " +
+                              "the beginning.") % \
+                              (RAW_STORIES_FILE_PATH, __file__, RESUME_FLAG)
+        sys.exit(errno.EINVAL)
+    return checkpoint
+
+"""
+Returns a dict mapping from the filename of each raw Pulse log file to the byte
+offset of the end of its last complete row.
+"""
+def _get_raw_end_offsets():
+    return {STORIES_FILENAME: _get_complete_rows_end(RAW_STORIES_FILE_PATH),
+            READS_FILENAME: _get_complete_rows_end(RAW_READS_FILE_PATH),
+            CLICKTHROUGHS_FILENAME: \
+                _get_complete_rows_end(RAW_CLICKTHROUGHS_FILE_PATH)}
+
+"""
+Atomically writes the given dict of raw log file offsets to
+INGEST_STATE_FILE_PATH, along with FETCH_FULL_STORIES, which must not change
+between incremental updates.
+"""
+def _write_ingest_state(raw_offsets):
+    state = {"fetch_full_stories": FETCH_FULL_STORIES,
+             "raw_offsets": raw_offsets}
+    temporary_file_path = INGEST_STATE_FILE_PATH + TEMPORARY_EXTENSION
+    output_stream = open_safely(temporary_file_path, "w")
+    json.dump(state, output_stream, indent=4, sort_keys=True)
+    output_stream.close()
+    os.rename(temporary_file_path, INGEST_STATE_FILE_PATH)
+
+"""
+Returns the dict of raw log file offsets in INGEST_STATE_FILE_PATH.  Prints an
+error message to sys.stderr and exits the program if the processed data cannot
+be updated incrementally.
+"""
+def _read_ingest_state():
+    if not os.path.exists(INGEST_STATE_FILE_PATH):
+        print >> sys.stderr, ("Could not find %s.  Run %s without %s to " +
+                              "process all of the raw data first.") % \
+                              (INGEST_STATE_FILE_PATH, __file__,
+                               INCREMENTAL_FLAG)
+        sys.exit(errno.ENOENT)
+    input_stream = open_safely(INGEST_STATE_FILE_PATH)
+    state = json.load(input_stream)
+    input_stream.close()
+    if state["fetch_full_stories"] != FETCH_FULL_STORIES:
+        print >> sys.stderr, ("The processed data was created with " +
+                              "FETCH_FULL_STORIES = %s.  Rerun %s without " +
+                              "%s to rebuild it.") % \
+                              (state["fetch_full_stories"], __file__,
+                               INCREMENTAL_FLAG)
+        sys.exit(errno.EINVAL)
+    return dict([(str(filename), offset) for (filename, offset) in \
+                 state["raw_offsets"].iteritems()])
+
+"""
+Returns a (story_keys, story_timestamps) tuple describing the stories in
+PROCESSED_STORIES_FILE_PATH.  story_keys is a list of the (feed_url,
+feed_title, story_url, story_title) keys of the stories in order of story ID,
+which is ascending order.  story_timestamps is a list of the corresponding
+times first read.  If FETCH_FULL_STORIES is True, then the keys are read from
+STORY_KEYS_FILE_PATH.
+"""
+def _read_processed_story_keys():
+    story_keys = []
+    story_timestamps = []
+    if FETCH_FULL_STORIES:
+        keys = read_tsv(STORY_KEYS_FILE_PATH)
+    for story_as_list in read_tsv(PROCESSED_STORIES_FILE_PATH):
+        if FETCH_FULL_STORIES:
+            story_keys.append(tuple(keys.next()))
+        else:
+            story_keys.append(tuple(story_as_list[:STORIES_TIMESTAMP_INDEX]))
+        story_timestamps.append(int(story_as_list[STORIES_TIMESTAMP_INDEX]))
+    if FETCH_FULL_STORIES:
+        keys.close()
+    return (story_keys, story_timestamps)
+
+"""
+Writes the union of the existing processed stories and the new stories to
+PROCESSED_STORIES_FILE_PATH + TEMPORARY_EXTENSION in ascending lexicographic
+order, and likewise for STORY_KEYS_FILE_PATH and STORY_CONTENTS_HASHES_FILE_PATH
+if FETCH_FULL_STORIES is True.
+story_keys is the list of existing story keys in order of story ID.
+new_story_keys is a sorted list of the keys of the stories that are not yet
+processed.  stories_dict maps from the keys of both kinds of stories to their
+values as built by _insert_story or _insert_full_story, so existing stories
+carry their possibly earlier times first read.  Rows of existing stories are
+copied from the processed stories log file with only the time first read
+replaced, and the hashes of their contents are computed from those rows, so
+their contents need not be held in memory.  As in _write_stories, the value of
+each story in stories_dict is replaced by its new story ID, and the story
+columns are written under temporary names if WRITE_BINARY_COLUMNS is True.
+Returns a list mapping from each existing story ID to its new story ID.
+"""
+def _write_updated_stories(story_keys, new_story_keys, stories_dict):
+    start_time = time.time()
+    story_id_remap = []
+    old_stories = read_tsv(PROCESSED_STORIES_FILE_PATH)
+    stories_writer = TsvWriter(_get_written_file_paths(
+        PROCESSED_STORIES_FILE_PATH, (), True)[0], STORIES_NUM_FIELDS)
+    if FETCH_FULL_STORIES:
+        keys_writer = TsvWriter(_get_written_file_paths(
+            STORY_KEYS_FILE_PATH, (), True)[0], STORIES_TIMESTAMP_INDEX)
+        hashes_writer = TsvWriter(_get_written_file_paths(
+            STORY_CONTENTS_HASHES_FILE_PATH, (), True)[0], 1)
+    column_writers = _open_column_writers(PROCESSED_STORIES_FILE_PATH,
+                                          STORY_COLUMN_NAMES, True)
+    feed_ids_dict = {}
+    num_old_stories = len(story_keys)
+    num_new_stories = len(new_story_keys)
+    old_story_num = 0
+    new_story_num = 0
+    row_num = 0
+    while (old_story_num < num_old_stories) or \
+            (new_story_num < num_new_stories):
+        if (new_story_num == num_new_stories) or \
+                ((old_story_num < num_old_stories) and \
+                 (story_keys[old_story_num] < new_story_keys[new_story_num])):
+            story_key = story_keys[old_story_num]
+            story_timestamp = _get_story_timestamp(stories_dict[story_key])
+            story_as_list = old_stories.next()
+            story_as_list[STORIES_TIMESTAMP_INDEX] = story_timestamp
+            if FETCH_FULL_STORIES:
+                story_contents = story_as_list[NEW_STORIES_TITLE_INDEX][
+                    len(story_key[NEW_STORIES_TITLE_INDEX]) + 1:]
+            story_id_remap.append(row_num)
+            old_story_num += 1
+        else:
+            story_key = new_story_keys[new_story_num]
+            story_value = stories_dict[story_key]
+            story_timestamp = _get_story_timestamp(story_value)
+            story_as_list = _format_story(story_key, story_value)
+            if FETCH_FULL_STORIES:
+                story_contents = story_value[1]
+            new_story_num += 1
+        stories_writer.write_row(story_as_list)
+        if FETCH_FULL_STORIES:
+            keys_writer.write_row(story_key)
+            story_contents_hash = get_story_contents_hash(story_contents)
+            hashes_writer.write_row((story_contents_hash, ))
+        if column_writers is not None:
+            _append_story_columns(column_writers, story_key, story_timestamp,
+                                  feed_ids_dict)
+        stories_dict[story_key] = row_num
+        row_num += 1
+    old_stories.close()
+    stories_writer.close()
+    if FETCH_FULL_STORIES:
+        keys_writer.close()
+        hashes_writer.close()
+    _close_column_writers(column_writers)
+    print("Merged %d new %s into %d existing %s." %
+          (num_new_stories, STORIES_DESCRIPTOR, num_old_stories,
+           STORIES_DESCRIPTOR))
+    report_time_elapsed(start_time)
+    _record_write_metrics(STORIES_DESCRIPTOR, start_time, row_num,
+                          PROCESSED_STORIES_FILE_PATH, STORY_COLUMN_NAMES, True)
+    return story_id_remap
+
+"""
+Generates the events in the given processed event log file with their user and
+story IDs replaced according to the given lists, which map from existing IDs to
+new IDs.  Both remappings preserve the order of IDs, so the events are still
+generated in ascending order.
+"""
+def _read_remapped_events(input_file_path, user_id_remap, story_id_remap):
+    for user_id, story_id, time_occurred in \
+            read_int_tsv(input_file_path, NEW_EVENTS_NUM_FIELDS):
+        yield (user_id_remap[user_id], story_id_remap[story_id], time_occurred)
+
+"""
+Writes the union of the events in the given processed event log file and the
+given set of newly cleaned events to input_file_path + TEMPORARY_EXTENSION in
+ascending order without duplicates, along with their binary columns if
+WRITE_BINARY_COLUMNS is True.  Existing events are remapped with
+user_id_remap and story_id_remap, and the original user IDs of new events are
+replaced using user_ids_dict.
+"""
+def _write_updated_events(input_file_path, new_events_set, user_ids_dict,
+                          user_id_remap, story_id_remap, event_descriptor):
+    new_events_list = sorted([(user_ids_dict[event[EVENTS_USER_ID_INDEX]],
+                               event[EVENTS_STORY_ID_INDEX],
+                               event[NEW_EVENTS_TIMESTAMP_INDEX]) for \
+                              event in new_events_set])
+    old_events = _read_remapped_events(input_file_path, user_id_remap,
+                                       story_id_remap)
+    def merged_events():
+        previous_event = None
+        for event in heapq.merge(old_events, new_events_list):
+            if event != previous_event:
+                yield event
+                previous_event = event
+    _write_events(merged_events(), input_file_path, event_descriptor, True)
+
+"""
+Writes "old_id<DELIMITER>new_id" rows for the given list, which maps from old
+IDs to new IDs, to the given file if any ID changed.  Otherwise, removes any
+file left at that path, since IDs remained stable.  Returns True if any ID
+changed.
+"""
+def _write_id_remap(id_remap, output_file_path):
+    ids_changed = any([old_id != new_id for (old_id, new_id) in \
+                       enumerate(id_remap)])
+    if ids_changed:
+        id_remap_writer = TsvWriter(output_file_path, 2)
+        id_remap_writer.write_rows(enumerate(id_remap))
+        id_remap_writer.close()
+    elif os.path.exists(output_file_path):
+        os.remove(output_file_path)
+    return ids_changed
+
+"""
+Atomically writes the given dict to UPDATE_MANIFEST_FILE_PATH.  The manifest is
+written to a temporary file, which is flushed to disk before it is renamed into
+place, so a crash never leaves a partial manifest.
+"""
+def _write_update_manifest(manifest):
+    temporary_file_path = UPDATE_MANIFEST_FILE_PATH + TEMPORARY_EXTENSION
+    output_stream = open_safely(temporary_file_path, "w")
+    json.dump(manifest, output_stream, indent=4, sort_keys=True)
+    output_stream.flush()
+    os.fsync(output_stream.fileno())
+    output_stream.close()
+    os.rename(temporary_file_path, UPDATE_MANIFEST_FILE_PATH)
+
+"""
+Puts the files of the update described by the given manifest, as written by
+_write_update_manifest, into place.  Renames each temporary file that has not
+been renamed yet over its processed file, removes the files to remove, records
+the raw log file offsets in INGEST_STATE_FILE_PATH, and finally deletes
+UPDATE_MANIFEST_FILE_PATH.  Each step can be repeated, so an interrupted call
+can simply be made again with the same manifest.
+"""
+def _apply_update_manifest(manifest):
+    for temporary_file_path, file_path in manifest["renames"]:
+        if os.path.exists(temporary_file_path):
+            os.rename(temporary_file_path, file_path)
+    for file_path in manifest["removals"]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    _write_ingest_state(dict([(str(filename), offset) for \
+                              (filename, offset) in \
+                              manifest["raw_offsets"].iteritems()]))
+    os.remove(UPDATE_MANIFEST_FILE_PATH)
+
+"""
+Finishes putting the files of an earlier update into place if it was
+interrupted while doing so, as recorded in UPDATE_MANIFEST_FILE_PATH.  Returns
+True if there was such an update.
+"""
+def _finish_interrupted_update():
+    if not os.path.exists(UPDATE_MANIFEST_FILE_PATH):
+        return False
+    input_stream = open_safely(UPDATE_MANIFEST_FILE_PATH)
+    manifest = json.load(input_stream)
+    input_stream.close()
+    print("Finishing the interrupted update recorded in %s" %
+          UPDATE_MANIFEST_FILE_PATH)
+    _apply_update_manifest(manifest)
+    return True
+
+"""
+Returns a list of the paths to the processed log files that process_data and
+update_processed_data write, before COMPRESSED_OUTPUT_EXTENSION is appended.
+"""
+def _get_text_output_file_paths():
+    file_paths = [PROCESSED_STORIES_FILE_PATH, PROCESSED_READS_FILE_PATH,
+                  PROCESSED_CLICKTHROUGHS_FILE_PATH, USER_IDS_FILE_PATH]
+    if FETCH_FULL_STORIES:
+        file_paths.extend([STORY_KEYS_FILE_PATH,
+                           STORY_CONTENTS_HASHES_FILE_PATH])
+    return file_paths
+
+"""
+Updates the processed data in PROCESSED_DATA_DIRECTORY with the rows that were
+appended to the raw Pulse log files since the processed data was last created
+or updated, as recorded in INGEST_STATE_FILE_PATH.  Only the new raw rows and
+the pending events are cleaned, so the cost of cleaning, fetching story
+contents, and sorting is proportional to the new data.  The existing processed
+files are merged with the new data in a single sequential pass each, without
+being sorted again.  Stories and users keep the lexicographic order that
+downstream programs rely on, so new stories and users are inserted where they
+belong.  Existing IDs are therefore unchanged if every new entity sorts after
+every existing one.  Otherwise, STORY_ID_REMAP_FILE_PATH or
+USER_ID_REMAP_FILE_PATH is written with the mapping from old IDs to new IDs.
+Events that reference unknown stories, including those appended to the raw logs
+before the stories they reference, are kept in the pending events files and
+cleaned again by every update until their stories appear, so the output is the
+same as that of rebuilding from the raw logs.  Every output file, including the
+remap and pending events files, is written under a temporary name.  The renames
+and removals that put them into place are then recorded in
+UPDATE_MANIFEST_FILE_PATH before any of them is done, and the ingest state is
+only updated after all of them are.  An update interrupted before the manifest
+is written can therefore simply be rerun, and one interrupted after it is
+finished by the next update instead.  That update does nothing else, since
+processing more rows would replace the remap files of the interrupted update.
+"""
+def update_processed_data():
+    global _run_start_time
+    start_time = time.time()
+    _run_start_time = start_time
+    socket.setdefaulttimeout(TIMEOUT_LENGTH)
+    if _finish_interrupted_update():
+        print("Updated the processed data in %s" % PROCESSED_DATA_DIRECTORY)
+        report_time_elapsed(start_time)
+        return
+    raw_offsets = _read_ingest_state()
+    end_offsets = _get_raw_end_offsets()
+    for filename, end_offset in end_offsets.iteritems():
+        if end_offset < raw_offsets[filename]:
+            print >> sys.stderr, ("%s%s is shorter than when it was last " +
+                                  "processed.  Rerun %s without %s to " +
+                                  "rebuild the processed data.") % \
+                                  (RAW_DATA_DIRECTORY, filename, __file__,
+                                   INCREMENTAL_FLAG)
+            sys.exit(errno.EINVAL)
+    
+    story_keys, story_timestamps = _read_processed_story_keys()
+    existing_story_keys = frozenset(story_keys)
+    if FETCH_FULL_STORIES:
+        stories_dict = dict([(story_key, [story_timestamp, None]) for \
+                             (story_key, story_timestamp) in \
+                             zip(story_keys, story_timestamps)])
+        insert_story_fn = _insert_full_story
+        story_contents_dict = {}
+    else:
+        timestamp_factory = functools.partial(int, LATEST_ACCEPTABLE_TIMESTAMP)
+        stories_dict = defaultdict(timestamp_factory,
+                                   zip(story_keys, story_timestamps))
+        insert_story_fn = _insert_story
+        story_contents_dict = None
+    del story_timestamps
+    _clean_stories(stories_dict, insert_story_fn, story_contents_dict,
+                   raw_offsets[STORIES_FILENAME], end_offsets[STORIES_FILENAME])
+    new_story_keys = sorted([story_key for story_key in stories_dict if \
+                             story_key not in existing_story_keys])
+    del existing_story_keys
+    story_id_remap = _write_updated_stories(story_keys, new_story_keys,
+                                            stories_dict)
+    del story_keys, new_story_keys
+    story_index = _build_story_index(stories_dict)
+    del stories_dict
+    
+    reads_set = set()
+    _clean_events(RAW_READS_FILE_PATH, PROCESSED_READS_FILE_PATH,
+                  READS_DESCRIPTOR, story_index, reads_set,
+                  raw_offsets[READS_FILENAME], end_offsets[READS_FILENAME],
+                  True)
+    clickthroughs_set = set()
+    _clean_events(RAW_CLICKTHROUGHS_FILE_PATH,
+                  PROCESSED_CLICKTHROUGHS_FILE_PATH,
+                  CLICKTHROUGHS_DESCRIPTOR, story_index, clickthroughs_set,
+                  raw_offsets[CLICKTHROUGHS_FILENAME],
+                  end_offsets[CLICKTHROUGHS_FILENAME], True)
+    del story_index
+    
+    metrics = StageMetrics("reassign " + USER_IDS_DESCRIPTOR)
+    old_user_ids = list(read_lines(USER_IDS_FILE_PATH))
+    new_user_ids = set([read[EVENTS_USER_ID_INDEX] for read in reads_set])
+    new_user_ids.update([clickthrough[EVENTS_USER_ID_INDEX] for \
+                         clickthrough in clickthroughs_set])
+    new_user_ids.difference_update(old_user_ids)
+    user_ids_list = list(heapq.merge(old_user_ids, sorted(new_user_ids)))
+    user_ids_dict = dict([(original_user_id, new_user_id) for \
+                          (new_user_id, original_user_id) in \
+                          enumerate(user_ids_list)])
+    user_id_remap = [user_ids_dict[original_user_id] for original_user_id in \
+                     old_user_ids]
+    del old_user_ids
+    metrics.num_rows = len(reads_set) + len(clickthroughs_set)
+    _record_stage_metrics(metrics)
+    
+    _write_updated_events(PROCESSED_READS_FILE_PATH, reads_set, user_ids_dict,
+                          user_id_remap, story_id_remap, READS_DESCRIPTOR)
+    _write_updated_events(PROCESSED_CLICKTHROUGHS_FILE_PATH, clickthroughs_set,
+                          user_ids_dict, user_id_remap, story_id_remap,
+                          CLICKTHROUGHS_DESCRIPTOR)
+    del user_ids_dict
+    _write_user_ids(user_ids_list, True)
+    story_ids_changed = _write_id_remap(story_id_remap,
+                                        STORY_ID_REMAP_FILE_PATH +
+                                        TEMPORARY_EXTENSION)
+    user_ids_changed = _write_id_remap(user_id_remap,
+                                       USER_ID_REMAP_FILE_PATH +
+                                       TEMPORARY_EXTENSION)
+    
+    log_file_paths = _get_text_output_file_paths()
+    renames = []
+    for file_path in log_file_paths:
+        if file_path == PROCESSED_STORIES_FILE_PATH:
+            column_names = STORY_COLUMN_NAMES
+        elif file_path in [PROCESSED_READS_FILE_PATH,
+                           PROCESSED_CLICKTHROUGHS_FILE_PATH]:
+            column_names = EVENT_COLUMN_NAMES
+            for index_file_path in [get_user_index_file_path(file_path),
+                                    _get_pending_events_file_path(file_path)]:
+                renames.append((index_file_path + TEMPORARY_EXTENSION,
+                                index_file_path))
+        else:
+            column_names = ()
+        renames.extend(zip(_get_written_file_paths(file_path, column_names,
+                                                   True),
+                           _get_written_file_paths(file_path, column_names)))
+    removals = _get_stale_output_file_paths(log_file_paths)
+    for ids_changed, file_path in [(story_ids_changed,
+                                    STORY_ID_REMAP_FILE_PATH),
+                                   (user_ids_changed, USER_ID_REMAP_FILE_PATH)]:
+        if ids_changed:
+            renames.append((file_path + TEMPORARY_EXTENSION, file_path))
+        else:
+            removals.append(file_path)
+    manifest = {"renames": renames, "removals": removals,
+                "raw_offsets": end_offsets}
+    _write_update_manifest(manifest)
+    _apply_update_manifest(manifest)
+    if story_ids_changed:
+        print("Existing story IDs changed; wrote the mapping to %s" %
+              STORY_ID_REMAP_FILE_PATH)
+    if user_ids_changed:
+        print("Existing user IDs changed; wrote the mapping to %s" %
+              USER_ID_REMAP_FILE_PATH)
+    print("Updated the processed data in %s" % PROCESSED_DATA_DIRECTORY)
+    report_time_elapsed(start_time)
 
 """
 Creates a clean version of the raw log files for the Pulse project.  Corrupt and
@@ -400,10 +2407,50 @@ excluded from the output.  Conflicting data are resolved where possible.  Output
 files are written to PROCESSED_DATA_DIRECTORY with same filenames as the inputs.
 One additional file with name USER_IDS_FILENAME is written that contains all of
 the user IDs present in the processed data sorted in ascending lexicographic
-order.
+order.  The extent of the raw log files that was processed is recorded in
+INGEST_STATE_FILE_PATH, and only the rows within it are processed, so that
+update_processed_data can later process only the rows appended since.  The
+events that reference unknown stories are written to the pending events files
+so that update_processed_data can retry them once their stories appear.  A
+metrics record for each stage is appended to METRICS_FILE_PATH.  While the
+stories are cleaned, their state is checkpointed to CHECKPOINT_FILE_PATH every
+CHECKPOINT_INTERVAL seconds.  If resume is True, then the cleaning resumes from
+the last checkpoint of an interrupted run rather than from the beginning, and
+the extent of the raw log files recorded in INGEST_STATE_FILE_PATH is that of
+the interrupted run.  The checkpoint is deleted once the run completes.  Any
+update that update_processed_data left unfinished in UPDATE_MANIFEST_FILE_PATH
+is abandoned, since every file is rebuilt.  If FETCH_FULL_STORIES is False, then the story keys and contents
+hashes of an earlier run are removed, since they would not match the stories.
 """
-def process_data():
+def process_data(resume = False):
+    global _run_start_time, _last_checkpoint_time
+    _run_start_time = time.time()
+    _last_checkpoint_time = _run_start_time
     socket.setdefaulttimeout(TIMEOUT_LENGTH)
+    if resume:
+        checkpoint = _read_checkpoint()
+        end_offsets = checkpoint["raw_end_offsets"]
+        stories_offset = checkpoint["stories_offset"]
+        print("Resuming from byte %d of %s with %d %s checkpointed." %
+              (stories_offset, RAW_STORIES_FILE_PATH,
+               len(checkpoint["stories_dict"]), STORIES_DESCRIPTOR))
+    else:
+        end_offsets = _get_raw_end_offsets()
+        stories_offset = 0
+    if not os.path.exists(PROCESSED_DATA_DIRECTORY):
+        os.mkdir(PROCESSED_DATA_DIRECTORY)
+    if os.path.exists(UPDATE_MANIFEST_FILE_PATH):
+        os.remove(UPDATE_MANIFEST_FILE_PATH)
+    if not FETCH_FULL_STORIES:
+        # The story keys and contents hashes of an earlier run that fetched
+        # full stories would not describe the stories written now.
+        for file_path in [STORY_KEYS_FILE_PATH,
+                          STORY_CONTENTS_HASHES_FILE_PATH]:
+            for sidecar_file_path in [file_path] + \
+                    [file_path + extension for extension in \
+                     COMPRESSED_EXTENSIONS]:
+                if os.path.exists(sidecar_file_path):
+                    os.remove(sidecar_file_path)
 
     if FETCH_FULL_STORIES:
         stories_dict = {}
@@ -414,32 +2461,31 @@ def process_data():
         stories_dict = defaultdict(timestamp_factory)
         insert_story_fn = _insert_story
         story_contents_dict = None
-    _clean_data(RAW_STORIES_FILE_PATH, STORIES_NUM_FIELDS,
-                STORIES_TIMESTAMP_INDEX, STORIES_DESCRIPTOR, insert_story_fn,
-                stories_dict, story_contents_dict)
-    
-    if not os.path.exists(PROCESSED_DATA_DIRECTORY):
-        os.mkdir(PROCESSED_DATA_DIRECTORY)
+    if resume:
+        stories_dict.update(checkpoint["stories_dict"])
+        if FETCH_FULL_STORIES:
+            story_contents_dict.update(checkpoint["story_contents_dict"])
+        del checkpoint
+    _clean_stories(stories_dict, insert_story_fn, story_contents_dict,
+                   stories_offset, end_offsets[STORIES_FILENAME], end_offsets)
     
     _write_stories(stories_dict)
-    
-    reads_set = set()
-    _clean_data(RAW_READS_FILE_PATH, OLD_EVENTS_NUM_FIELDS,
-                OLD_EVENTS_TIMESTAMP_INDEX, READS_DESCRIPTOR, _insert_event,
-                stories_dict, reads_set)
-    clickthroughs_set = set()
-    _clean_data(RAW_CLICKTHROUGHS_FILE_PATH, OLD_EVENTS_NUM_FIELDS,
-                OLD_EVENTS_TIMESTAMP_INDEX, CLICKTHROUGHS_DESCRIPTOR,
-                _insert_event, stories_dict, clickthroughs_set)
-    
-    reads_list = sorted(reads_set)
-    clickthroughs_list = sorted(clickthroughs_set)
-    user_ids_list = get_user_ids(reads_list, clickthroughs_list)
-    _write_events(reads_list, PROCESSED_READS_FILE_PATH, READS_DESCRIPTOR)
-    _write_events(clickthroughs_list, PROCESSED_CLICKTHROUGHS_FILE_PATH,
-                  CLICKTHROUGHS_DESCRIPTOR)
-    _write_user_ids(user_ids_list)
+    story_index = _build_story_index(stories_dict)
+    del stories_dict
+    _process_events(story_index, end_offsets)
+    for file_path in [STORY_ID_REMAP_FILE_PATH, USER_ID_REMAP_FILE_PATH]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    _remove_stale_outputs(_get_text_output_file_paths())
+    _write_ingest_state(end_offsets)
+    if os.path.exists(CHECKPOINT_FILE_PATH):
+        os.remove(CHECKPOINT_FILE_PATH)
 
 if __name__ == "__main__":
-    check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
-    process_data()
+    if (len(sys.argv) == 2) and (sys.argv[1] == INCREMENTAL_FLAG):
+        update_processed_data()
+    elif (len(sys.argv) == 2) and (sys.argv[1] == RESUME_FLAG):
+        process_data(True)
+    else:
+        check_num_arguments(NUM_ARGUMENTS, PROGRAM_USAGE)
+        process_data()
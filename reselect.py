@@ -3,12 +3,13 @@
 import sys, os, errno, logging, random, bisect, math, time
 from collections import defaultdict
 from gensim import corpora, models, similarities
-from utilities import DELIMITER, open_safely
+from utilities import DELIMITER, open_safely, read_lines, read_int_tsv
 from process_data import STORIES_FILENAME, READS_FILENAME, \
     EARLIEST_ACCEPTABLE_TIMESTAMP, LATEST_ACCEPTABLE_TIMESTAMP, \
     NEW_STORIES_FEED_URL_INDEX, NEW_STORIES_TITLE_INDEX, \
     STORIES_TIMESTAMP_INDEX, EVENTS_USER_ID_INDEX, EVENTS_STORY_ID_INDEX, \
-    NEW_EVENTS_TIMESTAMP_INDEX
+    NEW_EVENTS_TIMESTAMP_INDEX, NEW_EVENTS_NUM_FIELDS, read_story_sidecars, \
+    split_story_title
 from stem_processed_stories import STEMMED_STORIES_EXTENSION
 from liblinearutil import parameter, problem, train, predict
 from svmutil import svm_parameter, svm_problem, svm_train, svm_predict
@@ -41,28 +42,61 @@ STOPLIST = frozenset(['a', 'able', 'about', 'across', 'after', 'all', 'almost',
 ############################################
 
 """
-Reads in the story data to a matrix for quick acess. 
+Reads in the story data to a matrix for quick acess.  Each story title is
+lowercased and tokenized once, into a tuple of its words.  If the story keys and
+contents hashes written for stories with full contents are next to the
+unstemmed stories, then contents that several stories share, such as those of
+syndicated stories, are tokenized only once and share their words.
 """
 def _read_stories():
     stories = []
-    story_stream = open_safely(STORIES_FILE_PATH)
-    for story_as_str in story_stream:
-        story_as_list = story_as_str[:-1].lower().split(DELIMITER)
+    keys, hashes = (None, None)
+    if not STEMMING:
+        # Stemmed story titles never match the story keys and contents hashes.
+        keys, hashes = read_story_sidecars(STORIES_FILE_PATH)
+    tokenized_contents_dict = {}
+    for story_as_str in read_lines(STORIES_FILE_PATH):
+        story_as_list = story_as_str.split(DELIMITER)
+        story_title = story_as_list[NEW_STORIES_TITLE_INDEX]
+        title_and_contents = None
+        if keys is not None:
+            try:
+                story_key = keys.next()
+                story_contents_hash = hashes.next()
+            except StopIteration:
+                keys.close()
+                hashes.close()
+                keys, hashes = (None, None)
+            else:
+                title_and_contents = split_story_title(story_title, story_key,
+                                                       story_contents_hash)
+        if title_and_contents is None:
+            tokenized_title = tuple(story_title.lower().split())
+        else:
+            # No word spans the space between the title and contents, so they
+            # can be tokenized separately.
+            title, story_contents = title_and_contents
+            if story_contents_hash not in tokenized_contents_dict:
+                tokenized_contents_dict[story_contents_hash] = \
+                    tuple(story_contents.lower().split())
+            tokenized_title = tuple(title.lower().split()) + \
+                tokenized_contents_dict[story_contents_hash]
+        for field_num, field in enumerate(story_as_list):
+            story_as_list[field_num] = field.lower()
+        story_as_list[NEW_STORIES_TITLE_INDEX] = tokenized_title
         time_first_read = int(story_as_list[STORIES_TIMESTAMP_INDEX])
         story_as_list[STORIES_TIMESTAMP_INDEX] = time_first_read
         stories.append(tuple(story_as_list))
-    story_stream.close()
+    if keys is not None:
+        keys.close()
+        hashes.close()
     return stories
 
 """
 Events is a matrix of story reads by user. Each user has a vector of stories they have read and when they read them. 
 """
 def _read_events():
-    event_stream = open_safely(EVENTS_FILE_PATH)
-    events = [tuple(map(int, event[:-1].split(DELIMITER))) for event in \
-              event_stream]
-    event_stream.close()
-    return events
+    return list(read_int_tsv(EVENTS_FILE_PATH, NEW_EVENTS_NUM_FIELDS))
 
 def _binary_search(list, elem):
     index_of_leftmost_match = bisect.bisect_left(list, (elem, ))
@@ -83,8 +117,8 @@ def _get_pos_samples(stories, events, user_id, curr_day, corpus_dict, predict):
         if (event[EVENTS_USER_ID_INDEX] == user_id) and \
                 ((event[NEW_EVENTS_TIMESTAMP_INDEX] <= curr_day) != predict):
             story = stories[event[EVENTS_STORY_ID_INDEX]]
-            tokenized_title = story[NEW_STORIES_TITLE_INDEX].split()
-            corpus.append(corpus_dict.doc2bow(tokenized_title, True))
+            corpus.append(corpus_dict.doc2bow(story[NEW_STORIES_TITLE_INDEX],
+                                              True))
             feedlist.add(story[NEW_STORIES_FEED_URL_INDEX])
     return corpus, feedlist
 
@@ -124,7 +158,7 @@ def _get_neg_samples(stories, events, user_id, curr_day, corpus_dict, predict,
         sampled_corpus_list += corpus_list
     else:
         sampled_corpus_list += random.sample(corpus_list, (num_get-len(sampled_corpus_list)))
-    corp= [corpus_dict.doc2bow(story_title[0].split(), True) for story_title in sampled_corpus_list]
+    corp= [corpus_dict.doc2bow(story_title[0], True) for story_title in sampled_corpus_list]
     if predict:
         chosen_stories = sampled_corpus_list
     else:
@@ -157,7 +191,7 @@ def _tfidf(tfidf, dictionary, stories, events, user_id, curr_time, reselect,
 Creates tfidf model
 """
 def _build_tfidf_model(corpus_dict, stories, curr_day):
-    my_corpus = [corpus_dict.doc2bow(story[NEW_STORIES_TITLE_INDEX].split()) \
+    my_corpus = [corpus_dict.doc2bow(story[NEW_STORIES_TITLE_INDEX]) \
                  for story in stories if \
                  story[STORIES_TIMESTAMP_INDEX] <= curr_day]
     return models.TfidfModel(my_corpus)
@@ -376,7 +410,7 @@ def classify(version):
     curr_day +=  SECONDS_IN_DAY
     reselect_by_user = [[] for i in range(NUM_USERS_TO_ANALYZE)]
     while (day < max_day):
-        corpus_dict = corpora.Dictionary(story[NEW_STORIES_TITLE_INDEX].split() \
+        corpus_dict = corpora.Dictionary(story[NEW_STORIES_TITLE_INDEX] \
                                          for story in stories if \
                                          story[STORIES_TIMESTAMP_INDEX] <= curr_day)
         # remove stop words and words that appear only once
@@ -1,11 +1,13 @@
 #!/usr/bin/python2.5
 
-import sys, re, time
+import sys, os, re, time
 from nltk.stem.porter import PorterStemmer
 from nltk.tokenize.regexp import WordPunctTokenizer
 from utilities import DELIMITER, check_num_arguments, report_time_elapsed, \
-    open_safely, write_2d_iterable
-from process_data import NEW_STORIES_TITLE_INDEX
+    find_file_path, read_lines, read_tsv, remove_compression_extension, \
+    write_2d_iterable
+from process_data import NEW_STORIES_TITLE_INDEX, read_story_sidecars, \
+    split_story_title
 
 NUM_ARGUMENTS = 2
 """
@@ -20,8 +22,25 @@ STEMMED_STORIES_EXTENSION = ".stemmed"
 
 ############################################
 
+def _stem(text, stemmer, prog):
+    """Return a list of the stems of the words in the given text."""
+    tok_contents = WordPunctTokenizer().tokenize(text)
+    return [stemmer.stem(word) for word in tok_contents if \
+            prog.match(word) is None]
+
 def stem_processed_stories(input_file_path):
-    """
+    """Write the given processed stories log file with its story titles
+    lowercased, tokenized, and stemmed to a file of the same name followed by
+    STEMMED_STORIES_EXTENSION.
+
+    If process_data wrote the story keys and contents hashes next to the log
+    file, then stem each story's title and contents separately, and stem the
+    contents shared by several stories, such as those of syndicated stories,
+    only once.  Stories whose rows of those files don't match them are stemmed
+    whole, so the output is the same either way.
+
+    input_file_path, a str, is the file path to a processed Pulse stories log
+    file.
     """
     start_time = time.time()
     if not isinstance(input_file_path, str):
@@ -30,18 +49,51 @@ def stem_processed_stories(input_file_path):
     stemmer = PorterStemmer()
     stories_list = []
     prog = re.compile('\W+')
-    story_stream = open_safely(input_file_path)
-    for story_as_str in story_stream:
-        story_as_list = story_as_str[:-1].lower().split(DELIMITER)
-        story_title = story_as_list[NEW_STORIES_TITLE_INDEX]
-        tok_contents = WordPunctTokenizer().tokenize(story_title)
-        stem_contents = [stemmer.stem(word) for word in tok_contents if \
-                         prog.match(word) is None]
+    keys, hashes = read_story_sidecars(input_file_path)
+    sidecars_exhausted = False
+    num_mismatched_stories = 0
+    stemmed_contents_dict = {}
+    for story_as_str in read_lines(input_file_path):
+        story_title = story_as_str.split(DELIMITER)[NEW_STORIES_TITLE_INDEX]
+        title_and_contents = None
+        if (keys is not None) and (not sidecars_exhausted):
+            try:
+                story_key = keys.next()
+                story_contents_hash = hashes.next()
+            except StopIteration:
+                sidecars_exhausted = True
+            else:
+                title_and_contents = split_story_title(story_title, story_key,
+                                                       story_contents_hash)
+        if (keys is not None) and (title_and_contents is None):
+            num_mismatched_stories += 1
+        if title_and_contents is None:
+            stem_contents = _stem(story_title.lower(), stemmer, prog)
+        else:
+            # No token spans the space between the title and contents, so they
+            # can be stemmed separately.
+            title, story_contents = title_and_contents
+            if story_contents_hash not in stemmed_contents_dict:
+                stemmed_contents_dict[story_contents_hash] = \
+                    _stem(story_contents.lower(), stemmer, prog)
+            stem_contents = _stem(title.lower(), stemmer, prog)
+            stem_contents += stemmed_contents_dict[story_contents_hash]
+        story_as_list = story_as_str.lower().split(DELIMITER)
         story_as_list[NEW_STORIES_TITLE_INDEX] = " ".join(stem_contents)
         stories_list.append(story_as_list)
+    if keys is not None:
+        keys.close()
+        hashes.close()
+        print("Stemmed %d distinct story contents." %
+              len(stemmed_contents_dict))
+        if num_mismatched_stories > 0:
+            print >> sys.stderr, ("The story keys and contents hashes of " +
+                                  "%d stories did not match them, so those " +
+                                  "stories were stemmed whole.") % \
+                                  num_mismatched_stories
     
-    story_stream.close()
-    output_file_path = input_file_path + STEMMED_STORIES_EXTENSION
+    output_file_path = remove_compression_extension(input_file_path) + \
+        STEMMED_STORIES_EXTENSION
     write_2d_iterable(stories_list, output_file_path)
     print("Output stemmed stories to %s" % output_file_path)
     report_time_elapsed(start_time)
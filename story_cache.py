@@ -0,0 +1,162 @@
+#!/usr/bin/python2.5
+"""Contains a persistent cache of extracted story contents keyed by story URL.
+
+StoryContentsCache stores the text extracted from each story URL, or a record
+that extraction failed, in an SQLite database so that reruns of the programs
+that fetch story contents don't fetch the same stories again.
+"""
+
+import os, time, sqlite3, threading
+
+EVICTION_TARGET = 0.9
+"""When a StoryContentsCache grows larger than its maximum size, least recently
+used entries are evicted until it is no larger than this fraction of its maximum
+size, so that evictions are batched rather than triggered by every insertion.
+"""
+
+NUM_READS_PER_COMMIT = 1000
+"""The number of cache hits after which the updated access times are committed.
+Insertions are committed immediately so that they survive a crash.
+"""
+
+class StoryContentsCache(object):
+    """A size-capped, least-recently-used, on-disk cache of story contents.
+
+    Each entry maps from a story URL to the contents extracted from it, or to
+    None if extraction failed.  Failed entries expire after failure_ttl seconds
+    so that stories on temporarily unavailable servers are eventually fetched
+    again.  Successful entries never expire but are evicted, least recently
+    used first, whenever the total size of the URLs and contents in the cache
+    exceeds max_size bytes.  All methods may be called from several threads at
+    once.
+    """
+
+    def __init__(self, file_path, max_size, failure_ttl):
+        """Open the cache stored at the given file path, creating it if needed.
+
+        file_path, a str, is the path to the SQLite database holding the cache.
+        Missing parent directories are created.
+        max_size, an int, is the largest total size in bytes of the cached URLs
+        and story contents.
+        failure_ttl, a number, is the number of seconds for which a failed
+        extraction is remembered.
+        """
+        directory = os.path.dirname(file_path)
+        if (directory != "") and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._max_size = max_size
+        self._failure_ttl = failure_ttl
+        self._lock = threading.Lock()
+        self._num_uncommitted_reads = 0
+        self.num_hits = 0
+        self.num_misses = 0
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.text_factory = str
+        self._connection.execute("CREATE TABLE IF NOT EXISTS story_contents " +
+                                 "(url TEXT PRIMARY KEY, contents TEXT, " +
+                                 "size INTEGER NOT NULL, " +
+                                 "time_fetched REAL NOT NULL, " +
+                                 "time_used REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS " +
+                                 "story_contents_by_time_used ON " +
+                                 "story_contents (time_used)")
+        self._connection.commit()
+        self._size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM story_contents").fetchone()[0]
+
+    def get(self, url):
+        """Return a (hit, story_contents) tuple for the given story URL.
+
+        hit is True if the cache holds an unexpired entry for the URL, in which
+        case story_contents is the cached contents or None if extraction
+        failed.  Otherwise, hit is False and story_contents is None.
+        """
+        self._lock.acquire()
+        try:
+            row = self._connection.execute("SELECT contents, time_fetched " +
+                                           "FROM story_contents WHERE url = ?",
+                                           (url, )).fetchone()
+            now = time.time()
+            if (row is None) or \
+                    ((row[0] is None) and (now - row[1] > self._failure_ttl)):
+                self.num_misses += 1
+                return (False, None)
+            self._connection.execute("UPDATE story_contents SET time_used = " +
+                                     "? WHERE url = ?", (now, url))
+            self._num_uncommitted_reads += 1
+            if self._num_uncommitted_reads >= NUM_READS_PER_COMMIT:
+                self._connection.commit()
+                self._num_uncommitted_reads = 0
+            self.num_hits += 1
+            return (True, row[0])
+        finally:
+            self._lock.release()
+
+    def put(self, url, story_contents):
+        """Store the given story contents, or None for a failure, under the URL.
+
+        Replace any existing entry for the URL, and evict least recently used
+        entries if the cache has grown too large.
+        """
+        size = len(url)
+        if story_contents is not None:
+            size += len(story_contents)
+        self._lock.acquire()
+        try:
+            row = self._connection.execute("SELECT size FROM story_contents " +
+                                           "WHERE url = ?", (url, )).fetchone()
+            if row is not None:
+                self._size -= row[0]
+            now = time.time()
+            self._connection.execute("INSERT OR REPLACE INTO story_contents " +
+                                     "VALUES (?, ?, ?, ?, ?)",
+                                     (url, story_contents, size, now, now))
+            self._size += size
+            if self._size > self._max_size:
+                self._evict()
+            self._connection.commit()
+            self._num_uncommitted_reads = 0
+        finally:
+            self._lock.release()
+
+    def fetch(self, url, fetch_fn):
+        """Return the contents of the given story URL, fetching them if needed.
+
+        On a cache miss, call fetch_fn, a function that accepts a URL and
+        returns the story contents or None, and cache its result.  fetch_fn is
+        called without holding the cache's lock.
+        """
+        hit, story_contents = self.get(url)
+        if not hit:
+            story_contents = fetch_fn(url)
+            self.put(url, story_contents)
+        return story_contents
+
+    def _evict(self):
+        """Delete least recently used entries until the cache is small enough.
+
+        The caller must hold the lock.
+        """
+        target_size = int(self._max_size * EVICTION_TARGET)
+        while self._size > target_size:
+            rows = self._connection.execute("SELECT url, size FROM " +
+                                            "story_contents ORDER BY " +
+                                            "time_used LIMIT 1000").fetchall()
+            if len(rows) == 0:
+                self._size = 0
+                return
+            for url, size in rows:
+                self._connection.execute("DELETE FROM story_contents WHERE " +
+                                         "url = ?", (url, ))
+                self._size -= size
+                if self._size <= target_size:
+                    return
+
+    def close(self):
+        """Commit any pending changes and close the cache."""
+        self._lock.acquire()
+        try:
+            self._connection.commit()
+            self._connection.close()
+        finally:
+            self._lock.release()
@@ -4,20 +4,115 @@
 check_num_arguments halts a program if the wrong number of arguments were
 supplied.
 report_time_elapsed prints a message notifying the user of the time elapsed.
-open_safely opens a file or halts the program if the file could not be opened.
+get_compression_extension returns the compression extension of a file path.
+remove_compression_extension removes the compression extension of a file path.
+find_file_path finds a file or a compressed version of it.
+open_safely opens a file, which may be compressed, or halts the program if the
+file could not be opened.
+BackgroundWriter writes to a stream on a background thread.
+read_line_blocks reads the lines of a text file a block at a time.
+read_lines reads the lines of a text file.
+read_tsv reads the rows of a tab-separated log file.
+read_int_tsv reads the rows of a tab-separated log file of ints.
+TsvWriter writes rows to a tab-separated log file in batches.
 write_iterable writes the contents of an iterable to a text file.
 write_2d_iterable writes the contents of an iterable of iterables to a text
 file.
+BinaryColumnWriter writes a column of ints to a fixed-width binary column file.
+load_binary_column memory-maps a binary column file.
+get_peak_rss returns the peak resident set size of the program.
+StageMetrics collects performance metrics for one stage of a program.
+write_metrics_record appends a metrics record to a log file as a line of JSON.
 """
 
-import sys, errno, time
+import sys, os, errno, time, struct, mmap, json, threading, Queue, io, gzip, \
+    bz2
+from array import array
 from datetime import timedelta
+from itertools import islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 DELIMITER = "\t"
 """The string used to separate each field in the input and output log files.
 This string should not appear in the fields themselves.
 """
 
+BINARY_COLUMN_MAGIC = "PULSECOL"
+"""The first bytes of every binary column file."""
+
+BINARY_COLUMN_VERSION = 1
+"""The version of the binary column file format written by BinaryColumnWriter.
+"""
+
+_BINARY_COLUMN_HEADER = struct.Struct("<8sIIQ")
+# The header of a binary column file: the magic bytes, the format version, the
+# width of each value in bytes, and the number of values.  Values follow the
+# header as little-endian signed ints, so they are 8-byte aligned.
+
+_BINARY_COLUMN_VALUE_WIDTH = 4
+# The width in bytes of each value in a binary column file.
+
+_BINARY_COLUMN_BUFFER_SIZE = 65536
+# The number of values a BinaryColumnWriter buffers before writing them out.
+
+GZIP_EXTENSION = ".gz"
+BZIP2_EXTENSION = ".bz2"
+XZ_EXTENSION = ".xz"
+COMPRESSED_EXTENSIONS = (GZIP_EXTENSION, BZIP2_EXTENSION, XZ_EXTENSION)
+"""The extensions of the compressed files that open_safely reads and writes, in
+the order in which find_file_path looks for them.  Files with the xz extension
+require the lzma module, which is in the standard library from Python 3.3 and is
+available as backports.lzma for earlier versions.
+"""
+
+COMPRESSION_LEVEL = 6
+"""The gzip and bzip2 compression level and the xz preset with which open_safely
+writes compressed files, from 1 (fastest) to 9 (smallest).
+"""
+
+READ_BUFFER_SIZE = 1 << 20
+"""The size in bytes of the buffer through which open_safely reads files, so
+that files on shared storage are read in a few large requests.
+"""
+
+WRITE_BLOCK_SIZE = 1 << 20
+"""The number of bytes a BackgroundWriter buffers before handing them to its
+background thread.
+"""
+
+TSV_BLOCK_SIZE = 1 << 22
+"""The number of bytes read from a log file at once by read_line_blocks,
+read_lines, read_tsv, and read_int_tsv.
+"""
+
+TSV_BATCH_SIZE = 65536
+"""The number of rows a TsvWriter formats and writes at once."""
+
+_INT_TSV_CHARACTERS = "0123456789+-" + DELIMITER + "\n"
+# The characters that may appear in a tab-separated file of ints.
+
+_WRITE_QUEUE_SIZE = 4
+# The number of blocks a BackgroundWriter queues for its background thread
+# before write blocks, which bounds the memory used when compression falls
+# behind.
+
 
 def check_num_arguments(num_arguments_expected, program_usage):
     """Terminate execution if the wrong number of arguments were supplied.
@@ -54,6 +149,67 @@ def report_time_elapsed(start_time):
     time_elapsed_as_str = str(timedelta(seconds=time_elapsed_as_int))
     print("Time required: " + time_elapsed_as_str + " (HH:MM:SS).")
 
+def get_compression_extension(file_path):
+    """Return the compression extension of the given file path, or None.
+    
+    The compression extension is the element of COMPRESSED_EXTENSIONS with
+    which the file path ends, if any.
+    """
+    extension = os.path.splitext(file_path)[1]
+    if extension in COMPRESSED_EXTENSIONS:
+        return extension
+    return None
+
+def remove_compression_extension(file_path):
+    """Return the given file path without its compression extension, if any."""
+    if get_compression_extension(file_path) is None:
+        return file_path
+    return os.path.splitext(file_path)[0]
+
+def find_file_path(file_path):
+    """Return the path to the given file or to a compressed version of it.
+    
+    Return the given file path if the file exists or if no compressed version
+    of it does.  Otherwise, return the path to the first compressed version,
+    i.e., the file path followed by an element of COMPRESSED_EXTENSIONS, that
+    exists.  Programs can therefore read the uncompressed or compressed version
+    of a log file by its uncompressed name.
+    """
+    if os.path.exists(file_path):
+        return file_path
+    for extension in COMPRESSED_EXTENSIONS:
+        if os.path.exists(file_path + extension):
+            return file_path + extension
+    return file_path
+
+def _open_compressed(file_path, mode, extension):
+    """Open the given compressed file in the given mode.
+    
+    Streams for reading are buffered by READ_BUFFER_SIZE bytes, and streams for
+    writing are BackgroundWriters, so that files are compressed on a separate
+    thread.
+    """
+    is_read_mode = ("r" in mode)
+    if extension == GZIP_EXTENSION:
+        if is_read_mode:
+            return io.BufferedReader(gzip.GzipFile(file_path, "rb"),
+                                     READ_BUFFER_SIZE)
+        return BackgroundWriter(gzip.GzipFile(file_path, mode,
+                                              COMPRESSION_LEVEL))
+    if extension == BZIP2_EXTENSION:
+        if is_read_mode:
+            return bz2.BZ2File(file_path, "r", READ_BUFFER_SIZE)
+        return BackgroundWriter(bz2.BZ2File(file_path, "w", 0,
+                                            COMPRESSION_LEVEL))
+    if lzma is None:
+        raise IOError(("Reading and writing %s files requires the lzma " +
+                       "module.") % XZ_EXTENSION)
+    if is_read_mode:
+        return io.BufferedReader(lzma.LZMAFile(file_path, "rb"),
+                                 READ_BUFFER_SIZE)
+    return BackgroundWriter(lzma.LZMAFile(file_path, "wb",
+                                          preset=COMPRESSION_LEVEL))
+
 def open_safely(file_path, mode = "r"):
     """Open the file with the given file path in the given mode.
     
@@ -61,45 +217,525 @@ def open_safely(file_path, mode = "r"):
     opened, then print an error message to sys.stderr and exit the program.  The
     caller is responsible for closing the stream when finished using the file.
     
+    Files whose paths end with an element of COMPRESSED_EXTENSIONS are
+    decompressed as they are read and compressed as they are written, on a
+    background thread.  When reading, a compressed version of the file is read
+    if the file itself does not exist, as in find_file_path.  Files are read
+    through a buffer of READ_BUFFER_SIZE bytes.  Streams for compressed files
+    support iteration over lines, read, readline, write, and close.
+    
     Refer to the documentation of the built-in Python function, open for an
     explanation of the parameters.
     """
+    is_read_mode = ("r" in mode) and ("+" not in mode)
+    if is_read_mode:
+        file_path = find_file_path(file_path)
     try:
+        extension = get_compression_extension(file_path)
+        if extension is not None:
+            return _open_compressed(file_path, mode, extension)
+        if is_read_mode:
+            return open(file_path, mode, READ_BUFFER_SIZE)
         return open(file_path, mode)
-    except IOError:
+    except IOError, e:
         print >> sys.stderr, "Could not open file: %s in mode %s" % \
             (file_path, mode)
+        if e.errno is None:
+            print >> sys.stderr, e
         sys.exit(errno.EIO)
 
+class BackgroundWriter(object):
+    """Writes to a stream on a background thread.
+    
+    Data written are gathered into blocks of about WRITE_BLOCK_SIZE bytes and
+    written to the stream by a background thread, so that the calling thread
+    can continue producing output while the stream compresses the previous
+    blocks.  The zlib, bz2, and lzma modules release the global interpreter
+    lock while compressing, so the two threads run in parallel.  If writing to
+    the stream fails, then the exception is re-raised by the next call to write
+    or close.
+    """
+    
+    def __init__(self, output_stream):
+        """Start writing to the given stream, which is closed by close."""
+        self._output_stream = output_stream
+        self._blocks = []
+        self._num_buffered_bytes = 0
+        self._block_queue = Queue.Queue(_WRITE_QUEUE_SIZE)
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._write_blocks)
+        self._thread.setDaemon(True)
+        self._thread.start()
+    
+    def _write_blocks(self):
+        """Write blocks from the queue to the stream until None is received.
+        
+        Keep taking blocks after a failed write, so that write never blocks on
+        a full queue, but discard them.
+        """
+        while True:
+            block = self._block_queue.get()
+            if block is None:
+                return
+            if self._exc_info is None:
+                try:
+                    self._output_stream.write(block)
+                except:
+                    self._exc_info = sys.exc_info()
+    
+    def _raise_exception(self):
+        """Re-raise the exception raised by the background thread, if any."""
+        if self._exc_info is not None:
+            exc_info = self._exc_info
+            self._exc_info = None
+            raise exc_info[0], exc_info[1], exc_info[2]
+    
+    def _flush_blocks(self):
+        """Queue the buffered data as a single block."""
+        self._raise_exception()
+        if len(self._blocks) > 0:
+            self._block_queue.put("".join(self._blocks))
+            self._blocks = []
+            self._num_buffered_bytes = 0
+    
+    def write(self, data):
+        """Write the given str to the stream."""
+        self._blocks.append(data)
+        self._num_buffered_bytes += len(data)
+        if self._num_buffered_bytes >= WRITE_BLOCK_SIZE:
+            self._flush_blocks()
+    
+    def writelines(self, lines):
+        """Write each str in the given iterable to the stream."""
+        for line in lines:
+            self.write(line)
+    
+    def close(self):
+        """Write the remaining data, stop the thread, and close the stream."""
+        if self._thread is None:
+            return
+        try:
+            self._flush_blocks()
+        finally:
+            self._block_queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._output_stream.close()
+        self._raise_exception()
+
+
+def _read_text_blocks(input_file_path, start_offset = 0, end_offset = None):
+    """Generate the contents of the given file as strs of whole lines.
+    
+    Read the file TSV_BLOCK_SIZE bytes at a time, and carry any partial line at
+    the end of a block over to the next one, so that every str ends with a
+    newline except possibly the last, if the file does not end with one.  Only
+    lines that begin in the byte range [start_offset, end_offset) are included,
+    where start_offset must be the offset of the start of a line.  If end_offset
+    is None, then lines are included up to the end of the file.
+    """
+    input_stream = open_safely(input_file_path)
+    try:
+        if start_offset > 0:
+            input_stream.seek(start_offset)
+        position = start_offset
+        remainder = ""
+        while True:
+            block = input_stream.read(TSV_BLOCK_SIZE)
+            if block == "":
+                text = remainder
+            else:
+                text = remainder + block
+                lines_end = text.rfind("\n") + 1
+                remainder = text[lines_end:]
+                text = text[:lines_end]
+            if (end_offset is not None) and (position + len(text) > end_offset):
+                # Keep only the lines that begin before end_offset.
+                if end_offset <= position:
+                    text = ""
+                else:
+                    newline_index = text.find("\n", end_offset - position - 1)
+                    if newline_index >= 0:
+                        text = text[:newline_index + 1]
+                block = ""
+            if text != "":
+                yield text
+                position += len(text)
+            if block == "":
+                return
+    finally:
+        input_stream.close()
+
+def read_line_blocks(input_file_path, start_offset = 0, end_offset = None):
+    """Generate lists of the lines in the given file, a block at a time.
+    
+    Strip the newline from the end of each line.  Reading a large block at a
+    time and splitting it into lines in one call is faster than reading the
+    file line by line, and lets the caller process a whole list of lines with
+    fast built-in functions.
+    
+    input_file_path, a str, is the file path to a text file, which may be
+    compressed, as in open_safely.
+    start_offset and end_offset, both ints, are the byte offsets that bound the
+    lines generated.  Only lines that begin in the range [start_offset,
+    end_offset) are generated, where start_offset must be the offset of the
+    start of a line.  If end_offset is None, then lines are generated up to the
+    end of the file.  Offsets into a compressed file are offsets into its
+    uncompressed contents.
+    """
+    for text in _read_text_blocks(input_file_path, start_offset, end_offset):
+        lines = text.split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        yield lines
+
+def read_lines(input_file_path, start_offset = 0, end_offset = None):
+    """Generate the lines in the given file without their newlines.
+    
+    The parameters are as in read_line_blocks.
+    """
+    for lines in read_line_blocks(input_file_path, start_offset, end_offset):
+        for line in lines:
+            yield line
+
+def read_tsv(input_file_path):
+    """Generate the rows of the given tab-separated file as lists of strs.
+    
+    Fields are delimited by DELIMITER, and rows are delimited by newlines.
+    
+    input_file_path, a str, is the file path to a tab-separated log file,
+    which may be compressed, as in open_safely.
+    """
+    for lines in read_line_blocks(input_file_path):
+        for line in lines:
+            yield line.split(DELIMITER)
+
+def _parse_ints(text, num_fields):
+    """Return a list of the ints in the given block of tab-separated rows.
+    
+    Raise ValueError unless each of the rows has num_fields int fields.  When
+    NumPy is installed, the whole block is parsed in a single call, which is
+    several times faster than calling int on each field.
+    """
+    num_rows = text.count("\n")
+    if not text.endswith("\n"):
+        num_rows += 1
+    if (numpy is not None) and \
+            (text.count(DELIMITER) == num_rows * (num_fields - 1)) and \
+            (text.translate(None, _INT_TSV_CHARACTERS) == ""):
+        # NumPy skips any whitespace between ints, including both delimiters,
+        # and would read 1.5 as 1, but it silently stops at the first malformed
+        # int.  The count of ints parsed reveals whether it did.
+        values = numpy.fromstring(text, dtype=numpy.int64, sep=" ")
+        if len(values) == num_rows * num_fields:
+            return values.tolist()
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    fields = DELIMITER.join(lines).split(DELIMITER)
+    if len(fields) != num_rows * num_fields:
+        raise ValueError("Expected every row to have %d fields." % num_fields)
+    return map(int, fields)
+
+def read_int_tsv(input_file_path, num_fields, start_offset = 0,
+                 end_offset = None):
+    """Generate the rows of the given tab-separated file as tuples of ints.
+    
+    Parse each block of rows read by read_line_blocks in bulk rather than row
+    by row.  Raise ValueError if a block contains a field that is not an int or
+    the wrong total number of fields.
+    
+    input_file_path, a str, is the file path to a tab-separated log file in
+    which every field is an int, such as a processed Pulse event log file.  It
+    may be compressed, as in open_safely.
+    num_fields, an int, is the number of fields in each row.
+    start_offset and end_offset are as in read_line_blocks.
+    """
+    for text in _read_text_blocks(input_file_path, start_offset, end_offset):
+        values = _parse_ints(text, num_fields)
+        for row in zip(*([iter(values)] * num_fields)):
+            yield row
+
+class TsvWriter(object):
+    """Writes rows of fields to a tab-separated file in large batches.
+    
+    Rows are buffered until TSV_BATCH_SIZE of them have been written, and then
+    formatted with a single format string and written in a single call, which
+    is several times faster than joining and writing each row separately.
+    Fields are converted with str, so they may be strs or ints.  Every row must
+    have the same number of fields.
+    """
+    
+    def __init__(self, output_file_path, num_fields = None,
+                 row_terminator = "\n"):
+        """Create the given file and prepare to write rows to it.
+        
+        output_file_path, a str, is the file path to which to write the rows.
+        The file is compressed if the path ends with a compression extension,
+        as in open_safely.
+        num_fields, an int, is the number of fields in each row.  If None, then
+        it is the number of fields in the first row written.
+        row_terminator, a str, is added after each row.
+        """
+        self._output_stream = open_safely(output_file_path, "w")
+        self._row_terminator = row_terminator
+        self._num_fields = None
+        self._row_format = None
+        self._rows = []
+        self._num_bytes_written = 0
+        if num_fields is not None:
+            self._set_num_fields(num_fields)
+
+    def _set_num_fields(self, num_fields):
+        """Prepare the format of rows with the given number of fields."""
+        self._num_fields = num_fields
+        self._row_format = DELIMITER.join(["%s"] * num_fields) + \
+            self._row_terminator.replace("%", "%%")
+    
+    def _flush_rows(self):
+        """Format and write the buffered rows."""
+        if len(self._rows) == 0:
+            return
+        if self._row_format is None:
+            self._set_num_fields(len(self._rows[0]))
+        row_format = self._row_format
+        try:
+            text = "".join([row_format % tuple(row) for row in self._rows])
+        except TypeError:
+            raise ValueError("Expected every row to have %d fields." %
+                             self._num_fields)
+        self._output_stream.write(text)
+        self._num_bytes_written += len(text)
+        self._rows = []
+    
+    def write_row(self, row):
+        """Write the given row, a sequence of fields."""
+        self._rows.append(row)
+        if len(self._rows) >= TSV_BATCH_SIZE:
+            self._flush_rows()
+    
+    def write_rows(self, rows):
+        """Write each row in the given iterable."""
+        rows = iter(rows)
+        while True:
+            self._rows.extend(islice(rows, TSV_BATCH_SIZE - len(self._rows)))
+            if len(self._rows) < TSV_BATCH_SIZE:
+                return
+            self._flush_rows()
+    
+    def flush(self):
+        """Write the buffered rows without waiting for TSV_BATCH_SIZE of them,
+        so that they reach the file before it is closed.
+        """
+        self._flush_rows()
+    
+    def tell(self):
+        """Write the buffered rows and return the number of bytes written so
+        far, which is the offset at which the next row will begin.  Offsets
+        into a compressed file are offsets into its uncompressed contents, as
+        in read_line_blocks.
+        """
+        self._flush_rows()
+        return self._num_bytes_written
+    
+    def close(self):
+        """Write the remaining rows and close the file."""
+        try:
+            self._flush_rows()
+        finally:
+            self._output_stream.close()
 
 def write_iterable(iterable, output_file_path, delimiter = "\n"):
     """Write the contents of the given iterable to the given output file.
     
     Output elements of the iterable in the order in which they are supplied.
-    Add the given delimiter after each element.
+    Add the given delimiter after each element.  Elements are written in
+    batches by a TsvWriter.
     
-    iterable, a iterable with str elements, is assumed to have contents small
-    enough to fit on the supplied hardware.
+    iterable, a iterable with str or int elements, is assumed to have contents
+    small enough to fit on the supplied hardware.
     output_file_path, a str, is the file path to which to output the iterable.
     delimiter, a str, is added after each element of the outer iterable in the
     output.
     """
-    output_stream = open_safely(output_file_path, "w")
-    for element in iterable:
-        output_stream.write(element + delimiter)
-    output_stream.close()
+    writer = TsvWriter(output_file_path, 1, delimiter)
+    writer.write_rows((element, ) for element in iterable)
+    writer.close()
 
 def write_2d_iterable(iterable, output_file_path, delimiter = "\n"): 
     """Write the contents of the given 2-dimensional iterable to the given file.
     
-    Delimit elements of the inner iterables with DELIMITER.
+    Delimit elements of the inner iterables with DELIMITER.  Rows are written in
+    batches by a TsvWriter.
     
-    iterable is an iterable whose elements are themselves iterables.  These
-    inner iterables' elements are of type str.
+    iterable is an iterable whose elements are themselves sequences of equal
+    length.  These inner sequences' elements are of type str or int.
     delimiter, a str, is added after each element of the outer iterable in the
     output.
     """
-    output_stream = open_safely(output_file_path, "w")
-    for outer_element in iterable:
-        output_stream.write(DELIMITER.join(outer_element) + delimiter)
+    writer = TsvWriter(output_file_path, None, delimiter)
+    writer.write_rows(iterable)
+    writer.close()
+
+class BinaryColumnWriter(object):
+    """Writes a column of ints to a fixed-width binary column file.
+    
+    The file consists of a small header followed by the values as 32-bit
+    little-endian signed ints, so that load_binary_column can map it into
+    memory without parsing it.  Values are buffered and written in blocks, and
+    the number of values is filled into the header when the writer is closed,
+    so columns of unknown length can be streamed to disk.
+    """
+    
+    def __init__(self, output_file_path):
+        """Create the given file and prepare to append values to it.
+        
+        output_file_path, a str, is the file path to which to write the column.
+        """
+        if array("i").itemsize != _BINARY_COLUMN_VALUE_WIDTH:
+            raise ValueError("Binary columns require 4-byte C ints.")
+        self._output_stream = open_safely(output_file_path, "wb")
+        self._buffer = array("i")
+        self._num_values = 0
+        self._write_header()
+    
+    def _write_header(self):
+        """Write the header for the values appended so far at the file start."""
+        self._output_stream.seek(0)
+        self._output_stream.write(_BINARY_COLUMN_HEADER.pack(
+            BINARY_COLUMN_MAGIC, BINARY_COLUMN_VERSION,
+            _BINARY_COLUMN_VALUE_WIDTH, self._num_values))
+    
+    def _flush(self):
+        """Write the buffered values to the end of the file."""
+        if sys.byteorder != "little":
+            self._buffer.byteswap()
+        self._buffer.tofile(self._output_stream)
+        self._num_values += len(self._buffer)
+        self._buffer = array("i")
+    
+    def append(self, value):
+        """Append the given int, which must fit in 32 bits, to the column."""
+        self._buffer.append(value)
+        if len(self._buffer) >= _BINARY_COLUMN_BUFFER_SIZE:
+            self._flush()
+    
+    def close(self):
+        """Flush buffered values, finish the header, and close the file."""
+        self._flush()
+        self._write_header()
+        self._output_stream.close()
+
+def load_binary_column(input_file_path):
+    """Return the column of ints stored in the given binary column file.
+    
+    If NumPy is installed, return a read-only NumPy array of 32-bit ints that
+    is backed directly by a memory map of the file, so loading takes constant
+    time and pages are read from disk only as they are accessed.  Otherwise,
+    return an array('i') read from the file in a single block.  Raise ValueError
+    if the file is not a binary column file written by BinaryColumnWriter.
+    
+    input_file_path, a str, is the file path to a file written by
+    BinaryColumnWriter.
+    """
+    input_stream = open_safely(input_file_path, "rb")
+    try:
+        header = input_stream.read(_BINARY_COLUMN_HEADER.size)
+        if len(header) != _BINARY_COLUMN_HEADER.size:
+            raise ValueError("%s is too short to be a binary column file." %
+                             input_file_path)
+        magic, version, value_width, num_values = \
+            _BINARY_COLUMN_HEADER.unpack(header)
+        if (magic != BINARY_COLUMN_MAGIC) or \
+                (version != BINARY_COLUMN_VERSION) or \
+                (value_width != _BINARY_COLUMN_VALUE_WIDTH):
+            raise ValueError("%s is not a version %d binary column file." %
+                             (input_file_path, BINARY_COLUMN_VERSION))
+        if numpy is not None:
+            column_map = mmap.mmap(input_stream.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            return numpy.frombuffer(column_map, dtype="<i4", count=num_values,
+                                    offset=_BINARY_COLUMN_HEADER.size)
+        column = array("i")
+        column.fromfile(input_stream, num_values)
+        if sys.byteorder != "little":
+            column.byteswap()
+        return column
+    finally:
+        input_stream.close()
+
+def get_peak_rss(who = "self"):
+    """Return the peak resident set size in bytes, or None if it is unknown.
+    
+    who, a str, is "self" for the peak of the calling process or "children"
+    for the largest peak of any of its terminated child processes.
+    """
+    if resource is None:
+        return None
+    if who == "self":
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    else:
+        peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux reports kilobytes, but Mac OS X reports bytes.
+    if sys.platform == "darwin":
+        return peak_rss
+    return peak_rss * 1024
+
+class StageMetrics(object):
+    """Collects machine-readable performance metrics for one stage of a program.
+    
+    The stage's caller fills in the number of rows processed and the number of
+    bytes read and written, and may count any other named quantities, such as
+    the number of rows discarded for each reason.  The stage is timed from the
+    creation of the object until finish is called.
+    """
+    
+    def __init__(self, stage_name):
+        """Start timing the stage with the given name.
+        
+        stage_name, a str, briefly describes the stage, e.g., "clean stories".
+        """
+        self.stage_name = stage_name
+        self.start_time = time.time()
+        self.num_rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.counts = {}
+    
+    def count(self, name, amount = 1):
+        """Add the given amount to the quantity with the given name."""
+        self.counts[name] = self.counts.get(name, 0) + amount
+    
+    def finish(self):
+        """Stop timing the stage and return its metrics record as a dict.
+        
+        The record holds the stage name, the start time in seconds since the
+        Unix epoch, the seconds elapsed, the rows processed and the rate at
+        which they were processed, the bytes read and written, the peak
+        resident set sizes in bytes of the program and of its largest child
+        process so far, and the named counts.
+        """
+        seconds_elapsed = time.time() - self.start_time
+        if seconds_elapsed > 0:
+            rows_per_second = self.num_rows / seconds_elapsed
+        else:
+            rows_per_second = None
+        return {"stage": self.stage_name, "time_started": self.start_time,
+                "seconds_elapsed": seconds_elapsed, "rows": self.num_rows,
+                "rows_per_second": rows_per_second,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "peak_rss": get_peak_rss(),
+                "peak_rss_children": get_peak_rss("children"),
+                "counts": self.counts}
+
+def write_metrics_record(record, output_file_path):
+    """Append the given metrics record to the given file as a line of JSON.
+    
+    record, a dict, is typically returned by StageMetrics.finish.
+    output_file_path, a str, is the file path to the metrics log, which is
+    created if it does not exist.
+    """
+    output_stream = open_safely(output_file_path, "a")
+    output_stream.write(json.dumps(record, sort_keys=True) + "\n")
     output_stream.close()